@@ -0,0 +1,196 @@
+'''Analyze many pcap files in parallel and merge the per-flow results into one report.
+
+Usage:
+    python analysis_pcap_batch.py [-j WORKERS] [--shard-size MB] [-o REPORT] [-q] file.pcap [file.pcap ...]
+
+Every file is one unit of work. A file larger than the shard size is split further by flow:
+its pcap_index (built once, or reused if it is current) gives the file offsets of the
+packets of every flow, the flows are spread over the shards by number of packets, and each
+worker reads and decodes the packets of its own flows only. A flow always lands in exactly
+one shard, so merging the shards is a concatenation.
+
+The indexes are built by the workers too, while the others analyze the files that are not
+split, and the shards of a file are queued as soon as its index is ready. The timing line
+at the end counts the CPU seconds the workers spent indexing and analyzing, and the wall
+time.
+
+The rows are the FlowSummary of analysis_pcap_tcp.TCPMetricsPass, so the retransmissions
+and the other metrics are the same as those of the single file tools.
+'''
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import time
+
+from analysis_pcap_tcp import TCPMetricsPass
+from pcap_core import FlowManager, read_capture
+from pcap_index import PcapIndex
+from pcap_results import FlowSummary, write_records
+
+
+REPORT_FIELDS = ['file'] + [field for field in FlowSummary._fields if field != 'ID']    # IDs are per worker
+
+
+def analyze_shard(task):
+    '''Worker: analyze the flows of one file that fall into one shard
+
+    Args:
+        task (tuple): (path, flow keys of the shard, None for the whole file)
+
+    Return:
+        (tuple) (path, list of report rows, CPU seconds)
+    '''
+    start = time.process_time()
+    path, keys = task
+    flow_manager = FlowManager(keep_packets=False, passes=[TCPMetricsPass()])
+    if keys is None:
+        read_capture(path, flow_manager)
+    else:
+        index = PcapIndex(path, build=False)
+        try:
+            index.load_flows(keys, flow_manager=flow_manager)
+        finally:
+            index.close()
+    flow_manager.close_all()
+
+    rows = []
+    for summary in flow_manager.records[TCPMetricsPass.name]:
+        row = summary._asdict()
+        del row['ID']
+        row['file'] = path
+        rows.append(row)
+    return path, rows, time.process_time() - start
+
+
+def index_file(path):
+    '''Worker: build the index of a file unless it is current
+
+    Return:
+        (tuple) (path, CPU seconds)
+    '''
+    start = time.process_time()
+    PcapIndex(path).close()
+    return path, time.process_time() - start
+
+
+def split_flows(entries, num_shards):
+    '''Spread the flows of a file over shards of about the same number of packets,
+       the largest flow first into the lightest shard
+
+    Args:
+        entries (iterable): pcap_index.FlowEntry
+        num_shards (int)
+
+    Return:
+        (list) a list of flow keys per shard, without the empty shards
+    '''
+    shards = [(0, shard, []) for shard in range(num_shards)]
+    for entry in sorted(entries, key=lambda entry: entry.packets, reverse=True):
+        packets, shard, keys = heapq.heappop(shards)
+        keys.append(entry.key)
+        heapq.heappush(shards, (packets + entry.packets, shard, keys))
+    return [keys for _, _, keys in sorted(shards, key=lambda shard: shard[1]) if keys]
+
+
+def shard_count(path, workers, shard_size):
+    '''Return the number of shards of a file, 1 if it is analyzed whole'''
+    return min(workers, max(1, -(-os.path.getsize(path)//shard_size)))
+
+
+def shard_tasks(path, num_shards):
+    '''Split an indexed file into units of work
+
+    Return:
+        (list) a list of (path, flow keys)
+    '''
+    index = PcapIndex(path, build=False)
+    try:
+        return [(path, keys) for keys in split_flows(index.flows.values(), num_shards)]
+    finally:
+        index.close()
+
+
+def run(paths, workers, shard_size):
+    '''Analyze all the files and merge the per-flow results. The workers build the missing
+       indexes of the files to split first, the largest first, and analyze the other files
+       meanwhile.
+
+    Args:
+        paths (list): pcap file paths
+        workers (int): number of worker processes
+        shard_size (int): files larger than this (in bytes) are split by flow
+
+    Return:
+        (tuple) (report rows sorted by file and flow start time,
+                 { 'index' : CPU seconds, 'analysis' : CPU seconds, 'wall' : seconds })
+    '''
+    start = time.perf_counter()
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    shards = dict((path, shard_count(path, workers, shard_size)) for path in paths)
+    split = [path for path in paths if shards[path] > 1]
+    whole = [(path, None) for path in paths if shards[path] == 1]
+    timings = {'index' : 0.0, 'analysis' : 0.0}
+    results = []
+    if workers == 1:
+        for path in split:
+            timings['index'] += index_file(path)[1]
+            results.extend(analyze_shard(task) for task in shard_tasks(path, shards[path]))
+        results.extend(analyze_shard(task) for task in whole)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            indexed = pool.imap_unordered(index_file, split)          # queued first, the largest files
+            pending = [pool.apply_async(analyze_shard, (task,)) for task in whole]
+            for path, seconds in indexed:
+                timings['index'] += seconds
+                pending.extend(pool.apply_async(analyze_shard, (task,)) for task in shard_tasks(path, shards[path]))
+            results = [result.get() for result in pending]
+    rows = []
+    for _, shard_rows, seconds in results:
+        rows.extend(shard_rows)
+        timings['analysis'] += seconds
+    rows.sort(key=lambda row: (row['file'], row['start'], row['port1'], row['port2']))
+    timings['wall'] = time.perf_counter() - start
+    return rows, timings
+
+
+def print_report(rows):
+    '''Print the per-flow rows followed by a total for every file
+    '''
+    current = None
+    totals = {}
+    for row in rows:
+        if row['file'] != current:
+            current = row['file']
+            print('\n***{}***'.format(current))
+        total = totals.setdefault(current, [0, 0, 0])
+        total[0] += 1
+        total[1] += row['packets']
+        total[2] += row['bytes']
+        print('port1={:<6d} port2={:<6d} packets={:<7d} bytes={:<10d} retransmissions={:<5d} throughput={:1.5f} Mbps'.format(
+              row['port1'], row['port2'], row['packets'], row['bytes'], row['retransmissions'], row['throughput']))
+
+    print('\n***Summary***')
+    for path, (flows, packets, total_bytes) in sorted(totals.items()):
+        print('{}: {} flows  {} packets  {} bytes'.format(path, flows, packets, total_bytes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyze pcap files in parallel')
+    parser.add_argument('pcaps', nargs='+', help='pcap files to analyze')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--shard-size', type=float, default=64, help='split files larger than this many MB by flow')
+    parser.add_argument('-o', '--output', help='also write the merged report as .jsonl, .csv or .parquet')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the report')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('the number of workers must be positive')
+    rows, timings = run(args.pcaps, args.workers, int(args.shard_size*1024*1024))
+    if not args.quiet:
+        print_report(rows)
+    print('\nIndexing {:1.2f} s, analysis {:1.2f} s (CPU), wall {:1.2f} s with {} workers'.format(
+          timings['index'], timings['analysis'], timings['wall'], args.workers))
+    if args.output:
+        write_records([dict((field, row[field]) for field in REPORT_FIELDS) for row in rows], args.output)
@@ -1,140 +1,90 @@
-import dpkt
 import sys
 
-class Packet:
-    '''Encapsulate TCP's header fields of a packet from pcap.
+import pcap_core
+from pcap_core import FlowPass, read_capture
+from http_reassembly import HTTPConnection
+from http_timing import request_timings, PageWaterfall
+from tls_classifier import TLSConnection, classify_capture
+from pcap_results import HTTPFlowRecord, CaptureRecord, write_records
+
+
+def http_flow_record(flow, tls, http):
+    '''Build the Part C record of a flow from its closed TLS and HTTP analyses
+    
+    Args:
+        flow (pcap_core.Flow): the flow
+        tls (TLSConnection): fed with every packet of the flow
+        http (HTTPConnection): fed with every packet of the flow, not used for a TLS flow
+    
+    Return:
+        (HTTPFlowRecord)
+    '''
+    alpn = tls.client.hello.get('alpn')
+    requests = 0 if tls.is_tls() else len(http.transactions)
+    return HTTPFlowRecord(
+        flow=flow.ID, port1=flow.port1, port2=flow.port2, label=tls.label(),
+        tls_version=tls.version(), sni=tls.sni(), alpn_offered=','.join(alpn) if alpn else None,
+        client_records=tls.client.application_records, server_records=tls.server.application_records,
+        requests=requests, packets_from_server=flow.packets_received, bytes_from_server=flow.data_received,
+        first_time=flow.first_time, last_time=flow.last_time)
+
+
+class HTTPAnalysis:
+    '''The TLS scan and the HTTP reassembly of one flow, fed packet by packet
     
     Attributes:
-        source_port (int):  source port number
-        dest_port (int):    destination port number
-        sequence_num (int): sequence number
-        ack_num (int):      acknowledgement number
-        head_len(int):      header length
-        urg (int):          urgent flag
-        ack (int):          acknowledgement flag
-        psh (int):          psh flag
-        rst (int):          reset flag
-        syn (int):          synchronize flag
-        fin (int):          finish flag
-        receive_win (int):  receive window
-        checksum (int):     checksum
-        urgent (int):       urgent data pointer
-        scale (int):        window scaling size
-        size (int):         the size of the whole packet, including data and all headers
-        payload (bytes):    TCP payload
-        payload_len (int):  TCP payload length
+        tls (TLSConnection)
+        http (HTTPConnection)
     '''
+    __slots__ = ('tls', 'http')
     
-    def __init__(self, packet):
-        '''Init a packet
+    def __init__(self, client_port):
+        self.tls  = TLSConnection(client_port)
+        self.http = HTTPConnection(client_port)
         
-        Args:
-            packet(tuple): an element from dpkt.pcap.Reader.readpkts()
-        '''
-        self.time_stamp = packet[0]
-        self.byte_info  = packet[1]
-        self.size = len(packet[1])
-
         
-    def parse_byte_info(self):
-        '''Convert the byte format information of a packet into human readable fields
-        '''
-        self.source_port  = int.from_bytes(self.byte_info[34:36], byteorder='big')
-        self.dest_port    = int.from_bytes(self.byte_info[36:38], byteorder='big')
-        self.sequence_num = int.from_bytes(self.byte_info[38:42], byteorder='big')
-        self.ack_num      = int.from_bytes(self.byte_info[42:46], byteorder='big')
-        head_len          = int.from_bytes(self.byte_info[46:47], byteorder='big')
-        self.head_len     = 4*(head_len>>4)
-        flags             = int.from_bytes(self.byte_info[47:48], byteorder='big')
-        self.fin = flags&1
-        flags = flags>>1
-        self.syn = flags&1
-        flags = flags>>1
-        self.rst = flags&1
-        flags = flags>>1
-        self.psh = flags&1
-        flags = flags>>1
-        self.ack = flags&1
-        flags = flags>>1
-        self.urg = flags&1
-        self.receive_win = int.from_bytes(self.byte_info[48:50], byteorder='big')
-        self.checksum    = int.from_bytes(self.byte_info[50:52], byteorder='big')
-        self.urgent      = int.from_bytes(self.byte_info[52:54], byteorder='big')
-        self.payload     = self.byte_info[34+packet.head_len:]
-        self.payload_len = len(self.payload)
+    def add_packet(self, packet):
+        self.tls.add_packet(packet)
+        self.http.add_packet(packet)
         
         
-    def parse_window_scale(self):
-        '''shift window size is typically 14. so the scaling is 2^14 = 16384
-        '''
-        shift = int.from_bytes(self.byte_info[73:74], byteorder='big')
-        self.scale = 1<<shift
+    def close(self):
+        self.tls.close()
+        self.http.close()
 
-        
-    def __str__(self):
-        string = 'Source Port #  = {}\n'.format(self.source_port)
-        string = string + 'Dest Port #    = {}\n'.format(self.dest_port)
-        string = string + 'Sequence #     = {}\n'.format(self.sequence_num)
-        string = string + 'Ackownledge #  = {}\n'.format(self.ack_num)
-        string = string + 'Header length  = {}\n'.format(self.head_len)
-        string = string + 'URG({}) ACK({}) PSH({})\n'.format(self.urg, self.ack, self.psh)
-        string = string + 'RST({}) SYN({}) FIN({})\n'.format(self.rst, self.syn, self.fin)
-        string = string + 'Receive window = {}\n'.format(self.receive_win)
-        string = string + 'Checksum       = {}\n'.format(self.checksum)
-        string = string + 'Urgent         = {}\n'.format(self.urgent)
-        string = string + 'Payload len    = {}\n'.format(self.payload_len)
-        return string
 
-class Flow:
-    '''Encapsulate a flow of packets from one port of sender to another port of receiver
+class HTTPPass(FlowPass):
+    '''The Part C analysis of every flow as a pass of pcap_core.FlowManager, records are HTTPFlowRecord'''
+    name = 'http'
+    
+    def start(self, flow):
+        return HTTPAnalysis(flow.port1)
+    
+    
+    def finish(self, flow, analyzer, reason):
+        analyzer.close()
+        return http_flow_record(flow, analyzer.tls, analyzer.http)
+
+
+class Flow(pcap_core.Flow):
+    '''Encapsulate a flow of packets from one port of sender to another port of receiver, 
+       with the Part C analyses. The packets and counters are those of pcap_core.Flow.
     
     Attributes:
-        __ID  (int):  private class member identification
-        ID    (int):  identification of a flow
-        port1 (int):  a port number
-        port2 (int):  a port number
-        flow  (list): a list of Packet
         throughput_emp (float): empirical throughput
         rtt (float): round trip time
-        counter (int): count the number of packets in this flow
-        scale (int):   window scaling size
         tda (int):     number of triple duplicate ack occurs
         timeout (int): number of timeout occurs
+        http (HTTPConnection): HTTP requests and responses, set by reassemble_http
+        tls  (TLSConnection):  TLS handshake and application protocol, set by tls_connection
     '''
-    __ID = 100
-    
-    def __init__(self):
-        self.ID    = Flow.__ID
-        Flow.__ID += 1
-        self.port1 = -1
-        self.port2 = -1
-        self.flow  = []
+    
+    def __init__(self, keep_packets=True):
+        pcap_core.Flow.__init__(self, keep_packets)
         self.throughput_emp = -1
         self.rtt     = -1
-        self.counter = 0
-        self.scale   = 1
-        print('init a new flow {}'.format(self.ID))
-        
-    
-    def __str__(self):
-        return 'ID={}  port1={}  port2={}  # of packets={}'.format(self.ID, self.port1, self.port2, self.counter)
-         
-    
-    def set_port(self, packet):
-        self.port1 = packet.source_port
-        self.port2 = packet.dest_port
-        
-    
-    def get_packet(self, index):
-        if index >= 0 and index < len(self.flow):
-            return self.flow[index]
-        else:
-            return None
-        
-    
-    def add_packet(self, packet):
-        self.flow.append(packet)
-        self.counter += 1
+        self.http    = None
+        self.tls     = None
         
 
     def reassemble_http(self):
@@ -142,49 +92,71 @@ class Flow:
            (the other two are encrypted, so you will not be able to reassemble easily). 
            The output of this part should be the Packet type (request or response) and the 
            unique <source, dest, seq, ack> TCP tuple for all the TCP segments that contain data for that request.
+           
+           Both directions are reassembled in one pass and parsed as HTTP/1.x (see http_reassembly), 
+           so out-of-order segments, retransmissions and pipelined requests are handled.
+        
+        Return:
+            (HTTPConnection) the requests and responses of this flow
         '''
-        get_packets = []
-        for packet in self.flow:       # find all the get packets
-            payload = getattr(packet, 'payload')
-            if str(payload).find('GET') != -1:
-                get_packets.append(packet)
+        self.http_connection()
+        for transaction in self.http.transactions:
+            self.print_http_message(transaction.request)
+            if transaction.response:
+                self.print_http_message(transaction.response)
+        return self.http
+    
+    
+    def http_connection(self):
+        '''Reassemble the flow as HTTP once and cache the result
         
-        packet_dict = {}
-        for packet in self.flow:
-            seq = getattr(packet, 'sequence_num')
-            packet_dict[seq] = packet  # the latter packets with the same seq number will replace the former one, which is okay.
-            
-        reassembles = []
+        Return:
+            (HTTPConnection)
+        '''
+        if self.http is None:
+            self.http = HTTPConnection(self.port1)
+            for packet in self.flow:
+                self.http.add_packet(packet)
+            self.http.close()
+        return self.http
+    
+    
+    def tls_connection(self):
+        '''Scan the flow as TLS once and cache the result (see tls_classifier)
         
-        for get in get_packets:
-            reassemble = ReassembleHTTP(get)
-            next_seq = getattr(get, 'ack_num')     # start from the ack of GET request
-            next_packet = packet_dict.get(next_seq)
-            while next_packet:
-                reassemble.add_tcp_segment(next_packet)
-                payload_len = getattr(next_packet, 'payload_len')
-                next_seq = next_seq + payload_len
-                next_packet = packet_dict.get(next_seq)
-                if getattr(next_packet, 'fin') == 1:
-                    break
-            reassembles.append(reassemble)
-            
-        for reassemble in reassembles:
-            reassemble.print_reassembleHTTP()
+        Return:
+            (TLSConnection)
+        '''
+        if self.tls is None:
+            self.tls = TLSConnection(self.port1)
+            for packet in self.flow:
+                self.tls.add_packet(packet)
+            self.tls.close()
+        return self.tls
+    
+    
+    def request_timings(self):
+        '''Return the connect/send/wait/receive timing of every HTTP request of this flow (see http_timing)
+        '''
+        return request_timings(self.ID, self.http_connection())
+    
+    
+    def print_http_message(self, message):
+        print('{0:8s}: {1}'.format(message.kind.capitalize(), message.start_line))
+        print('The TCP segments are below:')
+        for segment in message.segments:
+            print(segment)
             
     
-    def data_from_server(self):
+    def data_from_server(self, verbose=True):
         '''Count amount of data (in bytes) send from server to client
            
         Return:
             (int) the amount of data send from server to client
         '''
-        data_from_server = 0
-        for packet in self.flow:
-            source_port = getattr(packet, 'source_port')
-            if source_port == self.port2:   # packet from server is from port2
-                data_from_server += getattr(packet, 'payload_len')
-        print('Flow {0}: {1:10.0f} byte of data has been send from server to client'.format(self.ID, data_from_server))
+        data_from_server = self.data_received    # packet from server is from port2
+        if verbose:
+            print('Flow {0}: {1:10.0f} byte of data has been send from server to client'.format(self.ID, data_from_server))
         return data_from_server
     
     
@@ -194,12 +166,18 @@ class Flow:
         Return:
             (int) the number of packets
         '''
-        packet_counter = 0
-        for packet in self.flow:
-            source_port = getattr(packet, 'source_port')
-            if source_port == self.port2:
-                packet_counter += 1
-        return packet_counter
+        return self.packets_received
+    
+    
+    def http_record(self):
+        '''Compute the Part C results of this flow without printing anything
+        
+        Return:
+            (HTTPFlowRecord)
+        '''
+        tls = self.tls_connection()
+        http = self.http_connection() if not tls.is_tls() else None
+        return http_flow_record(self, tls, http)
     
     
     def last_packet_time(self):
@@ -221,115 +199,9 @@ class Flow:
         return (timestamp0, timestamp1)
 
 
-class ReassembleHTTP:
-    '''Reassemble the multiply packets of one HTTP Request/Response
-    
-    Attributes:
-        request (str): what this HTTP request for
-        response (str): version and status code
-    '''
-    def __init__(self, get_packet):   # use the request get to init, get only need one packet
-        start = str(get_packet.payload).find('GET')
-        end1 = str(get_packet.payload).find('HTTP')
-        end2 = str(get_packet.payload).find('Connection')
-        end  = end1 if end1 > end2 else end2
-        self.request = str(get_packet.payload)[start:end]
-        self.tcp_segment = []
-        
-        
-    def add_tcp_segment(self, packet):
-        source = getattr(packet, 'source_port')
-        dest   = getattr(packet, 'dest_port')
-        seq    = getattr(packet, 'sequence_num')
-        ack    = getattr(packet, 'ack_num')
-        self.tcp_segment.append((source, dest, seq, ack))
-    
-    
-    def print_reassembleHTTP(self):
-        print(self.request)
-        print('The TCP segments are below:')
-        for segment in self.tcp_segment:
-            print(segment)
-            
-
-class FlowManager:
-    '''Manage some flows
-    
-    Attributes:
-        flow_list (list): an list(array) of Flow
-        flow_info (dict): a dict { ID : (index, port1, port2) }
-    '''
-    
-    def __init__(self):
-        self.flow_list = []
-        self.flow_info = {}
-        
-        
-    def add_packet(self, packet):
-        '''Add a packet to the flow it belongs to. 
-           If the flow does not exit, then create a new one.
-           
-        Args:
-            packet (Packet)
-        '''
-        index = self.where_is_packet(packet)
-        if index == -1:  # this is a "new packet": the packet does not belong to any existed flow
-            new_flow = Flow()
-            new_flow.set_port(packet)
-            new_flow.add_packet(packet)
-            self.add_flow(new_flow)
-        else:            # this packet belongs to an existed flow
-            self.flow_list[index].add_packet(packet)
-    
-    
-    def add_flow(self, flow):
-        '''Add a new flow into FlowManager
-        
-        Args:
-            flow (Flow): a new flow to be added to the flow manager
-        '''
-        index = len(self.flow_list)
-        self.flow_list.append(flow)
-        ID  = getattr(flow, 'ID')
-        port1 = getattr(flow, 'port1')
-        port2 = getattr(flow, 'port2')
-        self.flow_info[ID] = (index, port1, port2)
-        
-    
-    def where_is_packet(self, packet):
-        '''Return the flow's index to which a packet belongs
-        
-        Args:
-            packet (Packet): a packet
-        
-        Return:
-            (int): index 
-        '''
-        source_port = getattr(packet, 'source_port')
-        dest_port = getattr(packet, 'dest_port')
-        for ID, info in self.flow_info.items():
-            if (source_port == info[1] and dest_port == info[2]) or (source_port == info[2] and dest_port == info[1]):
-                return info[0]
-        else:
-            return -1
-        
-    
-    def size(self):
-        return len(self.flow_list)
-    
-    
-    def get_flow(self, ID):
-        '''Get a flow according to its ID
-        
-        Args:
-            flow (Flow): Identification number
-        '''
-        flow_info = self.flow_info.get(ID)
-        if flow_info:
-            index = flow_info[0]
-            return self.flow_list[index]
-        return None
-    
+class FlowManager(pcap_core.FlowManager):
+    '''Manage some flows, see pcap_core.FlowManager, with the Part C reports'''
+    flow_class = Flow
     
     def partC_1(self):
         for flow in self.flow_list:
@@ -337,15 +209,44 @@ class FlowManager:
             print('\n\n')
             
     
-    def partC_2(self):
+    def partC_2(self, verbose=True):
         '''Identify which HTTP protocol is being used for each PCAP file. 
            Note that two of the sites are encrypted so you must use your knowledge of HTTP and TCP to 
            programmatically solve this question. Include the logic behind your code in the write-up.
+           
+           The TLS handshake is not encrypted: the ALPN protocol the server selects in its ServerHello 
+           names the protocol of the connection (see tls_classifier). The capture gets the label that 
+           carried most of its application data. Without any label, fall back to counting the connections 
+           that sent more than a key exchange worth of data.
+        
+        Return:
+            (str) 'http/1.1', 'h2' or 'h2c'
         '''
-        print()
+        if verbose:
+            print()
+        connections = []
+        for flow in self.flow_list:
+            tls = flow.tls_connection()
+            connections.append(tls)
+            if verbose:
+                print('Flow {0}: {1:8s}  version={2}  SNI={3}  ALPN offered={4}  '
+                      'application records client/server = {5}/{6}'.format(
+                      flow.ID, tls.label(), tls.version(), tls.sni(), tls.client.hello.get('alpn'),
+                      tls.client.application_records, tls.server.application_records))
+        
+        label = classify_capture(connections)
+        if label == 'h2' or label == 'h2c':
+            if verbose:
+                print('\nThis is HTTP/2.0: the server selected {} for the connections carrying the website data'.format(label))
+            return label
+        if label == 'http/1.1':
+            if verbose:
+                print('\nThis is HTTP/1.1: no connection carrying the website data negotiated HTTP/2')
+            return label
+        
         flow_server_data = []
         for flow in self.flow_list:
-            flow_server_data.append(flow.data_from_server())
+            flow_server_data.append(flow.data_from_server(verbose))
             
         secure_data = 3500     # typical amount of data for SSL key exchange
         flow_counter = 0       # number of flow that actually send website data, not merely SSL data
@@ -355,6 +256,8 @@ class FlowManager:
             if data > secure_data:
                 flow_counter += 1
         
+        if not verbose:
+            return 'http/1.1' if flow_counter > 1 else 'h2'
         print('\nData from all flows: {}'.format(total_data))
         print('\n{} TCP connection opened on server side to send website data to client.'.format(flow_counter))
         
@@ -362,82 +265,115 @@ class FlowManager:
             print('1 TCP connection opened merely for TLS key exchange')
         if flow_counter > 1:
             print('\nThis is HTTP/1.1 since it uses parallel(multiple) TCP connection to send website data')
+            return 'http/1.1'
         else:
             print('\nThis is HTTP/2.0 since it uses single TCP connection to send website data')
+            return 'h2'
         
         
-    def partC_3(self):
+    def partC_3(self, verbose=True):
         '''Finally, after you’ve labeled the PCAPs with their appropriate versions of HTTP, 
            answer the following: Which version of the protocol did the site load the fastest under? The Slowest? 
            Which sent the most number of packets and raw bytes? Which protocol sent the least? 
            Report your results and write a brief explanation for your observations.
+           
+           When the HTTP traffic can be reassembled, the load time is the span of the request waterfall 
+           (first SYN to last response byte). Encrypted captures fall back to the gap between packets.
+        
+        Return:
+            (tuple) (load time in seconds, number of packets, raw bytes), from the server
         '''
-        smallest_time  = sys.maxsize
-        largest_time   = 0
+        waterfall = self.http_waterfall()
+        if waterfall.timings:
+            smallest_time, largest_time = waterfall.start, waterfall.end
+        else:
+            smallest_time = sys.maxsize
+            largest_time  = 0
+            for flow in self.flow_list:
+                time0, time1 = flow.last_packet_time()
+                smallest_time = time0 if time0 < smallest_time else smallest_time
+                largest_time  = time1 if time1 > largest_time else largest_time
         packet_counter = 0
         byte_counter   = 0
         for flow in self.flow_list:
-            time0, time1 = flow.last_packet_time()
-            smallest_time = time0 if time0 < smallest_time else smallest_time
-            largest_time  = time1 if time1 > largest_time else largest_time
             packet_counter += flow.packet_from_server()
-            byte_counter += flow.data_from_server()
-        print('\nLoad time         = {0:4.4f} s'.format(largest_time - smallest_time))
-        print('Number of packets = {}'.format(packet_counter))
-        print('Raw bytes         = {} byte'.format(byte_counter))
-
-
-f_1080 = open('http_1080.pcap', 'rb')
-pcap_1080 = dpkt.pcap.Reader(f_1080)
-packets_bytes_1080 = pcap_1080.readpkts()
-
-flow_manager_1080 = FlowManager()
-
-packets = []
-for packet_bytes in packets_bytes_1080:
-    packet = Packet(packet_bytes)
-    packet.parse_byte_info()
-    flow_manager_1080.add_packet(packet)
-    packets.append(packet)
-
-
-flow_manager_1080.partC_1()
-
-
-f_1081 = open('http_1081.pcap', 'rb')
-pcap_1081 = dpkt.pcap.Reader(f_1081)
-packets_bytes_1081 = pcap_1081.readpkts()
-
-flow_manager_1081 = FlowManager()
-
-packets = []
-for packet_bytes in packets_bytes_1081:
-    packet = Packet(packet_bytes)
-    packet.parse_byte_info()
-    flow_manager_1081.add_packet(packet)
-    packets.append(packet)
-    
-flow_manager_1081.partC_2()
-
-
-f_1082 = open('http_1082.pcap', 'rb')
-pcap_1082 = dpkt.pcap.Reader(f_1082)
-packets_bytes_1082 = pcap_1082.readpkts()
-
-flow_manager_1082 = FlowManager()
+            byte_counter += flow.data_from_server(verbose)
+        if verbose:
+            print('\nLoad time         = {0:4.4f} s'.format(largest_time - smallest_time))
+            print('Number of packets = {}'.format(packet_counter))
+            print('Raw bytes         = {} byte'.format(byte_counter))
+        return largest_time - smallest_time, packet_counter, byte_counter
+        
+    
+    def http_results(self):
+        '''Return the HTTPFlowRecord of every flow'''
+        return [flow.http_record() for flow in self.flow_list]
+    
+    
+    def capture_record(self):
+        '''Compute the Part C (2) and (3) results of the capture without printing anything
+        
+        Return:
+            (CaptureRecord)
+        '''
+        load_time, packets, raw_bytes = self.partC_3(verbose=False)
+        return CaptureRecord(protocol=self.partC_2(verbose=False), flows=self.size(),
+                             load_time=load_time, packets=packets, bytes=raw_bytes)
+    
+    
+    def write_results(self, path, timings_path=None):
+        '''Write the per-flow Part C records, and optionally the timing of every HTTP request, 
+           as .jsonl, .csv or .parquet (see pcap_results)
+        '''
+        write_records(self.http_results(), path)
+        if timings_path:
+            write_records(self.http_waterfall().timings, timings_path)
+        
+    
+    def http_waterfall(self):
+        '''Put the HTTP requests of all the flows on one time line
+        
+        Return:
+            (PageWaterfall) empty if no flow carries plain HTTP
+        '''
+        timings = []
+        for flow in self.flow_list:
+            timings.extend(flow.request_timings())
+        return PageWaterfall(timings)
+    
+    
+    def partC_waterfall(self):
+        '''Print the per-request timing of the page and what dominates its load time
+        '''
+        waterfall = self.http_waterfall()
+        if not waterfall.timings:
+            print('\nNo plain HTTP request to break down')
+            return
+        print()
+        waterfall.print_waterfall()
+        print('\nSlowest requests:')
+        for timing in waterfall.slowest():
+            print('Flow {0}: {1} took {2:4.4f} s (ttfb {3:4.4f} s, receive {4:4.4f} s, {5:1.3f} Mbps)'.format(
+                  timing.flow, timing.uri, timing.end - timing.start, timing.wait, timing.receive, timing.throughput))
+        print('\nBusiest connections:')
+        for flow, requests, response_bytes, start, end in waterfall.connections()[:5]:
+            print('Flow {0}: {1} requests, {2} byte, busy for {3:4.4f} s'.format(flow, requests, response_bytes, end - start))
 
-packets = []
-for packet_bytes in packets_bytes_1082:
-    packet = Packet(packet_bytes)
-    packet.parse_byte_info()
-    flow_manager_1082.add_packet(packet)
-    packets.append(packet)
-    
-flow_manager_1082.partC_2()
 
+if __name__ == '__main__':
+    flow_manager_1080 = FlowManager()
+    read_capture('http_1080.pcap', flow_manager_1080)
+    flow_manager_1080.partC_1()
 
-flow_manager_1080.partC_3()
-flow_manager_1081.partC_3()
-flow_manager_1082.partC_3()
+    flow_manager_1081 = FlowManager()
+    read_capture('http_1081.pcap', flow_manager_1081)
+    flow_manager_1081.partC_2()
 
+    flow_manager_1082 = FlowManager()
+    read_capture('http_1082.pcap', flow_manager_1082)
+    flow_manager_1082.partC_2()
 
+    flow_manager_1080.partC_3()
+    flow_manager_1080.partC_waterfall()
+    flow_manager_1081.partC_3()
+    flow_manager_1082.partC_3()
@@ -0,0 +1,320 @@
+'''Analyze TCP flows live, from a network interface or from a pcap stream.
+
+Usage:
+    python analysis_pcap_live.py -i eth0 [--interval 5] [--idle-timeout 60] [--max-flows N] [-c COUNT]
+    tcpdump -i eth0 -U -w - | python analysis_pcap_live.py -r -
+    python analysis_pcap_live.py -r capture.pcap
+
+Packets are decoded and fed one at a time to the FlowManager and to streaming estimators
+(tcp_rtt, tcp_retrans) for both directions of every flow. Nothing is stored per packet and
+every step is a dict lookup or a constant amount of work, so the cost of a packet does not
+depend on how many flows or packets came before it.
+
+Every interval (of capture time, so a replayed file reports like a live interface) the
+flows active during the interval are printed with their throughput, loss rate and RTT,
+followed by the final metrics of the flows closed during the interval: finished (FIN/RST),
+idle for longer than the idle timeout, or evicted to stay under the flow limit. On an
+interface the reports and the idle timeouts also run while no packet arrives; a pcap
+stream only moves its clock with its packets.
+'''
+
+import argparse
+import socket
+import struct
+import sys
+import time
+
+import dpkt
+
+import pcap_decoder
+from analysis_pcap_tcp import Packet, FlowManager
+from tcp_retrans import RetransmissionClassifier
+from tcp_rtt import RTTEstimator
+
+
+ETH_P_ALL = 0x0003
+SNAPLEN   = 65535
+TICK      = 0.5      # seconds, the longest wait for a frame before the reports and timeouts run
+SO_TIMESTAMPNS  = getattr(socket, 'SO_TIMESTAMPNS', 35)
+PACKET_OUTGOING = 4
+
+ARPHRD_ETHER    = 1
+ARPHRD_LOOPBACK = 772
+ARPHRD_NONE     = 0xFFFE     # tun devices: raw IP
+HARDWARE_TYPES = {ARPHRD_ETHER: pcap_decoder.DLT_EN10MB, ARPHRD_LOOPBACK: pcap_decoder.DLT_EN10MB,
+                  ARPHRD_NONE: pcap_decoder.DLT_RAW}
+
+_TIMESPEC = struct.Struct('@qq')
+
+
+class InterfaceReader:
+    '''Read the frames of a network interface from a Linux AF_PACKET socket.
+       It is used like dpkt.pcap.Reader: datalink() and iteration over (time stamp, frame).
+       With a timeout, it yields (current time, None) when no frame arrived for that long.
+       Needs root or CAP_NET_RAW.
+
+    Attributes:
+        interface (str): name of the interface
+        sock (socket.socket): the packet socket
+    '''
+
+    def __init__(self, interface, snaplen=SNAPLEN, timeout=None):
+        self.interface = interface
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.bind((interface, ETH_P_ALL))
+            hardware_type = self.sock.getsockname()[3]
+            if hardware_type not in HARDWARE_TYPES:
+                raise ValueError('unsupported hardware type {} of {}'.format(hardware_type, interface))
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)   # kernel receive time
+        except Exception:
+            self.sock.close()
+            raise
+        self.__linktype = HARDWARE_TYPES[hardware_type]
+        self.__loopback = hardware_type == ARPHRD_LOOPBACK
+        self.__buf = bytearray(snaplen)
+
+
+    def datalink(self):
+        return self.__linktype
+
+
+    def __iter__(self):
+        buf = self.__buf
+        view = memoryview(buf)
+        ancillary_size = socket.CMSG_SPACE(_TIMESPEC.size)
+        recvmsg_into = self.sock.recvmsg_into
+        while True:
+            try:
+                length, ancillary, _, address = recvmsg_into([buf], ancillary_size)
+            except socket.timeout:
+                yield time.time(), None
+                continue
+            if self.__loopback and address[2] == PACKET_OUTGOING:
+                continue                                   # lo shows every packet twice
+            time_stamp = None
+            for level, kind, data in ancillary:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+                    time_stamp = seconds + nanoseconds*1e-9
+            yield (time_stamp if time_stamp is not None else time.time()), bytes(view[:length])
+
+
+    def close(self):
+        self.sock.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LiveFlow:
+    '''Streaming metrics of both directions of one flow
+
+    Attributes:
+        flow (Flow): the flow, its packets are not stored
+        directions (dict): { sender port : (RTTEstimator, RetransmissionClassifier) }, 
+                           port1 uses the estimators the flow feeds itself
+        interval_bytes (int): bytes of all packets, headers included, since the last report
+        interval_data (dict): { sender port : payload bytes since the last report }
+        reported (dict): { sender port : (packets sent, losses) at the last report }
+    '''
+    __slots__ = ('flow', 'directions', 'interval_bytes', 'interval_data', 'reported', 'rtt_estimator', 'classifier')
+
+    def __init__(self, flow):
+        self.flow = flow
+        self.rtt_estimator = RTTEstimator(flow.port2, keep_samples=False)
+        self.classifier = RetransmissionClassifier(flow.port2, self.rtt_estimator, keep_retransmissions=False)
+        self.directions = {flow.port1: (flow.rtt_estimator, flow.retrans_classifier),
+                           flow.port2: (self.rtt_estimator, self.classifier)}
+        self.interval_data = {flow.port1: 0, flow.port2: 0}
+        self.reported = {flow.port1: (0, 0), flow.port2: (0, 0)}
+        self.interval_bytes = 0
+
+
+    def add_packet(self, packet):
+        self.interval_bytes += packet.size
+        if packet.source_port in self.interval_data:
+            self.interval_data[packet.source_port] += packet.payload_len
+        self.rtt_estimator.add_packet(packet)
+        self.classifier.add_packet(packet)
+
+
+    def take_interval(self, interval):
+        '''Return the metrics since the last report and start a new interval.
+           Loss and RTT are those of the direction that sent more data during the interval.
+
+        Args:
+            interval (float): length of the interval in seconds
+
+        Return:
+            (tuple) (sender port, throughput in Mbps, loss rate, SRTT in seconds or -1)
+        '''
+        sender = max(self.interval_data, key=lambda port: (self.interval_data[port], port == self.flow.port1))
+        rtt_estimator, classifier = self.directions[sender]
+        packets_sent, losses = classifier.packets_sent, classifier.losses()
+        last_sent, last_losses = self.reported[sender]
+        sent = packets_sent - last_sent
+        loss_rate = (losses - last_losses)*1.0/sent if sent else 0.0
+        throughput = self.interval_bytes*8.0/(interval*1000000) if interval > 0 else 0.0
+        for port, (_, port_classifier) in self.directions.items():
+            self.reported[port] = (port_classifier.packets_sent, port_classifier.losses())
+            self.interval_data[port] = 0
+        self.interval_bytes = 0
+        return sender, throughput, loss_rate, rtt_estimator.srtt
+
+
+class LiveMonitor:
+    '''Keep the flows of a packet stream up to date and report them every interval
+
+    Attributes:
+        flow_manager (FlowManager): the tracked flows, without their packets
+        interval (float): seconds between two reports
+        live (dict): { Flow.ID : LiveFlow } of every tracked flow
+        active (dict): { Flow.ID : LiveFlow } of the flows with a packet since the last report
+        closed (list): FlowSummary of the flows closed since the last report
+        packets (int): number of TCP packets seen
+    '''
+
+    def __init__(self, interval=5.0, idle_timeout=60.0, max_flows=None):
+        self.flow_manager = FlowManager(keep_packets=False, idle_timeout=idle_timeout, max_flows=max_flows,
+                                        close_finished=True, on_close=self.__flow_closed)
+        self.interval = interval
+        self.live = {}
+        self.active = {}
+        self.closed = []
+        self.packets = 0
+        self.__start = None
+        self.__last_report = None
+
+
+    def add_packet(self, packet):
+        '''Feed the next parsed packet, in capture order'''
+        self.tick(packet.time_stamp)
+        self.packets += 1
+        flow = self.flow_manager.add_packet(packet)
+        if flow.ID not in self.flow_manager.flow_info:
+            return                                      # closed by this very packet
+        live = self.live.get(flow.ID)
+        if live is None:
+            live = LiveFlow(flow)
+            self.live[flow.ID] = live
+        live.add_packet(packet)
+        self.active[flow.ID] = live
+
+
+    def tick(self, now):
+        '''Advance the clock: report if the interval is over and close the idle flows
+
+        Args:
+            now (float): the time stamp of the next packet, or the current time without one
+        '''
+        if self.__last_report is None:
+            self.__start = now
+            self.__last_report = now
+            return
+        if now - self.__last_report >= self.interval:
+            self.report(now)
+        if self.flow_manager.idle_timeout is not None:
+            self.flow_manager.expire(now, self.flow_manager.idle_timeout)
+
+
+    def __flow_closed(self, summary):
+        self.live.pop(summary.ID, None)
+        self.active.pop(summary.ID, None)
+        self.closed.append(summary)
+
+
+    def report(self, now):
+        '''Print the flows active since the last report and the flows closed since then
+
+        Args:
+            now (float): time stamp that ends the interval
+        '''
+        interval = now - self.__last_report
+        closed = ', '.join('{} {}'.format(count, reason) for reason, count in sorted(self.flow_manager.closed.items()))
+        print('\n[{0:10.3f} s] {1} active / {2} tracked flows, {3} packets, closed: {4}'.format(
+              now - self.__start, len(self.active), self.flow_manager.size(), self.packets, closed or 'none'))
+        if self.active:
+            print('{0:>6s}  {1:47s} {2:>10s} {3:>9s} {4:>10s}'.format('flow', 'sender --> receiver', 'Mbps', 'loss', 'srtt (ms)'))
+        for ID, live in self.active.items():
+            sender, throughput, loss_rate, srtt = live.take_interval(interval)
+            flow = live.flow
+            receiver = flow.port2 if sender == flow.port1 else flow.port1
+            key = self.flow_manager.flow_info[ID][0]
+            endpoints = dict((port, ip) for ip, port in key)
+            path = '{}:{} --> {}:{}'.format(pcap_decoder.ip_to_str(endpoints[sender]), sender,
+                                             pcap_decoder.ip_to_str(endpoints[receiver]), receiver)
+            print('{0:6d}  {1:47s} {2:10.4f} {3:9.6f} {4:>10s}'.format(
+                  ID, path, throughput, loss_rate, _milliseconds(srtt)))
+        if self.closed:
+            print('{0:>6s}  {1:7s} {2:>11s} {3:>9s} {4:>12s} {5:>10s} {6:>9s} {7:>10s}'.format(
+                  'closed', 'reason', 'port1/port2', 'packets', 'bytes', 'Mbps', 'loss', 'rtt (ms)'))
+        for summary in self.closed:
+            print('{0:6d}  {1:7s} {2:>11s} {3:9d} {4:12d} {5:10.4f} {6:9.6f} {7:>10s}'.format(
+                  summary.ID, summary.reason, '{}/{}'.format(summary.port1, summary.port2), summary.packets,
+                  summary.bytes, summary.throughput, summary.loss_rate, _milliseconds(summary.rtt)))
+        self.active = {}
+        self.closed = []
+        self.__last_report = now
+
+
+def _milliseconds(seconds):
+    return '{:.3f}'.format(seconds*1000) if seconds >= 0 else '-'
+
+
+def run(reader, monitor, count=None):
+    '''Feed the TCP packets of a reader to a monitor until the stream ends, count packets or Ctrl-C
+
+    Args:
+        reader: dpkt.pcap.Reader or InterfaceReader, a frame None only advances the clock
+        monitor (LiveMonitor)
+        count (int): stop after this many TCP packets, None to run until the end
+    '''
+    linktype = reader.datalink()
+    now = None
+    try:
+        for packet_bytes in reader:
+            if packet_bytes[1] is None:
+                now = packet_bytes[0]
+                monitor.tick(now)
+                continue
+            packet = Packet(packet_bytes)
+            if not packet.parse_byte_info(linktype):
+                continue
+            now = packet.time_stamp
+            monitor.add_packet(packet)
+            if count is not None and monitor.packets >= count:
+                break
+    except KeyboardInterrupt:
+        pass
+    if now is not None:
+        monitor.flow_manager.close_all()
+        monitor.report(now)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report TCP throughput, loss and RTT per flow while capturing')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--interface', help='capture on this interface (AF_PACKET, needs CAP_NET_RAW)')
+    source.add_argument('-r', '--read', metavar='PCAP', help="read a pcap file, '-' for a stream on stdin")
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between reports (default 5)')
+    parser.add_argument('--idle-timeout', type=float, default=60.0, help='close a flow idle for this many seconds (default 60)')
+    parser.add_argument('--max-flows', type=int, help='track at most this many flows, evicting the least recently active')
+    parser.add_argument('-c', '--count', type=int, help='stop after this many TCP packets')
+    args = parser.parse_args()
+
+    monitor = LiveMonitor(args.interval, args.idle_timeout, args.max_flows)
+    if args.interface:
+        with InterfaceReader(args.interface, timeout=min(TICK, args.interval)) as reader:
+            run(reader, monitor, args.count)
+    elif args.read == '-':
+        run(dpkt.pcap.Reader(sys.stdin.buffer), monitor, args.count)
+    else:
+        with open(args.read, 'rb') as f:
+            run(dpkt.pcap.Reader(f), monitor, args.count)
@@ -1,145 +1,150 @@
 import dpkt
 import math
-import pandas as pd
-import matplotlib.pyplot as plt
+import os
 
+import pcap_core
+from pcap_core import Packet, FlowPass
+from tcp_rtt import RTTEstimator
+from tcp_cwnd import CwndEstimator, PHASES
+from tcp_retrans import RetransmissionClassifier, FAST_RETRANSMIT, RTO, SPURIOUS, TAIL_LOSS_PROBE
+from tcp_fairness import FairnessAnalysis, flow_samples, FAIR_INDEX
+from pcap_results import TransactionRecord, FlowSummary, write_records
 
-class Packet:
-    '''Encapsulate TCP's header fields of a packet from pcap.
+
+def theoretical_throughput(rtt, loss_rate, mss=1460):
+    '''The throughput formula derived in class, sqrt(3/2)*MSS/(RTT*sqrt(p))
+    
+    Return:
+        (float) bits per second, None if the RTT or the loss rate is not positive
+    '''
+    if rtt <= 0 or loss_rate <= 0:
+        return None
+    return (math.sqrt(3/2)*mss*8)/(rtt*math.sqrt(loss_rate))
+
+
+def flow_summary(flow, classifier, reason=None):
+    '''Compute the final metrics of a flow from its counters and its retransmission classifier
+    
+    Args:
+        flow (pcap_core.Flow): the flow
+        classifier (RetransmissionClassifier): fed with every packet of the flow, with an RTTEstimator
+        reason (str): why the flow is summarized, one of the CLOSE_ reasons
+    
+    Return:
+        (FlowSummary)
+    '''
+    rtt_estimator = classifier.rtt_estimator
+    duration = flow.last_time - flow.first_time if flow.counter else 0.0
+    throughput = flow.bytes*8.0/(duration*1000000) if duration > 0 else 0.0
+    losses = classifier.losses()
+    loss_rate = losses*1.0/classifier.packets_sent if classifier.packets_sent else 0.0
+    rtt = rtt_estimator.mean()
+    throughput_the = theoretical_throughput(rtt, loss_rate)
+    counts = classifier.counts
+    return FlowSummary(
+        ID=flow.ID, port1=flow.port1, port2=flow.port2,
+        start=flow.first_time, end=flow.last_time, duration=duration,
+        packets=flow.counter, bytes=flow.bytes, throughput=throughput,
+        data_sent=flow.data_sent, data_received=flow.data_received, packets_sent=classifier.packets_sent,
+        retransmissions=classifier.total(), losses=losses, loss_rate=loss_rate,
+        fast_retransmits=counts[FAST_RETRANSMIT], timeouts=counts[RTO],
+        tail_loss_probes=counts[TAIL_LOSS_PROBE], spurious=counts[SPURIOUS],
+        rtt=rtt, srtt=rtt_estimator.srtt, min_rtt=rtt_estimator.min_rtt, rtt_samples=rtt_estimator.sample_count,
+        theoretical_throughput=throughput_the/1000000 if throughput_the is not None else None,
+        reason=reason)
+
+
+class StreamingMetrics:
+    '''The RTT estimator and retransmission classifier of the sender (port1) of a flow, 
+       fed packet by packet instead of from the stored packets
     
     Attributes:
-        source_port (int):  source port number
-        dest_port (int):    destination port number
-        sequence_num (int): sequence number
-        ack_num (int):      acknowledgement number
-        head_len(int):      header length
-        urg (int):          urgent flag
-        ack (int):          acknowledgement flag
-        psh (int):          psh flag
-        rst (int):          reset flag
-        syn (int):          synchronize flag
-        fin (int):          finish flag
-        receive_win (int):  receive window
-        checksum (int):     checksum
-        urgent (int):       urgent data pointer
-        scale (int):        window scaling size
-        size (int):         the size of the whole packet, including data and all headers
-        payload (int):      TCP payload
+        rtt_estimator (RTTEstimator)
+        classifier (RetransmissionClassifier)
     '''
+    __slots__ = ('rtt_estimator', 'classifier')
     
-    def __init__(self, packet):
-        '''Init a packet
+    def __init__(self, sender_port):
+        self.rtt_estimator = RTTEstimator(sender_port, keep_samples=False)
+        self.classifier = RetransmissionClassifier(sender_port, self.rtt_estimator, keep_retransmissions=False)
         
-        Args:
-            packet(tuple): an element from dpkt.pcap.Reader.readpkts()
-        '''
-        self.time_stamp = packet[0]
-        self.byte_info  = packet[1]
-        self.size = len(packet[1])
-
         
-    def parse_byte_info(self):
-        '''Convert the byte format information of a packet into human readable fields
-        '''
-        self.source_port  = int.from_bytes(self.byte_info[34:36], byteorder='big')
-        self.dest_port    = int.from_bytes(self.byte_info[36:38], byteorder='big')
-        self.sequence_num = int.from_bytes(self.byte_info[38:42], byteorder='big')
-        self.ack_num      = int.from_bytes(self.byte_info[42:46], byteorder='big')
-        head_len          = int.from_bytes(self.byte_info[46:47], byteorder='big')
-        self.head_len     = 4*(head_len>>4)
-        flags             = int.from_bytes(self.byte_info[47:48], byteorder='big')
-        self.fin = flags&1
-        flags = flags>>1
-        self.syn = flags&1
-        flags = flags>>1
-        self.rst = flags&1
-        flags = flags>>1
-        self.psh = flags&1
-        flags = flags>>1
-        self.ack = flags&1
-        flags = flags>>1
-        self.urg = flags&1
-        self.receive_win = int.from_bytes(self.byte_info[48:50], byteorder='big')
-        self.checksum    = int.from_bytes(self.byte_info[50:52], byteorder='big')
-        self.urgent      = int.from_bytes(self.byte_info[52:54], byteorder='big')
-        self.payload     = len(self.byte_info[34+packet.head_len:])
-        
-        
-    def parse_window_scale(self):
-        '''shift window size is typically 14. so the scaling is 2^14 = 16384
-        '''
-        shift = int.from_bytes(self.byte_info[73:74], byteorder='big')
-        self.scale = 1<<shift
+    def add_packet(self, packet):
+        self.rtt_estimator.add_packet(packet)
+        self.classifier.add_packet(packet)
 
-        
-    def __str__(self):
-        string = 'Source Port #  = {}\n'.format(self.source_port)
-        string = string + 'Dest Port #    = {}\n'.format(self.dest_port)
-        string = string + 'Sequence #     = {}\n'.format(self.sequence_num)
-        string = string + 'Ackownledge #  = {}\n'.format(self.ack_num)
-        string = string + 'Header length  = {}\n'.format(self.head_len)
-        string = string + 'URG({}) ACK({}) PSH({})\n'.format(self.urg, self.ack, self.psh)
-        string = string + 'RST({}) SYN({}) FIN({})\n'.format(self.rst, self.syn, self.fin)
-        string = string + 'Receive window = {}\n'.format(self.receive_win)
-        string = string + 'Checksum       = {}\n'.format(self.checksum)
-        string = string + 'Urgent         = {}\n'.format(self.urgent)
-        return string
+
+class TCPMetricsPass(FlowPass):
+    '''The Part A/B metrics of every flow as a pass of pcap_core.FlowManager, records are FlowSummary'''
+    name = 'tcp'
+    
+    def start(self, flow):
+        return StreamingMetrics(flow.port1)
+    
+    
+    def finish(self, flow, analyzer, reason):
+        return flow_summary(flow, analyzer.classifier, reason)
 
 
-class Flow:
-    '''Encapsulate a flow of packets from one port of sender to another port of receiver
+class Flow(pcap_core.Flow):
+    '''Encapsulate a flow of packets from one port of sender to another port of receiver, 
+       with the Part A/B analyses. The packets and counters are those of pcap_core.Flow.
     
     Attributes:
-        __ID  (int):  private class member identification
-        ID    (int):  identification of a flow
-        port1 (int):  a port number
-        port2 (int):  a port number
-        flow  (list): a list of Packet
         loss_rate (float)
         throughput_emp (float): empirical throughput
         throughput_the (float): theoretical throuhput
-        rtt (float): round trip time
-        counter (int): count the number of packets in this flow
-        scale (int):   window scaling size
+        rtt (float): round trip time, the average of the RTT samples
+        rtt_estimator (RTTEstimator): RTT time series, min RTT, SRTT and RTTVAR, set by estimateRTT
+        cwnd_estimator (CwndEstimator): congestion window series, set by estimate_cwnd
         tda (int):     number of triple duplicate ack occurs
         timeout (int): number of timeout occurs
+        retrans_classifier (RetransmissionClassifier): every retransmission and its cause
+        keep_packets (bool): store the packets in flow. If False, the packets are only counted 
+                             and fed to a streaming retrans_classifier and rtt_estimator
     '''
-    __ID = 100
     
-    def __init__(self):
-        self.ID    = Flow.__ID
-        Flow.__ID += 1
-        self.port1 = -1
-        self.port2 = -1
-        self.flow  = []
+    def __init__(self, keep_packets=True):
+        pcap_core.Flow.__init__(self, keep_packets)
         self.loss_rate      = -1
         self.throughput_emp = -1
         self.throughput_the = -1
         self.rtt     = -1
-        self.counter = 0
-        self.scale   = 1
-        print('init a new flow {}'.format(self.ID))
-        
-    
-    def __str__(self):
-        return 'ID={}  port1={}  port2={}  # of packets={}'.format(self.ID, self.port1, self.port2, self.counter)
-         
-    
-    def set_port(self, packet):
-        self.port1 = packet.source_port
-        self.port2 = packet.dest_port
+        self.rtt_estimator  = None
+        self.cwnd_estimator = None
+        self.retrans_classifier = None
+        self.__classified = 0      # number of packets the classifier has seen
         
-    
-    def get_packet(self, index):
-        if index >= 0 and index < len(self.flow):
-            return self.flow[index]
-        else:
-            return None
         
-    
     def add_packet(self, packet):
-        self.flow.append(packet)
-        self.counter += 1
+        if not self.keep_packets:
+            if self.retrans_classifier is None:
+                self.rtt_estimator = RTTEstimator(self.port1, keep_samples=False)
+                self.retrans_classifier = RetransmissionClassifier(self.port1, self.rtt_estimator, keep_retransmissions=False)
+            self.rtt_estimator.add_packet(packet)
+            self.retrans_classifier.add_packet(packet)
+        pcap_core.Flow.add_packet(self, packet)
+        
+        
+    def release(self):
+        '''Drop the stored packets and the cached analyses, keep the counters'''
+        pcap_core.Flow.release(self)
+        self.rtt_estimator = None
+        self.retrans_classifier = None
+        self.cwnd_estimator = None
+        self.__classified = 0
+        
+        
+    def summary(self, reason=None):
+        '''Compute the final metrics of the flow without printing anything
+        
+        Args:
+            reason (str): why the flow is summarized, one of the CLOSE_ reasons
+        
+        Return:
+            (FlowSummary)
+        '''
+        return flow_summary(self, self.classify_retransmissions(), reason)
         
         
     def check_three_handshake(self):
@@ -181,285 +186,229 @@ class Flow:
         return index
     
     
+    def first_2_transactions(self):
+        '''The first 2 transactions after the TCP connection is set up: a segment from sender to receiver 
+           and the packet that acknowledges it
+        
+        Return:
+            (list) two TransactionRecord, empty if a segment is never acknowledged
+        '''
+        index = self.check_three_handshake()
+        records = []
+        for number, sender in enumerate(self.flow[index:index+2], 1):
+            expected_ack = getattr(sender, 'sequence_num') + sender.payload_len
+            receiver = None
+            for packet in self.flow:
+                if getattr(packet, 'ack_num') == expected_ack:
+                    receiver = packet
+                    break
+            if receiver is None:
+                return []
+            records.append(TransactionRecord(
+                flow=self.ID, index=number,
+                sender_seq=sender.sequence_num, sender_ack=sender.ack_num, sender_window=sender.receive_win,
+                receiver_seq=receiver.sequence_num, receiver_ack=receiver.ack_num, receiver_window=receiver.receive_win,
+                scale=self.scale))
+        return records if len(records) == 2 else []
+    
+    
     def print_first_2_transaction(self): 
         '''Part A (a): For the first 2 transactions after the TCP connection is set up 
            (from sender to receiver), get the values of the Sequence number, Ack number, 
            and Receive Window size. Explain these values.
-        ''' 
-        index = self.check_three_handshake()
-        sender_1 = self.flow[index]
-        sender_2 = self.flow[index+1]
-        payload_1 = getattr(sender_1, 'payload')
-        payload_2 = getattr(sender_2, 'payload')
-        seq_1     = getattr(sender_1, 'sequence_num')
-        seq_2     = getattr(sender_2, 'sequence_num')
-        ack_1     = seq_1 + payload_1
-        ack_2     = seq_2 + payload_2
-        receiver_1 = None
-        receiver_2 = None
         
-        for packet in self.flow:
-            ack = getattr(packet, 'ack_num')
-            if ack == ack_1:
-                receiver_1 = packet
-                break
-                
-        for packet in self.flow:
-            ack = getattr(packet, 'ack_num')
-            if ack == ack_2:
-                receiver_2 = packet
-                break
-        
-        if receiver_1 == None or receiver_2 == None:
+        Return:
+            (list) TransactionRecord, see first_2_transactions
+        ''' 
+        records = self.first_2_transactions()
+        if not records:
             print('Error!')
-            return
+            return records
         
         print('\n\n***Flow {}***'.format(self.ID))
-        print('\nTransaction 1:')
-        seq1 = getattr(sender_1, 'sequence_num')
-        ack1 = getattr(sender_1, 'ack_num')
-        rec1 = getattr(sender_1, 'receive_win')
-        seq2 = getattr(receiver_1, 'sequence_num')
-        ack2 = getattr(receiver_1, 'ack_num')
-        rec2 = getattr(receiver_1, 'receive_win')
-        print('Sender:  sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq1, ack1, rec1))
-        print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq1, ack1, rec1, self.scale))
-        print('\nReceiver: sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq2, ack2, rec2))
-        print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq2, ack2, rec2, self.scale)) 
-        
-        print('\nTransaction 2:')
-        seq1 = getattr(sender_2, 'sequence_num')
-        ack1 = getattr(sender_2, 'ack_num')
-        rec1 = getattr(sender_2, 'receive_win')
-        seq2 = getattr(receiver_2, 'sequence_num')
-        ack2 = getattr(receiver_2, 'ack_num')
-        rec2 = getattr(receiver_2, 'receive_win')
-        print('Sender:  sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq1, ack1, rec1))
-        print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq1, ack1, rec1, self.scale))
-        print('\nReceiver: sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq2, ack2, rec2))
-        print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq2, ack2, rec2, self.scale)) 
+        for record in records:
+            print('\nTransaction {}:'.format(record.index))
+            seq1, ack1, rec1 = record.sender_seq, record.sender_ack, record.sender_window
+            seq2, ack2, rec2 = record.receiver_seq, record.receiver_ack, record.receiver_window
+            print('Sender:  sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq1, ack1, rec1))
+            print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq1, ack1, rec1, self.scale))
+            print('\nReceiver: sequence # = {}  acknowledge # = {}  receive window = {}'.format(seq2, ack2, rec2))
+            print('I just a sent some data to you, starting at the ({0})th byte. \nThe next btye I anticipate to receive from you starts at the ({1})th byte. \nMy receive window size is {2} times {3}.'.format(seq2, ack2, rec2, self.scale)) 
+        return records
       
         
-    def compute_throughput(self):
+    def compute_throughput(self, verbose=True):
         '''Compute the throughput for data sent from source to destination. 
            To estimate throughput count all data and headers. You need to 
            figure out how to define throughput in terms of what you are including as part of the throughput estimation.
+        
+        Return:
+            (float) Mbps
         '''
-        total_data = 0
-        for packet in self.flow:
-            total_data += getattr(packet, 'size')
-            
-        start = getattr(self.flow[0], 'time_stamp')
-        end   = getattr(self.flow[self.counter-1], 'time_stamp')
-        elapse = end - start
-        self.throughput_emp = (total_data*8.0)/(elapse*1000000)
-        print('***Flow {}***'.format(self.ID))
-        print('Throughput is {0:1.5f} Mbps\n'.format(self.throughput_emp))
+        elapse = self.last_time - self.first_time
+        self.throughput_emp = (self.bytes*8.0)/(elapse*1000000) if elapse > 0 else 0.0
+        if verbose:
+            print('***Flow {}***'.format(self.ID))
+            print('Throughput is {0:1.5f} Mbps\n'.format(self.throughput_emp))
+        return self.throughput_emp
         
         
-    def compute_loss_rate(self):
-        '''Compute the loss rate for each flow. 
-           Loss rate is the number of packets not received divided by the number of packets sent.
+    def classify_retransmissions(self):
+        '''Classify every retransmission from sender to receiver in one pass over the flow (see tcp_retrans).
+           The result is cached, both the loss rate and the triple duplicate ack/timeout counts use it.
+        
+        Return:
+            (RetransmissionClassifier)
         '''
-        seq_counter = {}
-        for packet in self.flow:
-            seq = getattr(packet, 'sequence_num')
-            source_port = getattr(packet, 'source_port')  # packet's source port
-            sender_port = self.port1                      # flow's sender
-            if seq_counter.get(seq) and source_port == sender_port:
-                seq_counter[seq] = seq_counter[seq] + 1
-                #print(seq, seq_counter[seq])
-            else:
-                seq_counter[seq] = 1
-                
-        total_send = 0
-        for counter in seq_counter.values():
-            total_send += counter
-        retransmission = total_send - len(seq_counter) - 1 
-        print('***Flow {}***'.format(self.ID))
-        print('# of loss is {}'.format(retransmission))
-        print('# of packets send is {}'.format(len(self.flow)))
-        self.loss_rate = retransmission*1.0/len(self.flow)
-        print('Therefore, the loss rate is {0:1.6f}\n'.format(self.loss_rate))
+        if not self.keep_packets and self.retrans_classifier is not None:
+            return self.retrans_classifier             # fed packet by packet
+        if self.retrans_classifier is None or self.__classified != self.counter:
+            self.retrans_classifier = RetransmissionClassifier(self.port1)
+            for packet in self.flow:
+                self.retrans_classifier.add_packet(packet)
+            self.__classified = self.counter
+        return self.retrans_classifier
         
         
-    def estimateRTT(self):
+    def compute_loss_rate(self, verbose=True):
+        '''Compute the loss rate for each flow. 
+           Loss rate is the number of packets not received divided by the number of packets sent.
+           Only the packets from sender to receiver count, and spurious retransmissions are not losses.
+        
+        Return:
+            (float) loss rate
+        '''
+        classifier = self.classify_retransmissions()
+        retransmission = classifier.losses()
+        self.loss_rate = retransmission*1.0/classifier.packets_sent if classifier.packets_sent else 0
+        if verbose:
+            print('***Flow {}***'.format(self.ID))
+            print('# of loss is {}'.format(retransmission))
+            print('# of packets send is {}'.format(classifier.packets_sent))
+            print('Therefore, the loss rate is {0:1.6f}\n'.format(self.loss_rate))
+        return self.loss_rate
+        
+        
+    def estimateRTT(self, verbose=True):
         '''Estimate the average RTT. Now compare your empirical throughput from (b) 
            and the theoretical throughput (estimated using the formula derived in class). Explain your comparison.
+           
+           The RTT samples come from TCP timestamps when the flow has them, otherwise from ACKs 
+           matching the end of a segment that was sent only once (Karn's rule), see tcp_rtt.
+        
+        Return:
+            (float) the average RTT in seconds, -1 without a sample
         '''
-        payload = 1448       # 1448 byte is the max amount of payload in a TCP segment
-        sender_dic = {}      # stony brook  {seq --> packet}
-        sender_dic_ret = {}  # packets that are retransmitted
-        receiver_dic = {}    # washington   {ack --> packet}
-        for packet in self.flow:
-            source_port = getattr(packet, 'source_port')
-            if source_port == self.port1:  # sender --> receiver
-                seq = getattr(packet, 'sequence_num')
-                if sender_dic.get(seq):    # retransmmision packets appear twice
-                    sender_dic_ret[seq] = packet
-                else:
-                    sender_dic[seq] = packet
-            else:                          # receiver --> sender
-                ack = getattr(packet, 'ack_num')
-                receiver_dic[ack] = packet
+        if self.keep_packets or self.rtt_estimator is None:
+            self.rtt_estimator = RTTEstimator(self.port1)   # measure the data from sender to receiver
+            for packet in self.flow:
+                self.rtt_estimator.add_packet(packet)
+        self.rtt = self.rtt_estimator.mean()
+        throughput_the = theoretical_throughput(self.rtt, self.loss_rate)
+        if throughput_the is not None:
+            self.throughput_the = throughput_the
+        if not verbose:
+            return self.rtt
         
-        for key in sender_dic_ret:  # when esitmating RTT, we do not consider the retransmission case
-            sender_dic.pop(key)
-            
-        total_time = 0
-        counter = 0
-        for ack, ack_packet in receiver_dic.items():
-            seq = ack - payload
-            seq_packet = sender_dic.get(seq)
-            if seq_packet:
-                time2 = getattr(ack_packet, 'time_stamp')
-                time1 = getattr(seq_packet, 'time_stamp')
-                total_time += (time2 - time1)
-                counter += 1
-        self.rtt = total_time/counter
         print('***Flow {}***'.format(self.ID))
-        print('Estimated RTT is {0:1.5f} second'.format(self.rtt))
-        try:
-            self.throughput_the = (math.sqrt(3/2)*1460*8)/(self.rtt*math.sqrt(self.loss_rate))
-            print('Theoretical throughput is {0:1.5f} Mbps\n'.format(self.throughput_the/1000000))
-        except ZeroDivisionError as ze:
+        if self.rtt < 0:
+            print('No RTT sample in this flow\n')
+            return self.rtt
+        print('Estimated RTT is {0:1.5f} second ({1} samples)'.format(self.rtt, self.rtt_estimator.sample_count))
+        print('min RTT = {0:1.5f}  SRTT = {1:1.5f}  RTTVAR = {2:1.5f}'.format(
+              self.rtt_estimator.min_rtt, self.rtt_estimator.srtt, self.rtt_estimator.rttvar))
+        if throughput_the is None:
             print('Theoretical throughput is infinity')
-        except Exception as e:
-            print(e)
+        else:
+            print('Theoretical throughput is {0:1.5f} Mbps\n'.format(self.throughput_the/1000000))
+        return self.rtt
             
             
          
-    def compute_dta_timeout(self):
+    def estimate_cwnd(self, first=10, export=None, verbose=True):
+        '''Part B (1): Estimate the congestion window size per RTT from the sender's sequence numbers 
+           and the receiver's ACKs, and label each window with the phase of the sender (see tcp_cwnd).
+        
+        Args:
+            first (int): print the first few congestion windows
+            export (str): also write the whole series to this .csv, .npy or .parquet file
+        
+        Return:
+            (list) the series of tcp_cwnd.CwndEstimator
+        '''
+        self.cwnd_estimator = CwndEstimator(self.port1)
+        for packet in self.flow:
+            self.cwnd_estimator.add_packet(packet)
+        
+        series = self.cwnd_estimator.series
+        if verbose:
+            print('***Flow {}***'.format(self.ID))
+            print('The first {} congestion window sizes are:'.format(min(first, len(series))))
+            for time_stamp, cwnd, flight, ssthresh, phase in series[:first]:
+                print('time = {0:1.5f}  cwnd = {1:8d} byte  {2}'.format(time_stamp - self.first_time, cwnd, PHASES[phase]))
+            print()
+        if export:
+            self.cwnd_estimator.export(export)
+        return series
+        
+        
+    def compute_dta_timeout(self, verbose=True):
         '''Compute the number of times a retransmission occurred due to triple duplicate ack 
            and the number of time a retransmission occurred due to timeout 
            (as before, determine if you need to do it at the sender or the receiver)
+           
+           Every copy of a segment after the first is classified, so a segment retransmitted 
+           more than once is counted every time (see tcp_retrans).
+        
+        Return:
+            (tuple) (# of triple duplicate ack, # of timeout)
         '''
-        sender_dic = {}      # stony brook  {seq --> [packet]}
-        receiver_dic = {}    # washington   {ack --> [packet]}
-        for packet in self.flow:  # divide the packets in the flow into two dict
-            source_port = getattr(packet, 'source_port')
-            if source_port == self.port1:   # sender's packet
-                seq = getattr(packet, 'sequence_num')
-                packet_list = sender_dic.get(seq)
-                if packet_list:
-                    packet_list.append(packet)
-                else:
-                    sender_dic[seq] = [packet]
-            else:                           # receiver's packet
-                ack = getattr(packet, 'ack_num')
-                packet_list = receiver_dic.get(ack)
-                if packet_list:
-                    packet_list.append(packet)
-                else:
-                    receiver_dic[ack] = [packet]
-                    
-        retransmit_dic = {}   # {seq --> [packet]}
-        for seq, packet_list in sender_dic.items():  # get the retrasmitted packets
-            if len(packet_list) > 1:
-                retransmit_dic[seq] = packet_list
-                
-        total_retransmission = len(retransmit_dic) - 1   # minus the third handshake and the one right after it
-        tda_counter = 0  # triple duplicate ack counter
-        
-        for seq, packet_list in retransmit_dic.items():
-            ack = seq
-            timestamp_1 = getattr(packet_list[0], 'time_stamp')  # from data, oberserve no retransmission twice
-            timestamp_2 = getattr(packet_list[1], 'time_stamp')
-            packet_list = receiver_dic.get(ack)
-            if packet_list:
-                ack_counter = 0
-                for packet in packet_list:
-                    timestamp = getattr(packet, 'time_stamp')
-                    if timestamp > timestamp_1 and timestamp < timestamp_2:
-                        ack_counter += 1
-                    if ack_counter >= 3:    # Mark: issue here. one ack plus triple ack, so need to be bigger than 3
-                        tda_counter += 1
-                        break
-                        
-        self.tda = tda_counter
-        self.timeout = total_retransmission - self.tda  # two reasons of retransmission: TDA or timeout
-        print('***Flow {}***'.format(self.ID))
-        print('# of triple duplicate ack = {}'.format(self.tda))
-        print('# of timeout = {}\n'.format(self.timeout))
+        classifier = self.classify_retransmissions()
+        self.tda     = classifier.counts[FAST_RETRANSMIT]
+        self.timeout = classifier.counts[RTO]
+        if verbose:
+            print('***Flow {}***'.format(self.ID))
+            print('# of triple duplicate ack = {}'.format(self.tda))
+            print('# of timeout = {}'.format(self.timeout))
+            print('# of tail loss probe = {}'.format(classifier.counts[TAIL_LOSS_PROBE]))
+            print('# of spurious retransmission = {}\n'.format(classifier.counts[SPURIOUS]))
+        return self.tda, self.timeout
                 
 
-class FlowManager:
-    '''Manage some flows
-    
-    Attributes:
-        flow_list (list): an list(array) of Flow
-        flow_info (dict): a dict { ID : (index, port1, port2) }
+class FlowManager(pcap_core.FlowManager):
+    '''Manage some flows, see pcap_core.FlowManager, with the Part A/B reports. 
+       A closed flow is summarized as a FlowSummary, which on_close receives.
     '''
+    flow_class = Flow
     
-    def __init__(self):
-        self.flow_list = []
-        self.flow_info = {}
-        
-        
-    def add_packet(self, packet):
-        '''Add a packet to the flow it belongs to. 
-           If the flow does not exit, then create a new one.
-           
-        Args:
-            packet (Packet)
-        '''
-        index = self.where_is_packet(packet)
-        if index == -1:  # this is a "new packet": the packet does not belong to any existed flow
-            new_flow = Flow()
-            new_flow.set_port(packet)
-            new_flow.add_packet(packet)
-            self.add_flow(new_flow)
-        else:            # this packet belongs to an existed flow
-            self.flow_list[index].add_packet(packet)
+    def summarize(self, flow, reason):
+        return flow.summary(reason)
     
     
-    def add_flow(self, flow):
-        '''Add a new flow into FlowManager
-        
-        Args:
-            flow (Flow): a new flow to be added to the flow manager
-        '''
-        index = len(self.flow_list)
-        self.flow_list.append(flow)
-        ID  = getattr(flow, 'ID')
-        port1 = getattr(flow, 'port1')
-        port2 = getattr(flow, 'port2')
-        self.flow_info[ID] = (index, port1, port2)
-        
-    
-    def where_is_packet(self, packet):
-        '''Return the flow's index to which a packet belongs
-        
-        Args:
-            packet (Packet): a packet
+    def results(self):
+        '''Compute the Part A/B metrics of every flow without printing anything
         
         Return:
-            (int): index 
+            (list) FlowSummary, in the order the flows were created
         '''
-        source_port = getattr(packet, 'source_port')
-        dest_port = getattr(packet, 'dest_port')
-        for ID, info in self.flow_info.items():
-            if (source_port == info[1] and dest_port == info[2]) or (source_port == info[2] and dest_port == info[1]):
-                return info[0]
-        else:
-            return -1
-        
+        return [flow.summary() for flow in self.flow_list]
     
-    def size(self):
-        return len(self.flow_list)
     
+    def transactions(self):
+        '''Return the TransactionRecord of Part A (a) of every flow'''
+        records = []
+        for flow in self.flow_list:
+            records.extend(flow.first_2_transactions())
+        return records
     
-    def get_flow(self, ID):
-        '''Get a flow according to its ID
-        
-        Args:
-            flow (Flow): Identification number
+    
+    def write_results(self, path, transactions_path=None):
+        '''Write the per-flow metrics, and optionally the Part A (a) transactions, 
+           as .jsonl, .csv or .parquet (see pcap_results)
         '''
-        flow_info = self.flow_info.get(ID)
-        if flow_info:
-            index = flow_info[0]
-            return self.flow_list[index]
-        return None
+        write_records(self.results(), path)
+        if transactions_path:
+            write_records(self.transactions(), transactions_path)
     
     
     def partA_a(self):
@@ -490,10 +439,46 @@ class FlowManager:
         print('However, from wireshark we see some timeout. When timeout occurs, we go to slow start. This explains why.')
         
     
+    def partB_1(self, export_dir=None):
+        '''Args:
+            export_dir (str): write the congestion window series of every flow to <export_dir>/flow_<ID>.csv
+        '''
+        print('\n\n\nPART B(1)\n')
+        for flow in self.flow_list:
+            export = os.path.join(export_dir, 'flow_{}.csv'.format(flow.ID)) if export_dir else None
+            flow.estimate_cwnd(export=export)
+        
+    
     def partB_2(self):
         print('\n\n\nPART B(2)\n')
         for flow in self.flow_list:
             flow.compute_dta_timeout()
+            
+            
+    def fairness(self, window=1.0, capacity=None):
+        '''Bin the throughput of the stored flows into windows and compute their fairness (see tcp_fairness).
+           Without stored packets, run tcp_fairness.FairnessPass while reading the capture instead.
+        
+        Args:
+            window (float): seconds
+            capacity (float): Mbps of the bottleneck, None to use the busiest window
+        
+        Return:
+            (FairnessAnalysis)
+        '''
+        return FairnessAnalysis([flow_samples(flow) for flow in self.flow_list], window, capacity)
+    
+    
+    def partB_fairness(self, window=1.0, threshold=FAIR_INDEX, export=None):
+        '''Args:
+            export (str): write the per-window fairness series to this .csv, .npy or .parquet file
+        '''
+        print('\n\n\nPART B(fairness)\n')
+        analysis = self.fairness(window)
+        analysis.print_report(threshold)
+        if export:
+            analysis.export(export)
+        return analysis
 
 
 if __name__ == '__main__':
@@ -506,9 +491,9 @@ if __name__ == '__main__':
 	packets = []
 	for packet_bytes in packets_bytes:
 		packet = Packet(packet_bytes)
-		packet.parse_byte_info()
-		flow_manager.add_packet(packet)
-		packets.append(packet)
+		if packet.parse_byte_info(pcap.datalink()):
+			flow_manager.add_packet(packet)
+			packets.append(packet)
  
 	counter = 0
 	for packet in packets:
@@ -524,6 +509,7 @@ if __name__ == '__main__':
 	flow_manager.partA_c()
 	flow_manager.partA_d()
 
+	flow_manager.partB_1()
 	flow_manager.partB_2()
 
 	
@@ -0,0 +1,455 @@
+'''Reassemble the TCP byte streams of a connection and parse the HTTP/1.x messages in them.
+
+StreamReassembler puts the segments of one direction back in sequence order. It drops
+retransmitted bytes, trims overlaps, holds out-of-order segments until the hole before them
+is filled and follows the sequence number across wraparound. The out-of-order buffer is
+bounded: when it is full, the missing bytes are given up as a gap.
+
+HTTPParser consumes one reassembled direction incrementally: headers, then a body framed by
+Content-Length, chunked transfer coding or the end of the connection. Bodies are counted,
+not stored, so only the headers of the current message are ever buffered. Several messages
+in a row (pipelining, keep-alive) are parsed one after another.
+
+HTTPConnection drives both directions of one flow in a single pass over its packets and
+pairs every request with its response, in order, with the timing of both.
+'''
+
+import heapq
+
+from tcp_seq import seq_diff
+
+
+MAX_BUFFER = 1 << 20       # bytes of out-of-order data held per direction
+MAX_HEADER = 1 << 16       # a header block larger than this is not HTTP
+
+NO_BODY_STATUS = (204, 304)
+
+
+class StreamReassembler:
+    '''Reassemble the byte stream of one direction of a TCP connection
+
+    Attributes:
+        on_data (callable): on_data(data, packet) for every new in-order chunk of bytes
+        on_gap (callable): on_gap(length) when missing bytes are skipped, may be None
+        delivered (int): bytes delivered so far
+        duplicate (int): retransmitted or overlapping bytes dropped
+        gaps (int): bytes never seen
+    '''
+
+    def __init__(self, on_data, on_gap=None, max_buffer=MAX_BUFFER):
+        self.on_data = on_data
+        self.on_gap = on_gap
+        self.max_buffer = max_buffer
+        self.delivered = 0
+        self.duplicate = 0
+        self.gaps = 0
+        self.__next = None             # next expected byte, as an unwrapped 64-bit offset
+        self.__pending = {}            # start --> (data, packet), out-of-order segments
+        self.__starts = []             # heap of the keys of pending
+        self.__buffered = 0
+        self.__fin = None              # offset of the FIN, once seen
+
+
+    def add_segment(self, packet):
+        '''Add a segment of this direction, in capture order
+
+        Args:
+            packet (Packet): a parsed packet with payload bytes
+        '''
+        seq = packet.sequence_num
+        if self.__next is None:
+            if not (packet.syn or packet.payload_len):
+                return
+            self.__next = seq
+        start = self.__next + seq_diff(seq, self.__next & 0xFFFFFFFF)
+        if packet.syn:
+            start += 1
+            if self.__next < start and self.delivered == 0 and not self.__pending:
+                self.__next = start
+        data = packet.payload
+        end = start + len(data)
+        if packet.fin and self.__fin is None:
+            self.__fin = end
+        if not data:
+            return
+
+        if end <= self.__next:
+            self.duplicate += len(data)
+            return
+        if start > self.__next:
+            self.__hold(start, data, packet)
+            return
+        if start < self.__next:
+            self.duplicate += self.__next - start
+            data = data[self.__next - start:]
+        self.__deliver(data, packet)
+        self.__drain()
+
+
+    def finished(self):
+        '''Return True once the FIN was seen and every byte before it was delivered or skipped'''
+        return self.__fin is not None and self.__next >= self.__fin
+
+
+    def flush(self):
+        '''Deliver everything still buffered, skipping the holes (end of capture or connection)'''
+        while self.__starts:
+            self.__skip_to(self.__starts[0])
+            self.__drain()
+
+
+    def __hold(self, start, data, packet):
+        held = self.__pending.get(start)
+        if held is not None:
+            if len(held[0]) >= len(data):
+                self.duplicate += len(data)
+                return
+            self.duplicate += len(held[0])
+            self.__buffered -= len(held[0])
+        else:
+            heapq.heappush(self.__starts, start)
+        self.__pending[start] = (data, packet)
+        self.__buffered += len(data)
+        while self.__buffered > self.max_buffer and self.__starts:
+            self.__skip_to(self.__starts[0])
+            self.__drain()
+
+
+    def __skip_to(self, start):
+        if start > self.__next:
+            self.gaps += start - self.__next
+            if self.on_gap:
+                self.on_gap(start - self.__next)
+            self.__next = start
+
+
+    def __drain(self):
+        starts = self.__starts
+        while starts and starts[0] <= self.__next:
+            start = heapq.heappop(starts)
+            data, packet = self.__pending.pop(start)
+            self.__buffered -= len(data)
+            end = start + len(data)
+            if end <= self.__next:
+                self.duplicate += len(data)
+                continue
+            if start < self.__next:
+                self.duplicate += self.__next - start
+                data = data[self.__next - start:]
+            self.__deliver(data, packet)
+
+
+    def __deliver(self, data, packet):
+        self.__next += len(data)
+        self.delivered += len(data)
+        self.on_data(data, packet)
+
+
+class HTTPMessage:
+    '''One HTTP request or response
+
+    Attributes:
+        kind (str): 'request' or 'response'
+        start_line (str): the request line or the status line
+        method (str): request method, None for a response
+        uri (str): request target, None for a response
+        version (str): HTTP version, e.g. 'HTTP/1.1'
+        status (int): status code, None for a request
+        headers (dict): { lower case name : value }
+        header_len (int): size of the start line and headers, in bytes
+        body_len (int): size of the body as sent (chunk framing included), in bytes
+        first_time (float): time stamp of the packet with the first byte
+        last_time (float): time stamp of the packet with the last byte
+        segments (list): (source port, dest port, seq, ack) of every segment that carried its bytes
+        complete (bool): the whole message was seen
+    '''
+
+    def __init__(self, kind, time_stamp):
+        self.kind = kind
+        self.start_line = ''
+        self.method = None
+        self.uri = None
+        self.version = None
+        self.status = None
+        self.headers = {}
+        self.header_len = 0
+        self.body_len = 0
+        self.first_time = time_stamp
+        self.last_time = time_stamp
+        self.segments = []
+        self.complete = False
+
+
+    def size(self):
+        return self.header_len + self.body_len
+
+
+    def __str__(self):
+        return self.start_line
+
+
+class HTTPParser:
+    '''Incremental HTTP/1.x parser for one direction of a connection
+
+    Attributes:
+        kind (str): 'request' or 'response'
+        on_message (callable): on_message(message) for every complete message
+        request_method (callable): for a response parser, returns the method of the request
+                                   being answered (HEAD responses have no body)
+        error (str): why the stream stopped being parsed, None while it is HTTP
+    '''
+    HEADERS, LENGTH, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILER, UNTIL_CLOSE = range(7)
+
+    def __init__(self, kind, on_message, request_method=None):
+        self.kind = kind
+        self.on_message = on_message
+        self.request_method = request_method
+        self.error = None
+        self.message = None
+        self.__state = self.HEADERS
+        self.__buffer = bytearray()
+        self.__remaining = 0
+
+
+    def feed(self, data, packet):
+        '''Parse the next chunk of the reassembled stream
+
+        Args:
+            data (bytes): in-order bytes
+            packet (Packet): the packet that carried them
+        '''
+        if self.error:
+            return
+        buffer = self.__buffer
+        buffer += data
+        pos = 0
+        while pos < len(buffer) and not self.error:
+            if self.message is None:
+                self.message = HTTPMessage(self.kind, packet.time_stamp)
+            message = self.message
+            message.last_time = packet.time_stamp
+            segment = (packet.source_port, packet.dest_port, packet.sequence_num, packet.ack_num)
+            if not message.segments or message.segments[-1] != segment:
+                message.segments.append(segment)
+
+            state = self.__state
+            if state == self.HEADERS:
+                end = buffer.find(b'\r\n\r\n', pos)
+                if end == -1:
+                    if len(buffer) - pos > MAX_HEADER:
+                        self.error = 'header block too large'
+                    break
+                self.__parse_headers(bytes(buffer[pos:end]))
+                message.header_len = end + 4 - pos
+                pos = end + 4
+                if self.__state == self.HEADERS:
+                    self.__complete()
+            elif state == self.LENGTH or state == self.CHUNK_DATA:
+                n = min(self.__remaining, len(buffer) - pos)
+                pos += n
+                message.body_len += n
+                self.__remaining -= n
+                if self.__remaining == 0:
+                    if state == self.LENGTH:
+                        self.__complete()
+                    else:
+                        self.__state = self.CHUNK_END
+            elif state == self.UNTIL_CLOSE:
+                message.body_len += len(buffer) - pos
+                pos = len(buffer)
+            else:                                   # CHUNK_SIZE, CHUNK_END, TRAILER work line by line
+                end = buffer.find(b'\r\n', pos)
+                if end == -1:
+                    if len(buffer) - pos > MAX_HEADER:
+                        self.error = 'chunk line too long'
+                    break
+                line = bytes(buffer[pos:end])
+                message.body_len += end + 2 - pos
+                pos = end + 2
+                self.__parse_line(state, line)
+        del buffer[:pos]
+        if self.error:
+            buffer.clear()
+
+
+    def close(self):
+        '''The direction ended: a body delimited by the end of the connection is now complete'''
+        if self.message is not None and self.__state == self.UNTIL_CLOSE:
+            self.__complete()
+
+
+    def gap(self, length):
+        '''Bytes of the stream are missing: the current message cannot be parsed any further'''
+        if self.__state in (self.LENGTH, self.CHUNK_DATA) and length <= self.__remaining:
+            self.__remaining -= length               # the hole is inside a body, keep counting
+            if self.message is not None:
+                self.message.body_len += length
+            return
+        self.message = None
+        self.__buffer.clear()
+        self.__state = self.HEADERS
+        self.error = 'missing {} bytes'.format(length)
+
+
+    def __parse_headers(self, block):
+        message = self.message
+        lines = block.decode('iso-8859-1').split('\r\n')
+        message.start_line = lines[0]
+        parts = lines[0].split(' ', 2)
+        if len(parts) < 2:
+            self.error = 'malformed start line'
+            return
+        if self.kind == 'request':
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                self.error = 'not an HTTP request'
+                return
+            message.method, message.uri, message.version = parts
+        else:
+            if not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+                self.error = 'not an HTTP response'
+                return
+            message.version, message.status = parts[0], int(parts[1])
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            message.headers[name.strip().lower()] = value.strip()
+
+        headers = message.headers
+        if self.kind == 'response':
+            method = self.request_method() if self.request_method else None
+            if method == 'HEAD' or message.status < 200 or message.status in NO_BODY_STATUS:
+                return
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            self.__state = self.CHUNK_SIZE
+        elif 'content-length' in headers:
+            try:
+                self.__remaining = int(headers['content-length'])
+            except ValueError:
+                self.error = 'bad Content-Length'
+                return
+            if self.__remaining > 0:
+                self.__state = self.LENGTH
+        elif self.kind == 'response':
+            self.__state = self.UNTIL_CLOSE
+
+
+    def __parse_line(self, state, line):
+        if state == self.CHUNK_SIZE:
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                self.error = 'bad chunk size'
+                return
+            if size == 0:
+                self.__state = self.TRAILER
+            else:
+                self.__remaining = size
+                self.__state = self.CHUNK_DATA
+        elif state == self.CHUNK_END:
+            self.__state = self.CHUNK_SIZE
+        elif not line:                               # TRAILER ends with an empty line
+            self.__complete()
+
+
+    def __complete(self):
+        message = self.message
+        message.complete = True
+        self.message = None
+        self.__state = self.HEADERS
+        self.__remaining = 0
+        self.on_message(message)
+
+
+class HTTPTransaction:
+    '''A request and the response to it
+
+    Attributes:
+        request (HTTPMessage)
+        response (HTTPMessage): None until the response is complete
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.response = None
+
+
+class HTTPConnection:
+    '''Reassemble and parse both directions of one TCP connection
+
+    Attributes:
+        client_port (int): the port of the side that sent the SYN (Flow.port1)
+        transactions (list): HTTPTransaction in request order
+        syn_time (float): time stamp of the client's SYN, None if not captured
+        synack_time (float): time stamp of the server's SYN/ACK, None if not captured
+        established_time (float): time stamp of the ACK that completed the handshake
+    '''
+
+    def __init__(self, client_port, max_buffer=MAX_BUFFER):
+        self.client_port = client_port
+        self.transactions = []
+        self.syn_time = None
+        self.synack_time = None
+        self.established_time = None
+        self.__unanswered = 0        # index of the first transaction without a response
+        self.__requests  = HTTPParser('request', self.__add_request)
+        self.__responses = HTTPParser('response', self.__add_response, self.__request_method)
+        self.__client = StreamReassembler(self.__requests.feed, self.__requests.gap, max_buffer)
+        self.__server = StreamReassembler(self.__responses.feed, self.__responses.gap, max_buffer)
+        self.__server_done = False   # the responses ended with the server's FIN or RST
+        self.__closed = False
+
+
+    def add_packet(self, packet):
+        '''Feed the next packet of the connection, in capture order. The responses end at the
+           server's FIN once the bytes before it are all in, or at once on its RST.
+        '''
+        if packet.source_port == self.client_port:
+            if packet.syn and self.syn_time is None:
+                self.syn_time = packet.time_stamp
+            elif self.synack_time is not None and self.established_time is None and packet.ack:
+                self.established_time = packet.time_stamp
+            self.__client.add_segment(packet)
+        else:
+            if packet.syn and packet.ack and self.synack_time is None:
+                self.synack_time = packet.time_stamp
+            self.__server.add_segment(packet)
+            if self.__server_done:
+                return
+            if packet.rst:
+                self.__server.flush()
+            elif not self.__server.finished():
+                return                               # no FIN yet, or retransmissions to come
+            self.__server_done = True
+            self.__responses.close()
+
+
+    def close(self):
+        '''End of the packets: flush both directions and complete close-delimited responses.
+           A response cut short by the end of the capture is still paired, with complete False.
+        '''
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__client.flush()
+        self.__server.flush()
+        self.__responses.close()
+        message = self.__responses.message
+        if message is not None and message.status is not None:
+            self.__add_response(message)
+
+
+    def __add_request(self, message):
+        self.transactions.append(HTTPTransaction(message))
+
+
+    def __request_method(self):
+        if self.__unanswered < len(self.transactions):
+            return self.transactions[self.__unanswered].request.method
+        return None
+
+
+    def __add_response(self, message):
+        if message.status is not None and message.status < 200:
+            return                                   # interim response, the final one follows
+        if self.__unanswered < len(self.transactions):
+            self.transactions[self.__unanswered].response = message
+            self.__unanswered += 1
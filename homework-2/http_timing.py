@@ -0,0 +1,129 @@
+'''Per-request HTTP timing and the page load waterfall across parallel connections.
+
+For every request/response pair of a reassembled connection (see http_reassembly):
+
+    connect   SYN to the ACK that completes the handshake, only for the first request of
+              a connection (the later ones reuse it)
+    blocked   connection ready (or previous response done) to the first byte of the request
+    send      first to last byte of the request
+    wait      last byte of the request to first byte of the response (time to first byte)
+    receive   first to last byte of the response
+
+All times are as seen at the capture point. The waterfall puts every request of every
+connection of a page on one time axis, starting at the first SYN or request.
+'''
+
+from collections import namedtuple
+
+
+RequestTiming = namedtuple('RequestTiming', [
+    'flow',            # Flow.ID
+    'index',           # position of the request on its connection
+    'method', 'uri', 'status',
+    'start',           # SYN (first request) or end of the previous response, absolute time stamp
+    'connect',         # seconds, 0 for a reused connection
+    'blocked',         # seconds the connection sat idle before the request
+    'send', 'wait', 'receive',
+    'end',             # last byte of the response, absolute time stamp
+    'request_bytes', 'response_bytes',
+    'throughput',      # response bytes over the receive time, in Mbps
+])
+
+
+def request_timings(flow_id, connection):
+    '''Return the timing of every answered request of one connection
+
+    Args:
+        flow_id (int): the flow the connection belongs to
+        connection (HTTPConnection): a reassembled connection
+
+    Return:
+        (list) RequestTiming in request order
+    '''
+    timings = []
+    ready = connection.established_time
+    for index, transaction in enumerate(connection.transactions):
+        request, response = transaction.request, transaction.response
+        if response is None:
+            continue
+        connect = 0.0
+        blocked = 0.0
+        start = request.first_time
+        if index == 0 and connection.syn_time is not None and ready is not None:
+            connect = ready - connection.syn_time
+            start = connection.syn_time
+        if ready is not None:
+            blocked = max(request.first_time - ready, 0.0)
+            if index > 0:
+                start = ready
+        ready = response.last_time
+        receive = response.last_time - response.first_time
+        response_bytes = response.size()
+        throughput = response_bytes*8.0/(receive*1000000) if receive > 0 else 0.0
+        timings.append(RequestTiming(
+            flow=flow_id, index=index, method=request.method, uri=request.uri, status=response.status,
+            start=start, connect=connect, blocked=blocked,
+            send=request.last_time - request.first_time,
+            wait=response.first_time - request.last_time,
+            receive=receive, end=response.last_time,
+            request_bytes=request.size(), response_bytes=response_bytes, throughput=throughput))
+    return timings
+
+
+class PageWaterfall:
+    '''All the requests of a page load, across its parallel connections
+
+    Attributes:
+        timings (list): RequestTiming of every connection, sorted by start
+        start (float): time stamp of the first SYN or request
+        end (float): time stamp of the last response byte
+    '''
+
+    def __init__(self, timings):
+        self.timings = sorted(timings, key=lambda timing: (timing.start, timing.flow, timing.index))
+        self.start = min((timing.start for timing in self.timings), default=0.0)
+        self.end = max((timing.end for timing in self.timings), default=0.0)
+
+
+    def load_time(self):
+        return self.end - self.start
+
+
+    def connections(self):
+        '''Summarize every connection
+
+        Return:
+            (list) (flow ID, number of requests, response bytes, first start, last end), busiest first
+        '''
+        summary = {}
+        for timing in self.timings:
+            flow = summary.setdefault(timing.flow, [timing.flow, 0, 0, timing.start, timing.end])
+            flow[1] += 1
+            flow[2] += timing.response_bytes
+            flow[3] = min(flow[3], timing.start)
+            flow[4] = max(flow[4], timing.end)
+        return sorted((tuple(flow) for flow in summary.values()), key=lambda flow: flow[4] - flow[3], reverse=True)
+
+
+    def slowest(self, n=5):
+        '''Return the n requests that took the longest, from start to last response byte'''
+        return sorted(self.timings, key=lambda timing: timing.end - timing.start, reverse=True)[:n]
+
+
+    def print_waterfall(self, width=40):
+        '''Print one line per request with its phases on a text time axis:
+           c = connect, . = blocked, s = send, w = wait, r = receive
+        '''
+        span = self.load_time()
+        scale = width/span if span > 0 else 0
+        print('{0:>5s} {1:>3s} {2:>8s} {3:>8s} {4:>8s} {5:>8s} {6:>10s}  {7:{8}s}  {9}'.format(
+              'flow', '#', 'connect', 'ttfb', 'receive', 'total', 'bytes', 'waterfall', width, 'uri'))
+        for timing in self.timings:
+            bar = ' '*int((timing.start - self.start)*scale)
+            for phase, length in (('c', timing.connect), ('.', timing.blocked), ('s', timing.send),
+                                  ('w', timing.wait), ('r', timing.receive)):
+                bar += phase*int(round(length*scale))
+            print('{0:5d} {1:3d} {2:8.4f} {3:8.4f} {4:8.4f} {5:8.4f} {6:10d}  {7:{8}s}  {9}'.format(
+                  timing.flow, timing.index, timing.connect, timing.wait, timing.receive, timing.end - timing.start,
+                  timing.response_bytes, bar[:width], width, timing.uri))
+        print('Page load time = {0:4.4f} s over {1} connections'.format(span, len(self.connections())))
@@ -0,0 +1,207 @@
+'''Measure the speed, memory and correctness of the analyzers on synthetic captures.
+
+Usage:
+    python pcap_benchmark.py [--flows 50] [--packets 2000] [--loss 0.01] [--reorder 0.01] [--rtt 0.05]
+                             [--http-objects 0] [--object-size 10000] [--seed 1]
+                             [--stages ingest,stream,metrics,http,passes] [-o results.jsonl]
+    python pcap_benchmark.py --pcap capture.pcap            # speed only, no ground truth
+
+A capture is written with pcap_synth (unless --pcap is given), then every stage runs in a
+fresh process so that its peak RSS is its own:
+
+    ingest    read, decode and add every packet to analysis_pcap_tcp.FlowManager
+    stream    the same without storing the packets (keep_packets=False)
+    metrics   ingest, then the Part A/B metrics of every flow (FlowManager.results)
+    http      read, decode and reassemble every flow as HTTP (analysis_pcap_http)
+    passes    the metrics and the HTTP reassembly as passes over one decoding, no packet
+              stored (pcap_core.FlowManager with TCPMetricsPass and HTTPPass)
+
+Each stage reports packets per second over the whole stage and its peak RSS. The metrics,
+http and passes stages are then compared with the ground truth of the generator: packets, bytes,
+retransmissions, RTT and HTTP requests of every flow.
+'''
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from collections import namedtuple
+
+import pcap_core
+import pcap_synth
+from pcap_results import write_records
+
+
+STAGES = ('ingest', 'stream', 'metrics', 'http', 'passes')
+RTT_TOLERANCE = 0.1          # relative, the timestamps of the generator have a 1 ms resolution
+
+BenchmarkRecord = namedtuple('BenchmarkRecord', ['stage', 'packets', 'flows', 'seconds', 'pps', 'peak_rss_mb'])
+
+
+def run_stage(stage, path):
+    '''Run one stage on a capture, meant to be the only work of its process
+
+    Return:
+        (tuple) (BenchmarkRecord, { 'tcp' : list of FlowSummary, 'http' : { client port : number of requests } }
+                 with the results of the stage)
+    '''
+    import analysis_pcap_tcp
+    import analysis_pcap_http
+    start = time.perf_counter()
+    results = {}
+    if stage == 'http':
+        flow_manager = analysis_pcap_http.FlowManager()
+        packets = pcap_core.read_capture(path, flow_manager)
+        results['http'] = dict((flow.port1, len(flow.http_connection().transactions)) for flow in flow_manager.flow_list)
+    elif stage == 'passes':
+        flow_manager = pcap_core.FlowManager(keep_packets=False, passes=[analysis_pcap_tcp.TCPMetricsPass(),
+                                                                         analysis_pcap_http.HTTPPass()])
+        packets = pcap_core.read_capture(path, flow_manager)
+        flows = flow_manager.size()
+        flow_manager.close_all()
+        results['tcp'] = flow_manager.records['tcp']
+        results['http'] = dict((record.port1, record.requests) for record in flow_manager.records['http'])
+    else:
+        flow_manager = analysis_pcap_tcp.FlowManager(keep_packets=stage != 'stream')
+        packets = pcap_core.read_capture(path, flow_manager)
+        if stage == 'metrics':
+            results['tcp'] = flow_manager.results()
+    if stage != 'passes':
+        flows = flow_manager.size()
+    seconds = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0    # KB on Linux
+    record = BenchmarkRecord(stage=stage, packets=packets, flows=flows, seconds=seconds,
+                             pps=packets/seconds if seconds > 0 else 0.0, peak_rss_mb=peak_rss)
+    return record, results
+
+
+def rtt_bounds(truth, samples):
+    '''Return the lowest and highest mean RTT accepted for a flow of the generator.
+       A reordered segment arrives up to MAX_REORDER_DELAY pacing gaps late, and the ACK that
+       covers it measures that delay too, so every reordered segment may add it to one sample.
+
+    Args:
+        truth (FlowTruth)
+        samples (int): number of RTT samples of the flow
+
+    Return:
+        (tuple) (low, high) in seconds
+    '''
+    delay = pcap_synth.MAX_REORDER_DELAY*truth.rtt/pcap_synth.WINDOW
+    slack = delay*truth.reordered/samples if samples > 0 else 0.0
+    return truth.rtt*(1 - RTT_TOLERANCE), truth.rtt*(1 + RTT_TOLERANCE) + slack
+
+
+def check_metrics(truths, summaries):
+    '''Compare the Part A/B metrics with the ground truth
+
+    Return:
+        (list) a description of every mismatch
+    '''
+    errors = []
+    by_port = dict((summary.port1, summary) for summary in summaries)
+    for truth in truths:
+        summary = by_port.get(truth.client_port)
+        if summary is None:
+            errors.append('flow {}: not found'.format(truth.client_port))
+            continue
+        expected = [('packets', truth.packets, summary.packets), ('bytes', truth.bytes, summary.bytes),
+                    ('packets sent', truth.packets_sent, summary.packets_sent)]
+        if truth.data_sender == truth.client_port:          # the losses of the client happen after the capture point
+            expected.append(('retransmissions', truth.fast_retransmits + truth.timeouts, summary.retransmissions))
+            expected.append(('fast retransmits', truth.fast_retransmits, summary.fast_retransmits))
+        for name, want, got in expected:
+            if want != got:
+                errors.append('flow {}: {} expected {} measured {}'.format(truth.client_port, name, want, got))
+        low, high = rtt_bounds(truth, summary.rtt_samples)
+        if summary.rtt < 0 or not low <= summary.rtt <= high:
+            errors.append('flow {}: RTT expected {:1.5f} measured {:1.5f}'.format(truth.client_port, truth.rtt, summary.rtt))
+    return errors
+
+
+def check_http(truths, requests):
+    errors = []
+    for truth in truths:
+        got = requests.get(truth.client_port)
+        if got != truth.requests:
+            errors.append('flow {}: HTTP requests expected {} measured {}'.format(truth.client_port, truth.requests, got))
+    return errors
+
+
+def benchmark(path, stages, truths=None):
+    '''Run the stages one process each and check their results against the ground truth
+
+    Return:
+        (tuple) (list of BenchmarkRecord, list of mismatches)
+    '''
+    context = multiprocessing.get_context('spawn')       # a fresh process, not a copy of this one
+    records = []
+    errors = []
+    for stage in stages:
+        with context.Pool(1) as pool:
+            record, results = pool.apply(run_stage, (stage, path))
+        records.append(record)
+        if truths is None:
+            continue
+        if 'tcp' in results:
+            errors.extend('{}: {}'.format(stage, error) for error in check_metrics(truths, results['tcp']))
+        if 'http' in results:
+            errors.extend('{}: {}'.format(stage, error) for error in check_http(truths, results['http']))
+    return records, errors
+
+
+def print_benchmark(records, errors, checked):
+    print('{0:>8s} {1:>10s} {2:>7s} {3:>9s} {4:>12s} {5:>13s}'.format('stage', 'packets', 'flows', 'seconds', 'packets/s', 'peak RSS (MB)'))
+    for record in records:
+        print('{0:>8s} {1:10d} {2:7d} {3:9.3f} {4:12.0f} {5:13.1f}'.format(
+              record.stage, record.packets, record.flows, record.seconds, record.pps, record.peak_rss_mb))
+    if not checked:
+        return
+    if errors:
+        print('\n{} mismatches with the ground truth:'.format(len(errors)))
+        for error in errors:
+            print(error)
+    else:
+        print('\nAll the checked metrics match the ground truth')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pcap analyzers on synthetic captures')
+    parser.add_argument('--pcap', help='benchmark this capture instead of a synthetic one (no correctness check)')
+    parser.add_argument('--flows', type=int, default=50)
+    parser.add_argument('--packets', type=int, default=2000, help='data segments per bulk flow')
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--reorder', type=float, default=0.01)
+    parser.add_argument('--rtt', type=float, default=0.05, help='seconds')
+    parser.add_argument('--http-objects', type=int, default=0, help='HTTP requests per flow instead of a bulk transfer')
+    parser.add_argument('--object-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma separated, among ' + ', '.join(STAGES))
+    parser.add_argument('-o', '--output', help='write the measurements as .jsonl, .csv or .parquet')
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('unknown stage {}'.format(stage))
+
+    truths = None
+    path = args.pcap
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.pcap')
+        os.close(handle)
+        start = time.perf_counter()
+        truths = pcap_synth.generate(path, args.flows, args.packets, args.loss, args.reorder, args.rtt,
+                                     args.http_objects, args.object_size, seed=args.seed)
+        print('Generated {} flows, {} packets in {:1.3f} s\n'.format(
+              len(truths), sum(truth.packets for truth in truths), time.perf_counter() - start))
+    try:
+        records, errors = benchmark(path, stages, truths)
+    finally:
+        if args.pcap is None:
+            os.remove(path)
+    print_benchmark(records, errors, truths is not None)
+    if args.output:
+        write_records(records, args.output)
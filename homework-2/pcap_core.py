@@ -0,0 +1,517 @@
+'''Decode a capture once and track its TCP flows, for every analysis.
+
+Packet, Flow and FlowManager are shared by analysis_pcap_tcp (Parts A and B) and
+analysis_pcap_http (Part C), which extend Flow and FlowManager with their own analyses and
+reports. Each packet is decoded once (see pcap_decoder). The FlowManager finds the flow
+of a packet with one dict lookup, keyed by both endpoints.
+
+Analyses that need to see the packets of a flow only once, in order, can also run as
+passes (FlowPass). The manager gives every new flow one analyzer per pass and feeds it
+every packet of the flow while the capture is read. When the flow is closed, the
+manager collects the record of each pass. So the TCP metrics and the HTTP analyses run
+over one decoding of the capture, and with keep_packets=False no packet is stored:
+
+    records = analyze('http_1080.pcap', [TCPMetricsPass(), HTTPPass()])
+    records['tcp'], records['http']     # FlowSummary and HTTPFlowRecord of every flow
+
+TCPMetricsPass is defined in analysis_pcap_tcp and HTTPPass in analysis_pcap_http.
+'''
+
+import sys
+from collections import OrderedDict
+
+import dpkt
+
+import pcap_decoder
+from tcp_seq import seq_add
+
+
+# why a flow stopped being tracked, see FlowManager
+CLOSE_FIN     = 'fin'
+CLOSE_RST     = 'rst'
+CLOSE_IDLE    = 'idle'
+CLOSE_EVICTED = 'evicted'
+CLOSE_END     = 'end'
+
+
+class Packet:
+    '''Encapsulate TCP's header fields of a packet from pcap.
+
+    Attributes:
+        time_stamp (float): capture time stamp
+        byte_info (bytes):  the whole frame
+        source_ip (bytes):  source IPv4/IPv6 address, see pcap_decoder.ip_to_str
+        dest_ip (bytes):    destination IPv4/IPv6 address
+        source_port (int):  source port number
+        dest_port (int):    destination port number
+        sequence_num (int): sequence number
+        ack_num (int):      acknowledgement number
+        head_len(int):      header length
+        urg (int):          urgent flag
+        ack (int):          acknowledgement flag
+        psh (int):          psh flag
+        rst (int):          reset flag
+        syn (int):          synchronize flag
+        fin (int):          finish flag
+        receive_win (int):  receive window
+        checksum (int):     checksum
+        urgent (int):       urgent data pointer
+        scale (int):        window scaling size, set by parse_window_scale
+        mss (int):          maximum segment size option, None if absent
+        wscale (int):       window scale option (shift count), None if absent
+        sack_permitted (bool): SACK permitted option
+        sack (tuple):       SACK blocks, a tuple of (left edge, right edge)
+        tsval (int):        timestamp value option, None if absent
+        tsecr (int):        timestamp echo reply option, None if absent
+        size (int):         the size of the whole packet, including data and all headers
+        payload (bytes):    TCP payload, sliced from byte_info when it is read
+        payload_len (int):  TCP payload length
+    '''
+    __slots__ = ('time_stamp', 'byte_info', 'size', 'source_ip', 'dest_ip', 'source_port', 'dest_port',
+                 'sequence_num', 'ack_num', 'head_len', 'urg', 'ack', 'psh', 'rst', 'syn', 'fin',
+                 'receive_win', 'checksum', 'urgent', 'scale', 'mss', 'wscale', 'sack_permitted', 'sack',
+                 'tsval', 'tsecr', 'payload_start', 'payload_len')
+
+    def __init__(self, packet):
+        '''Init a packet
+
+        Args:
+            packet(tuple): an element from dpkt.pcap.Reader.readpkts()
+        '''
+        self.time_stamp = packet[0]
+        self.byte_info  = packet[1]
+        self.size = len(packet[1])
+
+
+    def parse_byte_info(self, linktype=pcap_decoder.DLT_EN10MB):
+        '''Convert the byte format information of a packet into human readable fields
+
+        Args:
+            linktype (int): datalink type of the capture, from dpkt.pcap.Reader.datalink()
+
+        Return:
+            (bool) False if the packet is not a TCP segment, then no field is set
+        '''
+        fields = pcap_decoder.decode(self.byte_info, linktype)
+        if fields is None:
+            return False
+        (self.source_ip, self.dest_ip, self.source_port, self.dest_port, self.sequence_num, self.ack_num,
+         self.head_len, flags, self.receive_win, self.checksum, self.urgent, start, end, options) = fields
+        self.fin = flags&1
+        self.syn = (flags>>1)&1
+        self.rst = (flags>>2)&1
+        self.psh = (flags>>3)&1
+        self.ack = (flags>>4)&1
+        self.urg = (flags>>5)&1
+        self.payload_start = start
+        self.payload_len   = end - start
+        (self.mss, self.wscale, self.sack_permitted, self.sack, self.tsval, self.tsecr) = options
+        return True
+
+
+    @property
+    def payload(self):
+        start = self.payload_start
+        return self.byte_info[start:start + self.payload_len]
+
+
+    def parse_window_scale(self):
+        '''The scaling is 2^shift, where shift is the window scale option of a SYN (typically 7 to 14).
+           Without the option the window is not scaled.
+        '''
+        shift = self.wscale if self.wscale is not None else 0
+        self.scale = 1<<shift
+
+
+    def __str__(self):
+        string = 'Source Port #  = {}\n'.format(self.source_port)
+        string = string + 'Dest Port #    = {}\n'.format(self.dest_port)
+        string = string + 'Sequence #     = {}\n'.format(self.sequence_num)
+        string = string + 'Ackownledge #  = {}\n'.format(self.ack_num)
+        string = string + 'Header length  = {}\n'.format(self.head_len)
+        string = string + 'URG({}) ACK({}) PSH({})\n'.format(self.urg, self.ack, self.psh)
+        string = string + 'RST({}) SYN({}) FIN({})\n'.format(self.rst, self.syn, self.fin)
+        string = string + 'Receive window = {}\n'.format(self.receive_win)
+        string = string + 'Checksum       = {}\n'.format(self.checksum)
+        string = string + 'Urgent         = {}\n'.format(self.urgent)
+        string = string + 'Payload len    = {}\n'.format(self.payload_len)
+        return string
+
+
+class Flow:
+    '''Encapsulate a flow of packets from one port of sender to another port of receiver.
+       port1 is the source port of the first packet seen, normally the client.
+
+    Attributes:
+        __ID  (int):  private class member identification
+        ID    (int):  identification of a flow
+        port1 (int):  a port number
+        port2 (int):  a port number
+        flow  (list): a list of Packet, empty if keep_packets is False
+        counter (int): count the number of packets in this flow
+        scale (int):   window scaling size
+        keep_packets (bool): store the packets in flow, False to only keep the counters
+        first_time (float): time stamp of the first packet
+        last_time (float):  time stamp of the last packet
+        bytes (int):         size of all the packets, headers included
+        data_sent (int):     payload bytes from port1
+        data_received (int): payload bytes from port2
+        packets_received (int): packets from port2
+        finished (bool): a RST was seen, or both FINs and the ACK of the last one
+        analyses (dict): { FlowPass.name : analyzer fed with every packet }, see FlowManager
+    '''
+    __ID = 100
+
+    def __init__(self, keep_packets=True):
+        self.ID    = Flow.__ID
+        Flow.__ID += 1
+        self.port1 = -1
+        self.port2 = -1
+        self.flow  = []
+        self.counter = 0
+        self.scale   = 1
+        self.keep_packets = keep_packets
+        self.first_time = None
+        self.last_time  = None
+        self.bytes = 0
+        self.data_sent     = 0
+        self.data_received = 0
+        self.packets_received = 0
+        self.finished = False
+        self.analyses = {}
+        self.__fin_end = {}        # { port : sequence number after its FIN }
+
+
+    def __str__(self):
+        return 'ID={}  port1={}  port2={}  # of packets={}'.format(self.ID, self.port1, self.port2, self.counter)
+
+
+    def set_port(self, packet):
+        self.port1 = packet.source_port
+        self.port2 = packet.dest_port
+
+
+    def get_packet(self, index):
+        if index >= 0 and index < len(self.flow):
+            return self.flow[index]
+        else:
+            return None
+
+
+    def add_packet(self, packet):
+        if self.keep_packets:
+            self.flow.append(packet)
+        if self.first_time is None:
+            self.first_time = packet.time_stamp
+        self.last_time = packet.time_stamp
+        self.counter += 1
+        self.bytes += packet.size
+        if packet.source_port == self.port1:
+            self.data_sent += packet.payload_len
+        else:
+            self.data_received += packet.payload_len
+            self.packets_received += 1
+        self.__update_state(packet)
+        for analyzer in self.analyses.values():
+            analyzer.add_packet(packet)
+
+
+    def __update_state(self, packet):
+        if packet.rst:
+            self.finished = True
+        elif packet.fin:
+            self.__fin_end[packet.source_port] = seq_add(packet.sequence_num, packet.payload_len + 1)
+        elif len(self.__fin_end) == 2 and packet.ack and packet.ack_num == self.__fin_end.get(packet.dest_port):
+            self.finished = True
+
+
+    def release(self):
+        '''Drop the stored packets and the analyzers, keep the counters'''
+        self.flow = []
+        self.analyses = {}
+
+
+class FlowPass:
+    '''An analysis that runs over every flow while the capture is read, see the module docstring.
+       Subclasses set name and implement start and finish.
+
+    Attributes:
+        name (str): key of the records of the pass in FlowManager.records
+    '''
+    name = None
+
+    def start(self, flow):
+        '''Return the analyzer of a new flow: any object with add_packet(packet)
+
+        Args:
+            flow (Flow): the new flow, its ports are set but it has no packet yet
+        '''
+        raise NotImplementedError
+
+
+    def finish(self, flow, analyzer, reason):
+        '''Return the record of a flow being closed
+
+        Args:
+            flow (Flow): the flow, its packets are not released yet
+            analyzer: what start returned for this flow
+            reason (str): one of the CLOSE_ reasons
+        '''
+        raise NotImplementedError
+
+
+def flow_key(packet):
+    '''Return the key of the flow a packet belongs to, the same for both directions
+
+    Args:
+        packet (Packet): a parsed packet
+
+    Return:
+        (tuple) ((ip, port), (ip, port)), the smaller endpoint first
+    '''
+    source = (packet.source_ip, packet.source_port)
+    dest   = (packet.dest_ip, packet.dest_port)
+    return (source, dest) if source < dest else (dest, source)
+
+
+class FlowManager:
+    '''Manage some flows
+
+    Every packet finds its flow with one dict lookup, and the flows are kept in order of
+    their last packet, so the idle ones are found at the front without a scan.
+
+    By default every flow is kept until the end. For long captures the manager can close
+    flows instead: when they finish (RST, or both FINs acknowledged), when they are idle for
+    idle_timeout seconds of capture time, or when a new flow would exceed max_flows (the least
+    recently active flow is evicted). A closed flow is summarized, handed to on_close, released
+    and forgotten, so the memory is bounded by max_flows.
+
+    Attributes:
+        flow_class (type): the Flow created for a new flow, overridden by the analyses
+        flows (OrderedDict): { flow key : Flow }, the least recently active flow first
+        flow_info (dict): a dict { ID : (flow key, port1, port2) }
+        keep_packets (bool): every new Flow stores its packets, False to only keep counters
+        idle_timeout (float): close a flow without a packet for this many seconds, None to never
+        max_flows (int): the most flows tracked at once, None for no limit
+        close_finished (bool): close a flow as soon as it finishes
+        on_close (function): called with the summary of every closed flow, see summarize
+        closed (dict): { reason : number of flows closed for it }
+        passes (list): FlowPass run over every flow
+        records (dict): { FlowPass.name : list of the records of the closed flows }
+    '''
+    flow_class = Flow
+
+    def __init__(self, keep_packets=True, idle_timeout=None, max_flows=None, close_finished=False, on_close=None,
+                 passes=None):
+        self.flows = OrderedDict()
+        self.flow_info = {}
+        self.keep_packets = keep_packets
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.close_finished = close_finished
+        self.on_close = on_close
+        self.closed = {}
+        self.passes = list(passes) if passes else []
+        self.records = dict((flow_pass.name, []) for flow_pass in self.passes)
+
+
+    @property
+    def flow_list(self):
+        '''(list) the flows in the order they were created'''
+        return sorted(self.flows.values(), key=lambda flow: flow.ID)
+
+
+    def add_packet(self, packet):
+        '''Add a packet to the flow it belongs to.
+           If the flow does not exit, then create a new one.
+
+        Args:
+            packet (Packet)
+
+        Return:
+            (Flow) the flow of the packet
+        '''
+        if self.idle_timeout is not None:
+            self.expire(packet.time_stamp, self.idle_timeout)
+        key = flow_key(packet)
+        flow = self.flows.get(key)
+        if flow is None:  # this is a "new packet": the packet does not belong to any existed flow
+            if self.max_flows is not None and len(self.flows) >= self.max_flows:
+                self.close_flow(next(iter(self.flows.values())), CLOSE_EVICTED)
+            flow = self.flow_class(self.keep_packets)
+            flow.set_port(packet)
+            for flow_pass in self.passes:
+                flow.analyses[flow_pass.name] = flow_pass.start(flow)
+            self.add_flow(flow, key)
+        else:             # this packet belongs to an existed flow
+            self.flows.move_to_end(key)
+        flow.add_packet(packet)
+        if flow.finished and self.close_finished:
+            self.close_flow(flow, CLOSE_RST if packet.rst else CLOSE_FIN)
+        return flow
+
+
+    def add_flow(self, flow, key):
+        '''Add a new flow into FlowManager
+
+        Args:
+            flow (Flow): a new flow to be added to the flow manager
+            key (tuple): the flow key of its packets, see flow_key
+        '''
+        self.flows[key] = flow
+        self.flow_info[flow.ID] = (key, flow.port1, flow.port2)
+
+
+    def remove_flow(self, ID):
+        '''Stop tracking a flow
+
+        Return:
+            (Flow) the removed flow, None if it is unknown
+        '''
+        info = self.flow_info.pop(ID, None)
+        if info is None:
+            return None
+        return self.flows.pop(info[0])
+
+
+    def summarize(self, flow, reason):
+        '''Return what on_close receives for a closed flow, the flow itself here.
+           analysis_pcap_tcp returns its FlowSummary.
+        '''
+        return flow
+
+
+    def close_flow(self, flow, reason):
+        '''Collect the records of the passes and the summary of a flow, hand the summary to on_close,
+           then forget the flow and release its packets
+
+        Args:
+            flow (Flow): a tracked flow
+            reason (str): one of the CLOSE_ reasons
+
+        Return:
+            the summary of the flow, see summarize
+        '''
+        self.remove_flow(flow.ID)
+        for flow_pass in self.passes:
+            analyzer = flow.analyses.get(flow_pass.name)
+            if analyzer is not None:
+                self.records[flow_pass.name].append(flow_pass.finish(flow, analyzer, reason))
+        summary = self.summarize(flow, reason)
+        flow.release()
+        self.closed[reason] = self.closed.get(reason, 0) + 1
+        if self.on_close:
+            self.on_close(summary)
+        return summary
+
+
+    def close_all(self, reason=CLOSE_END):
+        '''Close every flow still tracked, at the end of a capture
+
+        Return:
+            (list) the summaries of the closed flows
+        '''
+        return [self.close_flow(flow, reason) for flow in self.flow_list]
+
+
+    def expire(self, now, idle_timeout):
+        '''Close the flows without a packet for more than idle_timeout seconds
+
+        Args:
+            now (float): the current time stamp
+            idle_timeout (float): seconds
+
+        Return:
+            (list) the summaries of the closed flows, the longest idle first
+        '''
+        expired = []
+        flows = self.flows
+        while flows:
+            flow = next(iter(flows.values()))
+            if now - flow.last_time <= idle_timeout:
+                break
+            expired.append(self.close_flow(flow, CLOSE_IDLE))
+        return expired
+
+
+    def where_is_packet(self, packet):
+        '''Return the flow to which a packet belongs
+
+        Args:
+            packet (Packet): a packet
+
+        Return:
+            (Flow): None if the packet starts a new flow
+        '''
+        return self.flows.get(flow_key(packet))
+
+
+    def size(self):
+        return len(self.flows)
+
+
+    def get_flow(self, ID):
+        '''Get a flow according to its ID
+
+        Args:
+            flow (Flow): Identification number
+        '''
+        flow_info = self.flow_info.get(ID)
+        if flow_info:
+            return self.flows[flow_info[0]]
+        return None
+
+
+def read_capture(source, flow_manager, packet_filter=None):
+    '''Decode every TCP packet of a capture once and add it to a flow manager.
+       The file is read one packet at a time, it is never loaded whole.
+
+    Args:
+        source: a pcap file path, '-' for stdin, or an open binary file
+        flow_manager (FlowManager)
+        packet_filter (function): add only the packets for which it returns True
+
+    Return:
+        (int) the number of TCP packets added
+    '''
+    if source == '-':
+        f = sys.stdin.buffer
+    elif isinstance(source, str):
+        f = open(source, 'rb')
+    else:
+        f = source
+    try:
+        pcap = dpkt.pcap.Reader(f)
+        linktype = pcap.datalink()
+        add_packet = flow_manager.add_packet
+        packets = 0
+        for packet_bytes in pcap:
+            packet = Packet(packet_bytes)
+            if not packet.parse_byte_info(linktype):
+                continue
+            if packet_filter is not None and not packet_filter(packet):
+                continue
+            add_packet(packet)
+            packets += 1
+    finally:
+        if f is not source and f is not sys.stdin.buffer:
+            f.close()
+    return packets
+
+
+def analyze(source, passes, keep_packets=False, **options):
+    '''Run several passes over one decoding of a capture
+
+    Args:
+        source: a pcap file path, '-' for stdin, or an open binary file
+        passes (list): FlowPass
+        keep_packets (bool): store the packets of the flows, not needed by the passes
+        options: the other arguments of FlowManager (idle_timeout, max_flows...)
+
+    Return:
+        (dict) { FlowPass.name : list of records, one per flow }
+    '''
+    flow_manager = FlowManager(keep_packets=keep_packets, passes=passes, **options)
+    read_capture(source, flow_manager)
+    flow_manager.close_all()
+    return flow_manager.records
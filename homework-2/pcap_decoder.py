@@ -0,0 +1,245 @@
+'''Decode the link, IP and TCP headers of a captured frame.
+
+The decoder works on the raw bytes returned by dpkt.pcap.Reader, without building dpkt
+objects. Every layer is a small function picked from a dict by link type, ethertype or
+option kind, and every fixed header is read with a precompiled struct.Struct.
+
+Supported:
+    link:    Ethernet (with any number of 802.1Q/802.1ad VLAN tags), Linux cooked (SLL),
+             BSD loopback (NULL/LOOP), raw IP
+    network: IPv4 (any IHL, first fragments only), IPv6 (skips extension headers)
+    TCP:     MSS, window scale, SACK permitted, SACK blocks and timestamps options
+'''
+
+import socket
+import struct
+
+
+DLT_NULL      = 0
+DLT_EN10MB    = 1
+DLT_RAW       = 101
+DLT_LOOP      = 108
+DLT_LINUX_SLL = 113
+DLT_RAW_ALT   = 12     # OpenBSD uses 12 for raw IP
+
+ETH_P_IP   = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_TCP = 6
+
+TCPOPT_EOL       = 0
+TCPOPT_NOP       = 1
+TCPOPT_MSS       = 2
+TCPOPT_WSCALE    = 3
+TCPOPT_SACK_PERM = 4
+TCPOPT_SACK      = 5
+TCPOPT_TIMESTAMP = 8
+
+MAX_WSCALE = 14        # RFC 7323: larger shift counts are treated as 14
+
+# the length of the fixed size options; a SACK option is 2 bytes plus 8 per block
+OPTION_LENGTHS = {TCPOPT_MSS: 4, TCPOPT_WSCALE: 3, TCPOPT_SACK_PERM: 2, TCPOPT_TIMESTAMP: 10}
+
+_ETHERTYPE = struct.Struct('!H')
+_NULL_FAMILY_LE = struct.Struct('<I')
+_NULL_FAMILY_BE = struct.Struct('!I')
+_IPV4 = struct.Struct('!BxHHHxB2x4s4s')       # ver_ihl, total length, id, frag, protocol, src, dst
+_IPV6 = struct.Struct('!4xHBx16s16s')         # payload length, next header, src, dst
+_TCP  = struct.Struct('!HHIIBBHHH')           # ports, seq, ack, offset, flags, window, checksum, urgent
+_U16  = struct.Struct('!H')
+_U32X2 = struct.Struct('!II')
+
+_IPV6_EXT_HEADERS = (0, 43, 60)               # hop-by-hop, routing, destination options
+_IPV6_FRAGMENT = 44
+_IPV6_AH = 51
+
+# BSD loopback stores the address family in host byte order; IPv6 uses different values per OS
+_NULL_FAMILIES = {2: ETH_P_IP, 10: ETH_P_IPV6, 24: ETH_P_IPV6, 28: ETH_P_IPV6, 30: ETH_P_IPV6}
+
+# (mss, wscale, sack_permitted, sack_blocks, tsval, tsecr) when a segment carries no option
+NO_OPTIONS = (None, None, False, (), None, None)
+
+
+def _link_ethernet(buf):
+    '''Return (ethertype, offset of the network header), skipping VLAN tags'''
+    ethertype = _ETHERTYPE.unpack_from(buf, 12)[0]
+    offset = 14
+    while ethertype in VLAN_TYPES:
+        ethertype = _ETHERTYPE.unpack_from(buf, offset + 2)[0]
+        offset += 4
+    return ethertype, offset
+
+
+def _link_sll(buf):
+    return _ETHERTYPE.unpack_from(buf, 14)[0], 16
+
+
+def _link_null(buf):
+    family = _NULL_FAMILY_LE.unpack_from(buf, 0)[0]
+    if family > 0xFFFF:
+        family = _NULL_FAMILY_BE.unpack_from(buf, 0)[0]
+    return _NULL_FAMILIES.get(family), 4
+
+
+def _link_loop(buf):
+    return _NULL_FAMILIES.get(_NULL_FAMILY_BE.unpack_from(buf, 0)[0]), 4
+
+
+def _link_raw(buf):
+    version = buf[0] >> 4
+    if version == 4:
+        return ETH_P_IP, 0
+    if version == 6:
+        return ETH_P_IPV6, 0
+    return None, 0
+
+
+LINK_DECODERS = {
+    DLT_EN10MB:    _link_ethernet,
+    DLT_LINUX_SLL: _link_sll,
+    DLT_NULL:      _link_null,
+    DLT_LOOP:      _link_loop,
+    DLT_RAW:       _link_raw,
+    DLT_RAW_ALT:   _link_raw,
+}
+
+
+def _network_ipv4(buf, offset):
+    '''Return (src, dst, offset of the TCP header, end of the IP packet) or None'''
+    ver_ihl, total_len, _, frag, protocol, src, dst = _IPV4.unpack_from(buf, offset)
+    if protocol != IPPROTO_TCP or frag & 0x1FFF:    # not TCP, or not the first fragment
+        return None
+    end = offset + total_len
+    if total_len == 0 or end > len(buf):            # TSO captures report 0, truncated captures are short
+        end = len(buf)
+    return src, dst, offset + 4*(ver_ihl & 0x0F), end
+
+
+def _network_ipv6(buf, offset):
+    payload_len, next_header, src, dst = _IPV6.unpack_from(buf, offset)
+    end = offset + 40 + payload_len
+    if payload_len == 0 or end > len(buf):          # jumbograms, truncated captures
+        end = len(buf)
+    offset += 40
+    while next_header != IPPROTO_TCP:
+        if next_header in _IPV6_EXT_HEADERS:
+            next_header, length = buf[offset], (buf[offset + 1] + 1)*8
+        elif next_header == _IPV6_FRAGMENT:
+            if _U16.unpack_from(buf, offset + 2)[0] & 0xFFF8:
+                return None
+            next_header, length = buf[offset], 8
+        elif next_header == _IPV6_AH:
+            next_header, length = buf[offset], (buf[offset + 1] + 2)*4
+        else:
+            return None
+        offset += length
+    return src, dst, offset, end
+
+
+NETWORK_DECODERS = {
+    ETH_P_IP:   _network_ipv4,
+    ETH_P_IPV6: _network_ipv6,
+}
+
+
+def _option_mss(buf, offset, length, options):
+    options[0] = _U16.unpack_from(buf, offset + 2)[0]
+
+
+def _option_wscale(buf, offset, length, options):
+    options[1] = min(buf[offset + 2], MAX_WSCALE)
+
+
+def _option_sack_perm(buf, offset, length, options):
+    options[2] = True
+
+
+def _option_sack(buf, offset, length, options):
+    options[3] = tuple(_U32X2.unpack_from(buf, start) for start in range(offset + 2, offset + length, 8))
+
+
+def _option_timestamp(buf, offset, length, options):
+    options[4], options[5] = _U32X2.unpack_from(buf, offset + 2)
+
+
+OPTION_DECODERS = {
+    TCPOPT_MSS:       _option_mss,
+    TCPOPT_WSCALE:    _option_wscale,
+    TCPOPT_SACK_PERM: _option_sack_perm,
+    TCPOPT_SACK:      _option_sack,
+    TCPOPT_TIMESTAMP: _option_timestamp,
+}
+
+
+def decode_options(buf, offset, end):
+    '''Decode the TCP options between offset and end. An option whose length is wrong for
+       its kind is skipped.
+
+    Return:
+        (tuple) (mss, wscale, sack_permitted, sack_blocks, tsval, tsecr)
+    '''
+    options = list(NO_OPTIONS)
+    while offset < end:
+        kind = buf[offset]
+        if kind == TCPOPT_EOL:
+            break
+        if kind == TCPOPT_NOP:
+            offset += 1
+            continue
+        if offset + 1 >= end:
+            break
+        length = buf[offset + 1]
+        if length < 2 or offset + length > end:     # malformed, stop rather than guess
+            break
+        decoder = OPTION_DECODERS.get(kind)
+        if kind == TCPOPT_SACK:
+            valid = length >= 10 and length % 8 == 2
+        else:
+            valid = length == OPTION_LENGTHS.get(kind)
+        if decoder and valid:
+            decoder(buf, offset, length, options)
+        offset += length
+    return tuple(options)
+
+
+def decode(buf, linktype=DLT_EN10MB):
+    '''Decode a captured frame down to its TCP header
+
+    Args:
+        buf (bytes): the frame, as returned by dpkt.pcap.Reader
+        linktype (int): the datalink type of the capture, pcap.datalink()
+
+    Return:
+        (tuple) (src, dst, source port, dest port, seq, ack, header length, flags, window,
+                 checksum, urgent, payload start, payload end, options),
+                 or None if the frame is not a TCP segment this decoder understands
+    '''
+    link = LINK_DECODERS.get(linktype)
+    if link is None:
+        raise ValueError('unsupported datalink type {}'.format(linktype))
+    try:
+        ethertype, offset = link(buf)
+        network = NETWORK_DECODERS.get(ethertype)
+        if network is None:
+            return None
+        network = network(buf, offset)
+        if network is None:
+            return None
+        src, dst, offset, end = network
+        sport, dport, seq, ack, data_offset, flags, window, checksum, urgent = _TCP.unpack_from(buf, offset)
+        head_len = 4*(data_offset >> 4)
+        options = NO_OPTIONS
+        if head_len > 20:
+            options = decode_options(buf, offset + 20, min(offset + head_len, end))
+    except (IndexError, struct.error):
+        return None
+
+    start = min(offset + head_len, end)
+    return (src, dst, sport, dport, seq, ack, head_len, flags, window, checksum, urgent, start, end, options)
+
+
+def ip_to_str(address):
+    '''Convert a 4 or 16 byte address from decode() into its text form'''
+    family = socket.AF_INET if len(address) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, address)
@@ -0,0 +1,365 @@
+'''Index a pcap file once, then read single flows or time ranges without scanning it again.
+
+Usage:
+    python pcap_index.py build capture.pcap [--time-step 1.0]
+    python pcap_index.py flows capture.pcap
+    python pcap_index.py query capture.pcap [--port PORT] [--ip IP] [--start T1] [--end T2]
+
+build writes a sidecar file (capture.pcap.idx) with:
+
+    a coarse time index   the time and file offset of the first packet of every time step
+                          that has packets, so a long silence in the capture costs nothing
+    a flow directory      for every TCP flow: its endpoints, number of packets, first and
+                          last time stamps, and where its offsets are stored
+    offset arrays         the file offset of every packet of every flow, 8 bytes each
+
+Queries map both files with mmap. A flow is read by jumping to its packets, a time range
+by jumping to the time step that contains its start, so the cost of a query depends on
+the packets it returns, not on the size of the capture. load_flows() builds an
+analysis_pcap_tcp.FlowManager from the selected flows only, for the usual Part A/B analyses.
+
+Times given to the API are absolute time stamps, the command line takes seconds since the
+first packet of the capture.
+'''
+
+import argparse
+import mmap
+import os
+import socket
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+import pcap_decoder
+from analysis_pcap_tcp import Packet, FlowManager
+
+
+INDEX_MAGIC   = b'PCAPIDX1'
+INDEX_VERSION = 1
+
+PCAP_MAGIC = {                      # magic --> (byte order, time stamp fraction unit)
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAP_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+_HEADER    = struct.Struct('<8sHIddQdII')   # magic, version, linktype, time step, first time, pcap size, pcap mtime, flows, time steps
+_TIME_STEP = struct.Struct('<dQ')           # time, offset of its first packet
+_ENDPOINT  = struct.Struct('<BH')           # address length, port; the address follows
+_FLOW      = struct.Struct('<QddQ')         # packets, first time, last time, position of the offsets
+
+FlowEntry = namedtuple('FlowEntry', ['key', 'packets', 'first', 'last', 'position'])
+
+
+def pcap_records(buf):
+    '''Walk the records of a pcap file held in memory
+
+    Args:
+        buf (mmap or bytes): the whole pcap file
+
+    Return:
+        (generator) (offset of the record header, time stamp, start and end of the frame in buf)
+    '''
+    order, unit = _pcap_format(buf)
+    record = struct.Struct(order + 'IIII')
+    size = len(buf)
+    offset = PCAP_HEADER_LEN
+    while offset + RECORD_HEADER_LEN <= size:
+        seconds, fraction, captured, _ = record.unpack_from(buf, offset)
+        start = offset + RECORD_HEADER_LEN
+        if start + captured > size:
+            break                                   # truncated last record
+        yield offset, seconds + fraction*unit, start, start + captured
+        offset = start + captured
+
+
+def _pcap_format(buf):
+    if len(buf) < PCAP_HEADER_LEN or bytes(buf[:4]) not in PCAP_MAGIC:
+        raise ValueError('not a pcap file (pcapng is not supported)')
+    return PCAP_MAGIC[bytes(buf[:4])]
+
+
+def _pcap_linktype(buf):
+    order, _ = _pcap_format(buf)
+    return struct.unpack_from(order + 'I', buf, 20)[0] & 0x0FFFFFFF
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def index_path_of(pcap_path):
+    return pcap_path + '.idx'
+
+
+def build_index(pcap_path, index_path=None, time_step=1.0):
+    '''Scan a pcap file once and write its sidecar index
+
+    Args:
+        pcap_path (str): the capture
+        index_path (str): where to write the index, <pcap_path>.idx by default
+        time_step (float): seconds per step of the time index
+
+    Return:
+        (str) the path of the index
+    '''
+    index_path = index_path or index_path_of(pcap_path)
+    buf = _map(pcap_path)
+    linktype = _pcap_linktype(buf)
+    flows = {}                                      # flow key --> [offsets, first, last]
+    times = []                                      # (time, offset) of the first packet of a step, sparse
+    first_time = None
+    last_step = -1
+    for offset, time_stamp, start, end in pcap_records(buf):
+        if first_time is None:
+            first_time = time_stamp
+        step = int((time_stamp - first_time)//time_step)
+        if step > last_step:                        # a packet earlier than its predecessor keeps its step
+            times.append((time_stamp, offset))
+            last_step = step
+        fields = pcap_decoder.decode(buf[start:end], linktype)
+        if fields is None:
+            continue
+        source, dest = (fields[0], fields[2]), (fields[1], fields[3])
+        key = (source, dest) if source < dest else (dest, source)
+        flow = flows.get(key)
+        if flow is None:
+            flows[key] = [array('Q', [offset]), time_stamp, time_stamp]
+        else:
+            flow[0].append(offset)
+            flow[2] = time_stamp
+
+    stat = os.stat(pcap_path)
+    with open(index_path, 'wb') as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, linktype, time_step, first_time or 0.0,
+                             stat.st_size, stat.st_mtime, len(flows), len(times)))
+        for step in times:
+            f.write(_TIME_STEP.pack(*step))
+        directory_size = sum(_flow_entry_size(key) for key in flows)
+        position = f.tell() + directory_size
+        for key, (offsets, first, last) in flows.items():
+            for address, port in key:
+                f.write(_ENDPOINT.pack(len(address), port))
+                f.write(address)
+            f.write(_FLOW.pack(len(offsets), first, last, position))
+            position += 8*len(offsets)
+        for offsets, _, _ in flows.values():
+            f.write(offsets.tobytes())              # native order, the index is not meant to move across machines
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+    return index_path
+
+
+def _flow_entry_size(key):
+    return sum(_ENDPOINT.size + len(address) for address, _ in key) + _FLOW.size
+
+
+class PcapIndex:
+    '''A pcap file and its sidecar index, both memory mapped
+
+    Attributes:
+        pcap_path (str): the capture
+        linktype (int): the datalink type of the capture
+        first_time (float): time stamp of the first packet
+        time_step (float): seconds per step of the time index
+        flows (dict): { flow key : FlowEntry }, see pcap_core.flow_key
+    '''
+
+    def __init__(self, pcap_path, index_path=None, build=True):
+        '''Open the index of a capture, building it first if it is missing or older than the capture
+
+        Raises:
+            ValueError: the index does not belong to this capture and build is False
+        '''
+        self.pcap_path = pcap_path
+        index_path = index_path or index_path_of(pcap_path)
+        if build and not self.__is_current(index_path):
+            build_index(pcap_path, index_path)
+        self.__pcap = _map(pcap_path)
+        self.__index = _map(index_path)
+        (magic, version, self.linktype, self.time_step, self.first_time,
+         pcap_size, _, flow_count, time_count) = _HEADER.unpack_from(self.__index, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or pcap_size != len(self.__pcap):
+            raise ValueError('{} is not an index of {}'.format(index_path, pcap_path))
+        self.__record = struct.Struct(_pcap_format(self.__pcap)[0] + 'IIII')
+        self.__unit = _pcap_format(self.__pcap)[1]
+
+        position = _HEADER.size
+        self.__times = []
+        self.__time_offsets = []
+        for _ in range(time_count):
+            time_stamp, offset = _TIME_STEP.unpack_from(self.__index, position)
+            self.__times.append(time_stamp)
+            self.__time_offsets.append(offset)
+            position += _TIME_STEP.size
+        self.flows = {}
+        for _ in range(flow_count):
+            key = []
+            for _ in range(2):
+                length, port = _ENDPOINT.unpack_from(self.__index, position)
+                position += _ENDPOINT.size
+                key.append((bytes(self.__index[position:position + length]), port))
+                position += length
+            packets, first, last, offsets = _FLOW.unpack_from(self.__index, position)
+            position += _FLOW.size
+            key = tuple(key)
+            self.flows[key] = FlowEntry(key, packets, first, last, offsets)
+
+
+    def __is_current(self, index_path):
+        try:
+            with open(index_path, 'rb') as f:
+                header = f.read(_HEADER.size)
+            magic, version, _, _, _, pcap_size, pcap_mtime, _, _ = _HEADER.unpack(header)
+        except (OSError, struct.error):
+            return False
+        stat = os.stat(self.pcap_path)
+        return magic == INDEX_MAGIC and version == INDEX_VERSION and pcap_size == stat.st_size \
+            and pcap_mtime == stat.st_mtime
+
+
+    def close(self):
+        for buf in (self.__pcap, self.__index):
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+
+    def find(self, port=None, ip=None):
+        '''Return the flows with an endpoint on this port and/or address
+
+        Args:
+            port (int): a port number, None for any
+            ip (str): an IPv4 or IPv6 address in text form, None for any
+
+        Return:
+            (list) FlowEntry, in order of their first packet
+        '''
+        address = None
+        if ip is not None:
+            address = socket.inet_pton(socket.AF_INET6 if ':' in ip else socket.AF_INET, ip)
+        found = []
+        for entry in self.flows.values():
+            for endpoint_address, endpoint_port in entry.key:
+                if (port is None or endpoint_port == port) and (address is None or endpoint_address == address):
+                    found.append(entry)
+                    break
+        return sorted(found, key=lambda entry: entry.first)
+
+
+    def __read(self, offset):
+        seconds, fraction, captured, _ = self.__record.unpack_from(self.__pcap, offset)
+        start = offset + RECORD_HEADER_LEN
+        return seconds + fraction*self.__unit, self.__pcap[start:start + captured]
+
+
+    def __time_at(self, offset):
+        seconds, fraction, _, _ = self.__record.unpack_from(self.__pcap, offset)
+        return seconds + fraction*self.__unit
+
+
+    def offsets(self, key):
+        '''Return the file offsets of the packets of a flow, a read only view into the index'''
+        entry = self.flows[key]
+        return memoryview(self.__index)[entry.position:entry.position + 8*entry.packets].cast('Q')
+
+
+    def flow_packets(self, key, start=None, end=None):
+        '''Read the packets of one flow, optionally only those between two time stamps.
+           The packets of a flow are in capture order, so the time range is found by bisection.
+
+        Return:
+            (generator) (time stamp, frame), like dpkt.pcap.Reader
+        '''
+        offsets = self.offsets(key)
+        low, high = 0, len(offsets)
+        if start is not None:
+            low = bisect_left(offsets, start, key=self.__time_at)
+        if end is not None:
+            high = bisect_right(offsets, end, lo=low, key=self.__time_at)
+        for i in range(low, high):
+            yield self.__read(offsets[i])
+
+
+    def time_range(self, start=None, end=None):
+        '''Read every packet between two time stamps, starting from the closest time index entry
+
+        Return:
+            (generator) (time stamp, frame), like dpkt.pcap.Reader
+        '''
+        step = 0
+        if start is not None:
+            step = max(bisect_right(self.__times, start) - 1, 0)
+        offset = self.__time_offsets[step] if self.__time_offsets else PCAP_HEADER_LEN
+        size = len(self.__pcap)
+        while offset + RECORD_HEADER_LEN <= size:
+            time_stamp, frame = self.__read(offset)
+            offset += RECORD_HEADER_LEN + len(frame)
+            if end is not None and time_stamp > end:
+                break
+            if start is None or time_stamp >= start:
+                yield time_stamp, frame
+
+
+    def load_flows(self, keys=None, start=None, end=None, flow_manager=None):
+        '''Build a FlowManager from some flows only
+
+        Args:
+            keys (list): flow keys (or FlowEntry) to load, None for all the flows of the index
+            start (float): skip the packets before this time stamp
+            end (float): skip the packets after this time stamp
+            flow_manager (FlowManager): add the packets to this one instead of a new one
+
+        Return:
+            (FlowManager)
+        '''
+        flow_manager = flow_manager if flow_manager is not None else FlowManager()
+        if keys is None:
+            keys = sorted(self.flows, key=lambda key: self.flows[key].first)
+        for key in keys:
+            key = key.key if isinstance(key, FlowEntry) else key
+            for packet_bytes in self.flow_packets(key, start, end):
+                packet = Packet(packet_bytes)
+                if packet.parse_byte_info(self.linktype):
+                    flow_manager.add_packet(packet)
+        return flow_manager
+
+
+def _endpoints(key):
+    return '{}:{} <-> {}:{}'.format(pcap_decoder.ip_to_str(key[0][0]), key[0][1], pcap_decoder.ip_to_str(key[1][0]), key[1][1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and query a flow and time index of a pcap file')
+    parser.add_argument('command', choices=['build', 'flows', 'query'])
+    parser.add_argument('pcap')
+    parser.add_argument('--time-step', type=float, default=1.0, help='seconds per step of the time index (build)')
+    parser.add_argument('--port', type=int, help='only the flows with this port (query)')
+    parser.add_argument('--ip', help='only the flows with this address (query)')
+    parser.add_argument('--start', type=float, help='seconds since the first packet (query)')
+    parser.add_argument('--end', type=float, help='seconds since the first packet (query)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        print('Wrote {}'.format(build_index(args.pcap, time_step=args.time_step)))
+    else:
+        index = PcapIndex(args.pcap)
+        if args.command == 'flows':
+            for entry in sorted(index.flows.values(), key=lambda entry: entry.first):
+                print('{0:60s} {1:8d} packets  {2:10.4f} s --> {3:10.4f} s'.format(
+                      _endpoints(entry.key), entry.packets, entry.first - index.first_time, entry.last - index.first_time))
+        else:
+            start = index.first_time + args.start if args.start is not None else None
+            end   = index.first_time + args.end if args.end is not None else None
+            flow_manager = index.load_flows(index.find(args.port, args.ip), start, end)
+            for flow in flow_manager.flow_list:
+                summary = flow.summary()
+                print('{0}  {1:1.5f} Mbps  {2} retransmissions  RTT {3:1.5f} s'.format(
+                      flow, summary.throughput, summary.retransmissions, summary.rtt))
+        index.close()
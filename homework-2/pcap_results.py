@@ -0,0 +1,117 @@
+'''Typed records of the Part A/B/C analyses, and writers for lists of them.
+
+Every analysis that prints its results also has a silent form that returns these records
+(see Flow.summary, Flow.first_2_transactions, FlowManager.results in analysis_pcap_tcp and
+Flow.http_record, FlowManager.capture_record in analysis_pcap_http). The writers take any
+list of records of one type, namedtuples or dicts, or a numpy structured array, and write
+them in bulk as JSON lines, csv, npy or parquet. A value that does not exist (no RTT sample,
+no TLS handshake, a NaN of an array...) is None, an empty csv cell or a parquet null.
+'''
+
+import csv
+import json
+from collections import namedtuple
+
+
+# Part A (a): one exchange of the first two transactions after the handshake
+TransactionRecord = namedtuple('TransactionRecord', [
+    'flow', 'index',                                   # Flow.ID, 1 or 2
+    'sender_seq', 'sender_ack', 'sender_window',
+    'receiver_seq', 'receiver_ack', 'receiver_window',
+    'scale',                                           # window scaling factor of the flow
+])
+
+# Part A (b, c, d) and B (2): the metrics of one TCP flow
+FlowSummary = namedtuple('FlowSummary', [
+    'ID', 'port1', 'port2',
+    'start', 'end', 'duration',         # time stamps of the first and last packet, seconds
+    'packets', 'bytes',                 # all packets, headers included
+    'throughput',                       # Mbps, as in Flow.compute_throughput
+    'data_sent', 'data_received',       # payload bytes from port1 / from port2
+    'packets_sent',                     # packets from port1, the denominator of the loss rate
+    'retransmissions', 'losses', 'loss_rate',
+    'fast_retransmits', 'timeouts', 'tail_loss_probes', 'spurious',
+    'rtt', 'srtt', 'min_rtt',           # seconds, -1 without a sample
+    'rtt_samples',
+    'theoretical_throughput',           # Mbps, None when the loss rate or the RTT is 0
+    'reason',                           # why the flow was closed, None while it is tracked
+])
+
+# Part C: one connection of an HTTP capture
+HTTPFlowRecord = namedtuple('HTTPFlowRecord', [
+    'flow', 'port1', 'port2',
+    'label',                            # application protocol, see tls_classifier
+    'tls_version', 'sni', 'alpn_offered',
+    'client_records', 'server_records', # TLS application data records per direction
+    'requests',                         # HTTP requests reassembled from plain HTTP
+    'packets_from_server', 'bytes_from_server',
+    'first_time', 'last_time',
+])
+
+# Part C (2, 3): one capture
+CaptureRecord = namedtuple('CaptureRecord', [
+    'protocol',                         # the HTTP version of the capture
+    'flows', 'load_time', 'packets', 'bytes',
+])
+
+
+def _is_array(records):
+    return getattr(getattr(records, 'dtype', None), 'names', None) is not None
+
+
+def as_dicts(records):
+    '''Return the records as a list of dicts, the fields in order'''
+    if _is_array(records):
+        names = records.dtype.names
+        return [dict(zip(names, (None if value != value else value for value in row)))    # NaN --> None
+                for row in records.tolist()]
+    return [record._asdict() if hasattr(record, '_asdict') else dict(record) for record in records]
+
+
+def to_jsonl(records, path):
+    with open(path, 'w') as f:
+        for record in as_dicts(records):
+            f.write(json.dumps(record, allow_nan=False))
+            f.write('\n')
+
+
+def to_csv(records, path):
+    rows = as_dicts(records)
+    with open(path, 'w', newline='') as f:
+        if not rows:
+            return
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def to_npy(records, path):
+    '''Write the records as a numpy structured array, needs numpy
+    '''
+    import numpy as np
+    if not _is_array(records):
+        rows = as_dicts(records)
+        records = np.rec.fromrecords([tuple(row.values()) for row in rows], names=list(rows[0])) if rows else np.array([])
+    np.save(path, records)
+
+
+def to_parquet(records, path):
+    '''Write the records as parquet, needs pandas with pyarrow or fastparquet
+    '''
+    import pandas as pd
+    pd.DataFrame(records if _is_array(records) else as_dicts(records)).to_parquet(path, index=False)
+
+
+def write_records(records, path):
+    '''Write the records in the format given by the extension of path: .jsonl, .csv, .npy or .parquet
+    '''
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        to_jsonl(records, path)
+    elif path.endswith('.csv'):
+        to_csv(records, path)
+    elif path.endswith('.npy'):
+        to_npy(records, path)
+    elif path.endswith('.parquet'):
+        to_parquet(records, path)
+    else:
+        raise ValueError('unknown output format: {}'.format(path))
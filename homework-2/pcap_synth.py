@@ -0,0 +1,336 @@
+'''Write synthetic TCP captures whose metrics are known in advance.
+
+Usage:
+    python pcap_synth.py out.pcap [--flows 10] [--packets 1000] [--loss 0.01] [--reorder 0.01]
+                                  [--rtt 0.05] [--http-objects 0] [--object-size 10000] [--seed 1]
+
+Every flow is simulated as a client and a server on Ethernet/IPv4, seen from a capture
+point next to the client, with the RTT split evenly between the two directions:
+
+    bulk (default)   the client sends --packets full data segments to the server
+    http             the client sends --http-objects GET requests one after the other on
+                     the same connection, the server answers each with --object-size bytes
+
+The sender paces a window of segments per RTT. Each data segment of a bulk transfer or of
+an HTTP response (not the retransmissions) is lost with probability --loss and delayed past
+the next one or two segments with probability --reorder. The receiver acknowledges every segment with a cumulative ACK and
+echoes timestamps as in RFC 7323. A hole is retransmitted after 3 duplicate ACKs, or after
+a retransmission timeout if too few segments follow it. Retransmissions are never lost.
+
+generate() returns the ground truth of every flow (FlowTruth), which the analyzers should
+find again: packets, bytes, retransmissions, RTT, HTTP requests. See pcap_benchmark.
+'''
+
+import argparse
+import heapq
+import random
+import struct
+from collections import namedtuple
+
+import dpkt
+
+
+FlowTruth = namedtuple('FlowTruth', [
+    'client_port', 'server_port',
+    'start', 'end',                         # capture time stamps of the first and last packet
+    'packets', 'bytes',                     # captured packets, headers included
+    'data_sender',                          # port of the side sending most of the data
+    'data_bytes',                           # payload bytes of that side, retransmissions excluded
+    'data_segments',                        # data segments of that side, retransmissions excluded
+    'packets_sent',                         # captured packets from the client
+    'losses', 'fast_retransmits', 'timeouts', 'reordered',
+    'rtt',                                  # seconds
+    'requests',                             # HTTP requests, 0 for a bulk flow
+])
+
+CLIENT_MAC = b'\x02\x00\x00\x00\x00\x01'
+SERVER_MAC = b'\x02\x00\x00\x00\x00\x02'
+SERVER_PORT = 80
+FIRST_CLIENT_PORT = 20000
+
+FIN, SYN, RST, PSH, ACK = 0x01, 0x02, 0x04, 0x08, 0x10
+
+WINDOW = 10                 # segments paced per RTT
+MAX_REORDER_DELAY = 2       # pacing gaps, a reordered segment arrives 1 to 2 gaps late
+WSCALE = 7
+RECEIVE_WINDOW = 65535 >> WSCALE << WSCALE
+DUPACK_THRESHOLD = 3
+MIN_RTO = 0.2
+
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_TCP  = struct.Struct('!HHIIBBHHH')
+_TIMESTAMP = struct.Struct('!BBBBII')       # NOP, NOP, kind 8, length 10, TSval, TSecr
+_SYN_OPTIONS = struct.Struct('!BBHBB')      # MSS, SACK permitted; timestamps and window scale follow
+_WSCALE_OPTION = struct.Struct('!BBBB')     # NOP, kind 3, length 3, shift count
+_CHECKSUM = struct.Struct('!10H')
+
+
+def _ip_checksum(header):
+    total = sum(_CHECKSUM.unpack(header))
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def build_frame(macs, src_ip, dst_ip, sport, dport, seq, ack, flags, tsval, tsecr, payload=b'', syn_mss=None):
+    '''Build an Ethernet/IPv4/TCP frame with a timestamps option (and the SYN options when syn_mss is set).
+       The TCP checksum is left at 0, the analyzers do not check it.
+    '''
+    if syn_mss is not None:
+        options = (_SYN_OPTIONS.pack(2, 4, syn_mss, 4, 2) + _TIMESTAMP.pack(1, 1, 8, 10, tsval, tsecr)[2:]
+                   + _WSCALE_OPTION.pack(1, 3, 3, WSCALE))
+        window = 65535
+    else:
+        options = _TIMESTAMP.pack(1, 1, 8, 10, tsval, tsecr)
+        window = RECEIVE_WINDOW >> WSCALE
+    tcp_length = 20 + len(options)
+    tcp = _TCP.pack(sport, dport, seq & 0xFFFFFFFF, ack & 0xFFFFFFFF, (tcp_length//4) << 4, flags, window, 0, 0)
+    ip = bytearray(_IPV4.pack(0x45, 0, 20 + tcp_length + len(payload), 0, 0x4000, 64, 6, 0, src_ip, dst_ip))
+    struct.pack_into('!H', ip, 10, _ip_checksum(ip))
+    return macs + b'\x08\x00' + bytes(ip) + tcp + options + payload
+
+
+class FlowSimulator:
+    '''Simulate one connection and collect its captured frames
+
+    Attributes:
+        frames (list): (capture time stamp, frame), not sorted
+        truth (dict): the counters of FlowTruth
+    '''
+
+    def __init__(self, index, start, rtt, loss, reorder, mss, rng):
+        self.rng = rng
+        self.rtt = rtt
+        self.owd = rtt/2
+        self.loss = loss
+        self.reorder = reorder
+        self.mss = mss
+        self.rto = max(MIN_RTO, 2*rtt)
+        self.client_ip = bytes((10, 0, 0, 1 + index % 250)) if index < 250 else bytes((10, 1, index >> 8 & 0xFF, index & 0xFF))
+        self.server_ip = bytes((10, 0, 1, 1))
+        self.client_port = FIRST_CLIENT_PORT + index
+        self.frames = []
+        self.time = start
+        # per side: next sequence number, time stamp clock offset, last TSval received from the other side
+        self.next_seq = {'client': rng.getrandbits(32), 'server': rng.getrandbits(32)}
+        self.clock = {'client': rng.randrange(1 << 30), 'server': rng.randrange(1 << 30)}
+        self.ts_recent = {'client': 0, 'server': 0}
+        self.truth = dict(losses=0, fast_retransmits=0, timeouts=0, reordered=0, requests=0,
+                          data={'client': [0, 0], 'server': [0, 0]}, packets_sent=0)
+
+
+    def other(self, side):
+        return 'server' if side == 'client' else 'client'
+
+
+    def tsval(self, side, time):
+        return (self.clock[side] + int(time*1000)) & 0xFFFFFFFF
+
+
+    def emit(self, side, time, seq, flags, payload=b'', tsval=None, tsecr=None, syn_mss=None, delay=0.0):
+        '''Capture a frame sent by side at time (on the clock of the simulation)
+           The client's frames are captured when sent, the server's when they reach the client.
+        '''
+        if side == 'client':
+            macs, capture = SERVER_MAC + CLIENT_MAC, time
+            src, dst, sport, dport = self.client_ip, self.server_ip, self.client_port, SERVER_PORT
+            self.truth['packets_sent'] += 1
+        else:
+            macs, capture = CLIENT_MAC + SERVER_MAC, time + self.owd + delay
+            src, dst, sport, dport = self.server_ip, self.client_ip, SERVER_PORT, self.client_port
+        ack = self.next_seq[self.other(side)] if flags & ACK else 0
+        tsval = self.tsval(side, time) if tsval is None else tsval
+        tsecr = self.ts_recent[side] if tsecr is None else tsecr
+        self.frames.append((capture, build_frame(macs, src, dst, sport, dport, seq, ack, flags, tsval, tsecr, payload, syn_mss)))
+        return tsval
+
+
+    def handshake(self):
+        t = self.time
+        tsval = self.emit('client', t, self.next_seq['client'], SYN, syn_mss=self.mss)
+        self.next_seq['client'] += 1
+        self.ts_recent['server'] = tsval
+        tsval = self.emit('server', t + self.owd, self.next_seq['server'], SYN | ACK, syn_mss=self.mss)
+        self.next_seq['server'] += 1
+        self.ts_recent['client'] = tsval
+        self.emit('client', t + self.rtt, self.next_seq['client'], ACK)
+        self.time = t + self.rtt
+
+
+    def transfer(self, side, data, lossy=True):
+        '''Send data from side to the other one, until all of it is acknowledged
+
+        Args:
+            side (str): 'client' or 'server'
+            data (bytes): the payload
+            lossy (bool): the data segments may be lost or reordered
+        '''
+        receiver = self.other(side)
+        base = self.next_seq[side]
+        segments = [data[i:i + self.mss] for i in range(0, len(data), self.mss)]
+        gap = self.rtt/WINDOW
+        start = self.time
+        events = []                                 # (time, order, kind, segment index, TSval)
+        order = 0
+        for i in range(len(segments)):
+            heapq.heappush(events, (start + i*gap, order, 'send', i, None))
+            order += 1
+        received = [False]*len(segments)
+        retransmitted = [False]*len(segments)
+        cumulative = 0                              # first segment the receiver misses
+        last_ack, dupacks = 0, 0
+        truth = self.truth
+        truth['data'][side][0] += len(data)
+        truth['data'][side][1] += len(segments)
+        time = start
+
+        while cumulative < len(segments):
+            if not events:                          # retransmission timeout of the first hole
+                time += self.rto
+                truth['timeouts'] += 1
+                retransmitted[cumulative] = True
+                heapq.heappush(events, (time, order, 'retransmit', cumulative, None))
+                order += 1
+            time, _, kind, i, tsval = heapq.heappop(events)
+            seq = base + i*self.mss
+            if kind in ('send', 'retransmit'):
+                lost = kind == 'send' and lossy and self.rng.random() < self.loss
+                delay = 0.0
+                if kind == 'send' and lossy and not lost and self.rng.random() < self.reorder:
+                    delay = gap*(1 + (MAX_REORDER_DELAY - 1)*self.rng.random())    # after the next one or two segments
+                    truth['reordered'] += 1
+                if lost:
+                    truth['losses'] += 1
+                if side == 'client' or not lost:
+                    tsval = self.emit(side, time, seq, ACK | PSH, segments[i], delay=delay)
+                else:
+                    tsval = self.tsval(side, time)
+                if not lost:
+                    heapq.heappush(events, (time + self.owd + delay, order, 'arrive', i, tsval))
+                    order += 1
+            elif kind == 'arrive':
+                received[i] = True
+                advanced = i == cumulative
+                while cumulative < len(segments) and received[cumulative]:
+                    cumulative += 1
+                if advanced:
+                    self.ts_recent[receiver] = tsval
+                ack = base + (cumulative*self.mss if cumulative < len(segments) else len(data))
+                self.next_seq[side] = ack                  # the ACK field of the receiver's frames
+                tsval = self.emit(receiver, time, self.next_seq[receiver], ACK)
+                heapq.heappush(events, (time + self.owd, order, 'ack', cumulative, tsval))
+                order += 1
+            else:                                          # the sender gets an ACK
+                self.ts_recent[side] = tsval
+                if i == last_ack:
+                    dupacks += 1
+                    if dupacks == DUPACK_THRESHOLD and i < len(segments) and not retransmitted[i]:
+                        retransmitted[i] = True
+                        truth['fast_retransmits'] += 1
+                        heapq.heappush(events, (time, order, 'retransmit', i, None))
+                        order += 1
+                elif i > last_ack:
+                    last_ack, dupacks = i, 0
+        self.next_seq[side] = base + len(data)
+        # the last event is the arrival of the data, the client knows half an RTT later if it sent it
+        self.time = time + (self.owd if side == 'client' else 0)
+
+
+    def close(self):
+        t = self.time
+        self.emit('client', t, self.next_seq['client'], FIN | ACK)
+        self.next_seq['client'] += 1
+        self.emit('server', t + self.owd, self.next_seq['server'], FIN | ACK)
+        self.next_seq['server'] += 1
+        self.emit('client', t + self.rtt, self.next_seq['client'], ACK)
+
+
+    def run_bulk(self, packets):
+        self.handshake()
+        self.transfer('client', b'\0'*(packets*self.mss))
+        self.close()
+
+
+    def run_http(self, objects, object_size):
+        self.handshake()
+        for k in range(objects):
+            request = 'GET /object{} HTTP/1.1\r\nHost: synthetic.example\r\n\r\n'.format(k).encode('ascii')
+            self.transfer('client', request, lossy=False)
+            response = 'HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(object_size).encode('ascii') + b'x'*object_size
+            self.transfer('server', response)
+            self.truth['requests'] += 1
+        self.close()
+
+
+    def flow_truth(self):
+        self.frames.sort(key=lambda frame: frame[0])
+        truth = self.truth
+        sender = 'client' if truth['data']['client'][0] >= truth['data']['server'][0] else 'server'
+        return FlowTruth(
+            client_port=self.client_port, server_port=SERVER_PORT,
+            start=self.frames[0][0], end=self.frames[-1][0],
+            packets=len(self.frames), bytes=sum(len(frame) for _, frame in self.frames),
+            data_sender=self.client_port if sender == 'client' else SERVER_PORT,
+            data_bytes=truth['data'][sender][0], data_segments=truth['data'][sender][1],
+            packets_sent=truth['packets_sent'],
+            losses=truth['losses'], fast_retransmits=truth['fast_retransmits'], timeouts=truth['timeouts'],
+            reordered=truth['reordered'], rtt=self.rtt, requests=truth['requests'])
+
+
+def generate(path, flows=10, packets=1000, loss=0.0, reorder=0.0, rtt=0.05, http_objects=0,
+             object_size=10000, mss=1448, spacing=0.01, seed=1):
+    '''Write a synthetic capture
+
+    Args:
+        path (str): the pcap file to write
+        flows (int): number of connections, started every spacing seconds
+        packets (int): data segments of every bulk flow
+        loss (float): loss probability of a data segment
+        reorder (float): reordering probability of a data segment
+        rtt (float): round trip time in seconds
+        http_objects (int): if positive, every flow is an HTTP/1.1 connection with this many requests
+        object_size (int): bytes of every HTTP response body
+        mss (int): maximum segment size
+        seed (int): the same seed writes the same capture
+
+    Return:
+        (list) FlowTruth of every flow, in order of their client port
+    '''
+    rng = random.Random(seed)
+    truths = []
+    streams = []
+    for index in range(flows):
+        simulator = FlowSimulator(index, 1e9 + index*spacing, rtt, loss, reorder, mss, rng)
+        if http_objects > 0:
+            simulator.run_http(http_objects, object_size)
+        else:
+            simulator.run_bulk(packets)
+        truths.append(simulator.flow_truth())
+        streams.append(simulator.frames)
+    with open(path, 'wb') as f:
+        writer = dpkt.pcap.Writer(f, snaplen=65535)
+        for time_stamp, frame in heapq.merge(*streams, key=lambda frame: frame[0]):
+            writer.writepkt(frame, time_stamp)
+    return truths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic TCP capture with known metrics')
+    parser.add_argument('pcap')
+    parser.add_argument('--flows', type=int, default=10)
+    parser.add_argument('--packets', type=int, default=1000, help='data segments per bulk flow')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--rtt', type=float, default=0.05, help='seconds')
+    parser.add_argument('--http-objects', type=int, default=0, help='HTTP requests per flow instead of a bulk transfer')
+    parser.add_argument('--object-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--truth', help='write the ground truth as .jsonl, .csv or .parquet')
+    args = parser.parse_args()
+
+    truths = generate(args.pcap, args.flows, args.packets, args.loss, args.reorder, args.rtt,
+                      args.http_objects, args.object_size, seed=args.seed)
+    print('Wrote {}: {} flows, {} packets'.format(args.pcap, len(truths), sum(truth.packets for truth in truths)))
+    if args.truth:
+        from pcap_results import write_records
+        write_records(truths, args.truth)
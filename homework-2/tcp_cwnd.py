@@ -0,0 +1,172 @@
+'''Passive congestion window estimation for one TCP flow.
+
+The sender's congestion window is not on the wire, but the bytes in flight are: the
+highest sequence number sent minus the highest ACK received. The estimator divides the
+flow into rounds, a round ends when the ACK of the first byte sent after the round began
+arrives (one RTT), and takes the largest flight of a round as its cwnd estimate.
+
+Every round is labeled with the sender's phase:
+
+    slow start            the window grows multiplicatively until the first loss (or until
+                          the growth slows down to additive, like HyStart would)
+    congestion avoidance  the window is at or above ssthresh
+    fast recovery         from a fast retransmission until the data sent before the loss
+                          is acknowledged
+    rto                   from a retransmission timeout until the data sent before the loss
+                          is acknowledged
+
+The retransmissions are told apart by tcp_retrans.RetransmissionClassifier: a tail loss
+probe or a spurious retransmission is not a loss. The result is a compact time series that
+can be written with pcap_results.write_records.
+'''
+
+from collections import namedtuple
+
+import tcp_retrans
+from pcap_results import write_records
+from tcp_retrans import RetransmissionClassifier
+from tcp_seq import seq_add, seq_diff, seq_lt, seq_leq
+
+
+SLOW_START           = 0
+CONGESTION_AVOIDANCE = 1
+FAST_RECOVERY        = 2
+RTO                  = 3
+PHASES = ('slow_start', 'congestion_avoidance', 'fast_recovery', 'rto')
+
+SLOW_START_GROWTH = 1.5    # a round growing less than this factor is no longer slow start
+
+SERIES_FIELDS = ('time_stamp', 'cwnd', 'flight', 'ssthresh', 'phase')
+CwndRecord = namedtuple('CwndRecord', SERIES_FIELDS)      # one round, the phase by name
+
+
+class CwndEstimator:
+    '''Estimate the congestion window of the data sent by one side of a flow
+
+    Attributes:
+        sender_port (int): the port of the side whose window is estimated
+        mss (int): maximum segment size, used as the lower bound of ssthresh
+        classifier (RetransmissionClassifier): tells the fast retransmissions from the timeouts; when
+                    given to the constructor, the caller feeds it each packet before the estimator
+        series (list): one (time_stamp, cwnd, flight, ssthresh, phase) tuple per round,
+                       ssthresh is -1 while unknown, phase is an index into PHASES
+        events (list): loss events, a list of (time_stamp, phase) with phase FAST_RECOVERY or RTO
+        phase (int): the current phase
+        ssthresh (int): the estimated slow start threshold, -1 before the first loss
+    '''
+
+    def __init__(self, sender_port, mss=1448, classifier=None):
+        self.sender_port = sender_port
+        self.mss = mss
+        self.classifier = classifier if classifier else RetransmissionClassifier(sender_port, keep_retransmissions=False)
+        self.__own_classifier = classifier is None
+        self.series = []
+        self.events = []
+        self.phase = SLOW_START
+        self.ssthresh = -1
+        self.__snd_una = None
+        self.__snd_nxt = None
+        self.__recovery_point = None
+        self.__round_end = None
+        self.__round_flight = 0
+        self.__last_cwnd = 0
+
+
+    def add_packet(self, packet):
+        '''Feed the next packet of the flow, in capture order
+
+        Args:
+            packet (Packet): a parsed packet of the flow
+        '''
+        if self.__own_classifier:
+            self.classifier.add_packet(packet)
+        if packet.source_port == self.sender_port:
+            self.__add_sent(packet)
+        elif packet.ack:
+            self.__add_ack(packet)
+
+
+    def flight(self):
+        '''Return the bytes currently in flight'''
+        if self.__snd_nxt is None:
+            return 0
+        return seq_diff(self.__snd_nxt, self.__snd_una)
+
+
+    def __add_sent(self, packet):
+        length = packet.payload_len + packet.syn + packet.fin
+        if length == 0:
+            return
+        seq = packet.sequence_num
+        end = seq_add(seq, length)
+        if self.__snd_nxt is None:
+            self.__snd_una = seq
+            self.__snd_nxt = seq
+            self.__round_end = end
+
+        if seq_lt(seq, self.__snd_nxt):               # retransmission, already classified
+            kind = self.classifier.last_retransmission.kind
+            if kind == tcp_retrans.RTO and self.phase != RTO:
+                self.__enter_loss(packet.time_stamp, RTO)
+            elif kind == tcp_retrans.FAST_RETRANSMIT and self.phase not in (FAST_RECOVERY, RTO):
+                self.__enter_loss(packet.time_stamp, FAST_RECOVERY)
+        if seq_lt(self.__snd_nxt, end):
+            self.__snd_nxt = end
+        self.__round_flight = max(self.__round_flight, self.flight())
+
+
+    def __enter_loss(self, time_stamp, phase):
+        self.ssthresh = max(self.flight()//2, 2*self.mss)
+        self.__recovery_point = self.__snd_nxt
+        self.phase = phase
+        self.events.append((time_stamp, phase))
+
+
+    def __add_ack(self, packet):
+        if self.__snd_una is None:
+            return
+        ack = packet.ack_num
+        if seq_lt(self.__snd_nxt, ack):
+            return
+        if seq_lt(self.__snd_una, ack):
+            self.__snd_una = ack
+            if self.phase in (FAST_RECOVERY, RTO) and seq_leq(self.__recovery_point, ack):
+                self.phase = CONGESTION_AVOIDANCE if self.phase == FAST_RECOVERY else SLOW_START
+            if seq_leq(self.__round_end, ack):
+                self.__end_round(packet.time_stamp)
+
+
+    def __end_round(self, time_stamp):
+        cwnd = self.__round_flight
+        if self.phase == SLOW_START:
+            if self.ssthresh < 0 and len(self.series) >= 2 and cwnd < SLOW_START_GROWTH*self.__last_cwnd:
+                self.ssthresh = cwnd                   # left slow start without a loss
+            if 0 <= self.ssthresh <= cwnd:
+                self.phase = CONGESTION_AVOIDANCE
+        self.series.append((time_stamp, cwnd, self.flight(), self.ssthresh, self.phase))
+        self.__last_cwnd = cwnd
+        self.__round_end = self.__snd_nxt
+        self.__round_flight = self.flight()
+
+
+    def to_numpy(self, path=None):
+        '''Return the series as a numpy structured array, and save it as .npy if path is given
+        '''
+        import numpy as np
+        dtype = [('time_stamp', 'f8'), ('cwnd', 'u4'), ('flight', 'u4'), ('ssthresh', 'i4'), ('phase', 'u1')]
+        array = np.array(self.series, dtype=dtype)
+        if path:
+            np.save(path, array)
+        return array
+
+
+    def records(self):
+        '''Return the series as a list of CwndRecord'''
+        return [CwndRecord(time_stamp, cwnd, flight, ssthresh, PHASES[phase])
+                for time_stamp, cwnd, flight, ssthresh, phase in self.series]
+
+
+    def export(self, path):
+        '''Write the series in the format given by the extension of path: .jsonl, .csv, .npy or .parquet
+        '''
+        write_records(self.records(), path)
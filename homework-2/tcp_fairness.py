@@ -0,0 +1,318 @@
+'''Fairness of the TCP flows competing for a link.
+
+The throughput of every flow (all bytes of both directions, headers included, as in
+Flow.compute_throughput) is binned into time windows. A flow counts from the window of its
+first packet to the window of its last; a window in which it sends nothing counts as 0.
+For every window:
+
+    Jain's index   J = (sum x)^2 / (n * sum x^2) over the n active flows, 1 when they all
+                   get the same throughput, 1/n when one flow gets everything
+    share          the fraction of the window's total throughput a flow gets; normalized by
+                   the fair share 1/n it is 1 for a fair flow, above 1 for a greedy one
+    utilization    the total throughput over the capacity of the bottleneck, given or
+                   estimated as the largest total of any window
+
+Convergence: the capture is cut into epochs wherever the number of active flows changes
+(a flow joins or leaves). An epoch with at least two flows converges at the first window
+from which J stays at or above the threshold for SUSTAIN windows (all of them in a shorter
+epoch), and its convergence time is the time from the start of the epoch to that window.
+The last window of an epoch is not checked: it is usually cut short by the end of the
+capture or taken by the teardown of a flow.
+
+The packets are sampled by FairnessPass while the capture is read (see pcap_core), or from
+the stored packets of analysis_pcap_tcp.FlowManager. The histogram is one numpy pass over
+all the samples. Only the (flow, window) cells with traffic are stored, so thousands of
+concurrent flows over a long capture do not need a flows x windows matrix.
+'''
+
+import argparse
+from array import array
+from collections import namedtuple
+
+from pcap_core import FlowPass
+from pcap_results import write_records
+
+
+FAIR_INDEX = 0.9       # default convergence threshold of Jain's index
+SUSTAIN = 3            # windows the index must stay above the threshold to count as converged
+
+# the time stamps and sizes of the packets of one flow, in capture order
+FlowSamples = namedtuple('FlowSamples', ['ID', 'port1', 'port2', 'times', 'sizes'])
+
+# a stretch of windows with the same number of active flows
+FairnessEpoch = namedtuple('FairnessEpoch', [
+    'start', 'end',             # time stamps, end excluded
+    'flows',                    # active flows
+    'mean_index',               # mean Jain's index of its windows
+    'convergence_time',         # seconds, None if the index never stays above the threshold long enough
+])
+
+# how one flow fared over its lifetime
+FlowShare = namedtuple('FlowShare', [
+    'ID', 'port1', 'port2',
+    'windows',                  # windows from its first to its last packet
+    'mean_throughput',          # Mbps, averaged over its windows
+    'mean_share',               # fraction of the total throughput, averaged over its windows
+    'normalized_share',         # share times the number of active flows, averaged, 1 is fair
+])
+
+WINDOW_FIELDS = ('time_stamp', 'flows', 'throughput', 'index', 'utilization')
+FLOW_FIELDS = ('flow', 'time_stamp', 'throughput', 'share')
+
+
+class ThroughputSampler:
+    '''Record the time stamp and size of every packet of a flow, 12 bytes a packet
+
+    Attributes:
+        times (array): time stamps, doubles
+        sizes (array): packet sizes, unsigned ints
+    '''
+    __slots__ = ('times', 'sizes')
+
+    def __init__(self):
+        self.times = array('d')
+        self.sizes = array('I')
+
+
+    def add_packet(self, packet):
+        self.times.append(packet.time_stamp)
+        self.sizes.append(packet.size)
+
+
+class FairnessPass(FlowPass):
+    '''Sample every flow for the fairness analysis as a pass of pcap_core.FlowManager,
+       records are FlowSamples
+    '''
+    name = 'fairness'
+
+    def start(self, flow):
+        return ThroughputSampler()
+
+
+    def finish(self, flow, analyzer, reason):
+        return FlowSamples(flow.ID, flow.port1, flow.port2, analyzer.times, analyzer.sizes)
+
+
+def flow_samples(flow):
+    '''Return the FlowSamples of a flow from its stored packets'''
+    sampler = ThroughputSampler()
+    for packet in flow.flow:
+        sampler.add_packet(packet)
+    return FlowSamples(flow.ID, flow.port1, flow.port2, sampler.times, sampler.sizes)
+
+
+class FairnessAnalysis:
+    '''Throughput of competing flows per time window and their fairness, needs numpy
+
+    Attributes:
+        window (float): length of a window in seconds
+        start (float): time stamp of the start of the first window
+        flows (list): FlowSamples of the flows with at least one packet
+        first_window (ndarray): window of the first packet of every flow
+        last_window (ndarray): window of the last packet of every flow
+        cell_flow (ndarray): position in flows of every (flow, window) cell with traffic
+        cell_window (ndarray): window of every cell
+        throughput (ndarray): Mbps of every cell
+        active (ndarray): number of active flows of every window
+        total (ndarray): Mbps of all the flows of every window
+        index (ndarray): Jain's index of every window, nan without traffic
+        capacity (float): Mbps of the bottleneck
+    '''
+
+    def __init__(self, flows, window=1.0, capacity=None):
+        '''Bin the samples of the flows into windows
+
+        Args:
+            flows (list): FlowSamples, see FairnessPass and flow_samples
+            window (float): seconds
+            capacity (float): Mbps of the bottleneck, None to use the largest total of a window
+        '''
+        import numpy as np
+        if window <= 0:
+            raise ValueError('the window must be positive')
+        self.window = window
+        self.flows = [flow for flow in flows if len(flow.times)]
+        if not self.flows:
+            raise ValueError('no packet to analyze')
+
+        counts = np.array([len(flow.times) for flow in self.flows])
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        times = np.concatenate([np.frombuffer(flow.times, dtype=np.float64) for flow in self.flows])
+        sizes = np.concatenate([np.frombuffer(flow.sizes, dtype=np.uintc) for flow in self.flows])
+        owner = np.repeat(np.arange(len(self.flows)), counts)
+
+        self.start = times.min()
+        windows = ((times - self.start)//window).astype(np.int64)
+        num_windows = int(windows.max()) + 1
+        self.first_window = np.minimum.reduceat(windows, offsets)   # the packets of a flow are contiguous
+        self.last_window  = np.maximum.reduceat(windows, offsets)
+        joins = np.bincount(self.first_window, minlength=num_windows + 1)
+        leaves = np.bincount(self.last_window + 1, minlength=num_windows + 1)
+        self.active = np.cumsum(joins - leaves)[:num_windows]
+
+        cells, inverse = np.unique(owner*num_windows + windows, return_inverse=True)
+        self.cell_flow = cells//num_windows
+        self.cell_window = cells % num_windows
+        self.throughput = np.bincount(inverse, weights=sizes)*8.0/(window*1000000)
+        self.total = np.bincount(self.cell_window, weights=self.throughput, minlength=num_windows)
+        squares = np.bincount(self.cell_window, weights=self.throughput**2, minlength=num_windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.index = self.total**2/(self.active*squares)
+        self.capacity = capacity if capacity else float(self.total.max())
+
+
+    def times(self):
+        '''Return the time stamp of the start of every window'''
+        import numpy as np
+        return self.start + np.arange(len(self.total))*self.window
+
+
+    def utilization(self):
+        '''Return the total throughput of every window over the capacity'''
+        return self.total/self.capacity if self.capacity > 0 else self.total*0.0
+
+
+    def shares(self):
+        '''Return the share of its window's total throughput of every cell'''
+        import numpy as np
+        total = self.total[self.cell_window]
+        return np.divide(self.throughput, total, out=np.zeros_like(total), where=total > 0)
+
+
+    def flow_shares(self):
+        '''Return how every flow fared over its lifetime
+
+        Return:
+            (list) FlowShare, in the order of flows
+        '''
+        import numpy as np
+        count = len(self.flows)
+        shares = self.shares()
+        lifetime = self.last_window - self.first_window + 1
+        throughput = np.bincount(self.cell_flow, weights=self.throughput, minlength=count)
+        share = np.bincount(self.cell_flow, weights=shares, minlength=count)
+        normalized = np.bincount(self.cell_flow, weights=shares*self.active[self.cell_window], minlength=count)
+        return [FlowShare(ID=flow.ID, port1=flow.port1, port2=flow.port2, windows=int(lifetime[i]),
+                          mean_throughput=throughput[i]/lifetime[i], mean_share=share[i]/lifetime[i],
+                          normalized_share=normalized[i]/lifetime[i])
+                for i, flow in enumerate(self.flows)]
+
+
+    def epochs(self, threshold=FAIR_INDEX, sustain=SUSTAIN):
+        '''Cut the capture where the number of active flows changes and find when each part converges
+
+        Args:
+            threshold (float): Jain's index from which the flows are considered fair
+            sustain (int): windows the index must stay fair from the convergence on
+
+        Return:
+            (list) FairnessEpoch of the parts with at least two active flows
+        '''
+        import numpy as np
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(self.active)) + 1, [len(self.active)]))
+        fair = self.index >= threshold                    # nan compares False
+        epochs = []
+        for first, end in zip(bounds[:-1], bounds[1:]):
+            flows = int(self.active[first])
+            if flows < 2:
+                continue
+            checked = fair[first:end - 1] if end - first > 1 else fair[first:end]
+            unfair = np.flatnonzero(~checked)
+            starts = np.concatenate(([0], unfair + 1))          # the runs of fair windows
+            stops = np.concatenate((unfair, [len(checked)]))
+            runs = stops - starts
+            sustained = np.flatnonzero(runs >= max(1, min(sustain, len(checked))))
+            converged = int(starts[sustained[0]]) if len(sustained) else None
+            index = self.index[first:end]
+            index = index[~np.isnan(index)]
+            epochs.append(FairnessEpoch(
+                start=self.start + first*self.window, end=self.start + end*self.window, flows=flows,
+                mean_index=float(index.mean()) if len(index) else None,
+                convergence_time=converged*self.window if converged is not None else None))
+        return epochs
+
+
+    def window_series(self):
+        '''Return the per-window series as a numpy structured array of WINDOW_FIELDS'''
+        import numpy as np
+        dtype = [('time_stamp', 'f8'), ('flows', 'u4'), ('throughput', 'f8'), ('index', 'f8'), ('utilization', 'f8')]
+        series = np.empty(len(self.total), dtype=dtype)
+        series['time_stamp'] = self.times()
+        series['flows'] = self.active
+        series['throughput'] = self.total
+        series['index'] = self.index
+        series['utilization'] = self.utilization()
+        return series
+
+
+    def flow_series(self):
+        '''Return the per-flow throughput of every window with traffic as a numpy structured array of FLOW_FIELDS'''
+        import numpy as np
+        dtype = [('flow', 'u4'), ('time_stamp', 'f8'), ('throughput', 'f8'), ('share', 'f8')]
+        series = np.empty(len(self.throughput), dtype=dtype)
+        series['flow'] = np.array([flow.ID for flow in self.flows])[self.cell_flow]
+        series['time_stamp'] = self.start + self.cell_window*self.window
+        series['throughput'] = self.throughput
+        series['share'] = self.shares()
+        return series
+
+
+    def export(self, path, flows_path=None):
+        '''Write the per-window series, and optionally the per-flow series, in the format given by
+           the extension of the path: .jsonl, .csv, .npy or .parquet
+        '''
+        write_records(self.window_series(), path)
+        if flows_path:
+            write_records(self.flow_series(), flows_path)
+
+
+    def print_report(self, threshold=FAIR_INDEX, top=5):
+        '''Print the fairness of the capture, its epochs and the flows furthest from their fair share
+        '''
+        import numpy as np
+        shared = (self.active >= 2) & ~np.isnan(self.index)
+        print('{} flows, {} windows of {} s, bottleneck capacity {:1.4f} Mbps'.format(
+              len(self.flows), len(self.total), self.window, self.capacity))
+        if not shared.any():
+            print('No window with two active flows')
+            return
+        index = self.index[shared]
+        print("Jain's index over {} shared windows: mean {:1.4f}  min {:1.4f}  fair (>= {}) {:1.1f}%".format(
+              int(shared.sum()), index.mean(), index.min(), threshold, 100.0*(index >= threshold).mean()))
+        print('Mean utilization {:1.1f}%'.format(100.0*self.utilization()[shared].mean()))
+        epochs = self.epochs(threshold)
+        converged = [epoch.convergence_time for epoch in epochs if epoch.convergence_time is not None]
+        print('{} epochs with competing flows, {} converged'.format(len(epochs), len(converged)), end='')
+        if converged:
+            print(', convergence time mean {:1.4f} s  max {:1.4f} s'.format(sum(converged)/len(converged), max(converged)))
+        else:
+            print()
+        shares = sorted(self.flow_shares(), key=lambda share: abs(share.normalized_share - 1), reverse=True)
+        print('\n{0:>6s} {1:>11s} {2:>8s} {3:>10s} {4:>8s} {5:>11s}'.format(
+              'flow', 'port1/port2', 'windows', 'Mbps', 'share', 'share x n'))
+        for share in shares[:top]:
+            print('{0:6d} {1:>11s} {2:8d} {3:10.4f} {4:8.4f} {5:11.4f}'.format(
+                  share.ID, '{}/{}'.format(share.port1, share.port2), share.windows,
+                  share.mean_throughput, share.mean_share, share.normalized_share))
+
+
+if __name__ == '__main__':
+    import pcap_core
+
+    parser = argparse.ArgumentParser(description='Fairness of the TCP flows of a capture')
+    parser.add_argument('pcap', help="pcap file, '-' for stdin")
+    parser.add_argument('-w', '--window', type=float, default=1.0, help='seconds per window (default 1)')
+    parser.add_argument('--capacity', type=float, help='Mbps of the bottleneck, default the busiest window')
+    parser.add_argument('--threshold', type=float, default=FAIR_INDEX, help="Jain's index considered fair (default 0.9)")
+    parser.add_argument('--top', type=int, default=5, help='print this many flows furthest from their fair share')
+    parser.add_argument('--export', help='write the per-window series as .jsonl, .csv, .npy or .parquet')
+    parser.add_argument('--export-flows', help='write the per-flow series as .jsonl, .csv, .npy or .parquet')
+    args = parser.parse_args()
+
+    records = pcap_core.analyze(args.pcap, [FairnessPass()])
+    analysis = FairnessAnalysis(records['fairness'], args.window, args.capacity)
+    analysis.print_report(args.threshold, args.top)
+    if args.export:
+        analysis.export(args.export, args.export_flows)
+    elif args.export_flows:
+        write_records(analysis.flow_series(), args.export_flows)
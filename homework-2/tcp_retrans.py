@@ -0,0 +1,210 @@
+'''Classify the retransmissions of one TCP flow in a single ordered pass.
+
+The classifier follows the sender's segments and the receiver's ACKs in capture order,
+keeping the highest ACK, the current run of duplicate ACKs and the outstanding segments.
+Every retransmission (every copy after the first, so a segment sent three times counts
+twice) gets one of these kinds:
+
+    rto              sent after the sender was idle for the retransmission timeout, even
+                     during a fast recovery, or any retransmission not of the other kinds
+    fast_retransmit  sent after 3 duplicate ACKs, or while the sender is still in the fast
+                     recovery that such a retransmission started
+    spurious         the data was already acknowledged when it was resent, or the ACK that
+                     covers it echoes the timestamp of an earlier copy (Eifel detection)
+    tail_loss_probe  the last outstanding segment resent without duplicate ACKs, sooner
+                     than the retransmission timeout
+'''
+
+from collections import deque
+
+from tcp_rtt import RTTEstimator
+from tcp_seq import seq_add, seq_lt, seq_leq
+
+
+FAST_RETRANSMIT = 'fast_retransmit'
+RTO             = 'rto'
+SPURIOUS        = 'spurious'
+TAIL_LOSS_PROBE = 'tail_loss_probe'
+KINDS = (FAST_RETRANSMIT, RTO, SPURIOUS, TAIL_LOSS_PROBE)
+
+DUPACK_THRESHOLD = 3
+TIMER_SLACK = 0.001     # seconds, a timer may seem to fire that much early once the times are rounded
+
+
+class Retransmission:
+    '''One retransmitted copy of a segment
+
+    Attributes:
+        time_stamp (float): when the copy was sent
+        seq (int): first sequence number of the copy
+        end (int): sequence number after the copy
+        kind (str): one of KINDS
+        transmission (int): 2 for the first retransmission of this data, 3 for the next...
+        tsval (int): TSval of the copy, None without timestamps
+    '''
+    __slots__ = ('time_stamp', 'seq', 'end', 'kind', 'transmission', 'tsval')
+
+    def __init__(self, time_stamp, seq, end, kind, transmission, tsval):
+        self.time_stamp = time_stamp
+        self.seq = seq
+        self.end = end
+        self.kind = kind
+        self.transmission = transmission
+        self.tsval = tsval
+
+
+class RetransmissionClassifier:
+    '''Count and classify the retransmissions of the data sent by one side of a flow
+
+    Attributes:
+        sender_port (int): the port of the side whose data is followed
+        rtt_estimator (RTTEstimator): gives the RTO that separates tail loss probes from timeouts
+        retransmissions (list): every Retransmission, in capture order, empty unless keep_retransmissions
+        last_retransmission (Retransmission): the latest one, None before the first
+        counts (dict): { kind : number of retransmissions }
+        packets_sent (int): number of packets from the sender
+        segments_sent (int): number of data segments from the sender, retransmissions included
+        highest_ack (int): highest cumulative ACK from the receiver
+    '''
+
+    def __init__(self, sender_port, rtt_estimator=None, keep_retransmissions=True):
+        self.sender_port = sender_port
+        self.keep_retransmissions = keep_retransmissions
+        self.rtt_estimator = rtt_estimator if rtt_estimator else RTTEstimator(sender_port)
+        self.__own_estimator = rtt_estimator is None
+        self.retransmissions = []
+        self.last_retransmission = None
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.packets_sent  = 0
+        self.segments_sent = 0
+        self.highest_ack = None
+        self.__snd_nxt = None
+        self.__dupacks = 0
+        self.__recovery_point = None          # fast recovery lasts until this is acknowledged
+        self.__outstanding = deque()          # [seq, end, transmissions], in sequence order
+        self.__transmissions = {}             # seq --> the same list, for retransmission lookups
+        self.__unconfirmed = deque()          # retransmissions waiting for their ACK, to detect spurious ones
+        self.__last_activity = None           # time of the last data sent or ACK that advanced
+
+
+    def add_packet(self, packet):
+        '''Feed the next packet of the flow, in capture order
+
+        Args:
+            packet (Packet): a parsed packet of the flow
+        '''
+        if self.__own_estimator:
+            self.rtt_estimator.add_packet(packet)
+        if packet.source_port == self.sender_port:
+            self.packets_sent += 1
+            self.__add_sent(packet)
+        elif packet.ack:
+            self.__add_ack(packet)
+
+
+    def total(self):
+        '''Return the number of retransmissions of any kind'''
+        return sum(self.counts.values())
+
+
+    def losses(self):
+        '''Return the number of retransmissions that repaired a real loss'''
+        return self.total() - self.counts[SPURIOUS]
+
+
+    def __add_sent(self, packet):
+        length = packet.payload_len + packet.syn + packet.fin
+        if length == 0:
+            return
+        self.segments_sent += 1
+        seq = packet.sequence_num
+        end = seq_add(seq, length)
+        time_stamp = packet.time_stamp
+        if self.__snd_nxt is None:
+            self.__snd_nxt = seq
+            self.highest_ack = seq
+
+        if seq_lt(seq, self.__snd_nxt):
+            self.__add_retransmission(packet, seq, end)
+            if seq_lt(self.__snd_nxt, end):               # the part beyond snd_nxt is new data
+                record = [self.__snd_nxt, end, 1]
+                self.__outstanding.append(record)
+                self.__transmissions[self.__snd_nxt] = record
+                self.__snd_nxt = end
+        else:
+            record = [seq, end, 1]
+            self.__outstanding.append(record)
+            self.__transmissions[seq] = record
+            self.__snd_nxt = end
+        self.__last_activity = time_stamp
+
+
+    def __add_retransmission(self, packet, seq, end):
+        time_stamp = packet.time_stamp
+        record = self.__transmissions.get(seq)
+        if record is not None:
+            record[2] += 1
+            transmission = record[2]
+        else:
+            transmission = 2                  # resegmented data, or acknowledged and forgotten
+
+        timed_out = time_stamp - self.__last_activity >= self.rtt_estimator.rto - TIMER_SLACK
+        if seq_leq(end, self.highest_ack):
+            kind = SPURIOUS
+        elif timed_out:                       # a timeout also ends a fast recovery
+            kind = RTO
+            self.__recovery_point = None
+        elif self.__dupacks >= DUPACK_THRESHOLD or self.__in_recovery():
+            kind = FAST_RETRANSMIT
+            if not self.__in_recovery():
+                self.__recovery_point = self.__snd_nxt
+        elif end == self.__snd_nxt:
+            kind = TAIL_LOSS_PROBE
+        else:
+            kind = RTO
+            self.__recovery_point = None
+
+        retransmission = Retransmission(time_stamp, seq, end, kind, transmission, packet.tsval)
+        self.last_retransmission = retransmission
+        if self.keep_retransmissions:
+            self.retransmissions.append(retransmission)
+        self.counts[kind] += 1
+        if kind != SPURIOUS and packet.tsval is not None:
+            self.__unconfirmed.append(retransmission)
+
+
+    def __in_recovery(self):
+        return self.__recovery_point is not None and seq_lt(self.highest_ack, self.__recovery_point)
+
+
+    def __add_ack(self, packet):
+        if self.__snd_nxt is None:
+            return
+        ack = packet.ack_num
+        if seq_lt(self.__snd_nxt, ack):
+            return
+        if seq_lt(self.highest_ack, ack):
+            self.highest_ack = ack
+            self.__dupacks = 0
+            self.__last_activity = packet.time_stamp
+            outstanding = self.__outstanding
+            while outstanding and seq_leq(outstanding[0][1], ack):
+                del self.__transmissions[outstanding.popleft()[0]]
+            if packet.tsecr is not None:
+                self.__check_spurious(ack, packet.tsecr)
+        elif ack == self.highest_ack and packet.payload_len == 0 and not (packet.syn or packet.fin) \
+                and self.__outstanding:
+            self.__dupacks += 1
+
+
+    def __check_spurious(self, ack, tsecr):
+        '''Eifel: the ACK of a retransmission echoes a TSval older than the retransmission,
+           so the receiver got an earlier copy and the retransmission was not needed
+        '''
+        unconfirmed = self.__unconfirmed
+        while unconfirmed and seq_leq(unconfirmed[0].end, ack):
+            retransmission = unconfirmed.popleft()
+            if seq_lt(tsecr, retransmission.tsval):
+                self.counts[retransmission.kind] -= 1
+                self.counts[SPURIOUS] += 1
+                retransmission.kind = SPURIOUS
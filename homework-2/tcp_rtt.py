@@ -0,0 +1,204 @@
+'''Streaming round trip time estimation for one TCP flow.
+
+The estimator is fed every packet of a flow in capture order and measures the RTT of the
+data sent by one side (the sender), as seen from the capture point:
+
+    * timestamps: an ACK that acknowledges new data and echoes a TSval (TSecr) gives the
+      time since that TSval was first sent (RFC 7323). Retransmissions carry a new TSval,
+      which is recorded as well.
+    * outstanding segments: only on a flow without timestamps, an ACK (or a new SACK block)
+      whose edge is exactly the end of an outstanding segment gives the time since that
+      segment was sent.
+
+An ACK that acknowledges a retransmitted segment gives no sample at all (Karn's rule), even
+if that segment is not the last one it acknowledges.
+
+The samples are smoothed as in RFC 6298 into SRTT, RTTVAR and RTO.
+'''
+
+from collections import deque
+
+from tcp_seq import seq_add, seq_lt, seq_leq
+
+
+ALPHA   = 1/8      # RFC 6298 gains
+BETA    = 1/4
+K       = 4
+MIN_RTO = 0.2      # Linux TCP_RTO_MIN; RFC 6298 recommends 1 second
+MAX_RTO = 120.0
+
+
+class Segment:
+    '''A data segment sent but not yet cumulatively acknowledged
+
+    Attributes:
+        seq (int):  first sequence number
+        end (int):  sequence number after the segment (seq + payload, SYN and FIN count as one)
+        time_stamp (float): time of the first transmission
+        retransmitted (bool): the segment was sent more than once
+        sacked (bool): the segment is covered by a SACK block
+    '''
+    __slots__ = ('seq', 'end', 'time_stamp', 'retransmitted', 'sacked')
+
+    def __init__(self, seq, end, time_stamp):
+        self.seq = seq
+        self.end = end
+        self.time_stamp = time_stamp
+        self.retransmitted = False
+        self.sacked = False
+
+
+class RTTEstimator:
+    '''Measure the RTT of the data sent by one side of a flow
+
+    Attributes:
+        sender_port (int): the port of the side whose data is measured
+        samples (list): the RTT time series, a list of (time stamp of the ACK, rtt), empty unless keep_samples
+        sample_count (int): number of samples taken
+        min_rtt (float): smallest sample, -1 before the first sample
+        srtt (float):    smoothed RTT, -1 before the first sample
+        rttvar (float):  RTT variation, -1 before the first sample
+        rto (float):     retransmission timeout derived from srtt and rttvar
+        snd_una (int):   oldest unacknowledged sequence number, None before the first data
+        snd_nxt (int):   next new sequence number of the sender, None before the first data
+    '''
+
+    def __init__(self, sender_port, min_rto=MIN_RTO, keep_samples=True):
+        self.sender_port = sender_port
+        self.min_rto = min_rto
+        self.keep_samples = keep_samples
+        self.samples = []
+        self.sample_count = 0
+        self.__sample_sum = 0
+        self.min_rtt = -1
+        self.srtt    = -1
+        self.rttvar  = -1
+        self.rto     = 1.0   # RFC 6298 initial RTO
+        self.snd_una = None
+        self.snd_nxt = None
+        self.__outstanding = deque()   # Segment, in sequence order
+        self.__by_end = {}             # end --> Segment, to match ACK and SACK edges
+        self.__tsval_sent = deque()    # (tsval, time stamp), in the order first sent
+        self.__timestamps = False      # the flow carries timestamps
+
+
+    def add_packet(self, packet):
+        '''Feed the next packet of the flow, in capture order
+
+        Args:
+            packet (Packet): a parsed packet of the flow
+
+        Return:
+            (float) the RTT sample taken from this packet, or None
+        '''
+        if packet.source_port == self.sender_port:
+            self.__add_sent(packet)
+            return None
+        if packet.ack:
+            return self.__add_ack(packet)
+        return None
+
+
+    def mean(self):
+        '''Return the average of all samples, -1 if there is none'''
+        if not self.sample_count:
+            return -1
+        return self.__sample_sum/self.sample_count
+
+
+    def __add_sent(self, packet):
+        seq = packet.sequence_num
+        length = packet.payload_len + packet.syn + packet.fin
+        if length == 0:
+            return
+        end = seq_add(seq, length)
+        time_stamp = packet.time_stamp
+
+        if self.snd_nxt is None:
+            self.snd_una = seq
+            self.snd_nxt = seq
+        if packet.tsval is not None:
+            self.__timestamps = True
+            if not self.__tsval_sent or seq_lt(self.__tsval_sent[-1][0], packet.tsval):
+                self.__tsval_sent.append((packet.tsval, time_stamp))
+        if seq_lt(seq, self.snd_nxt):                 # retransmission (or overlap with sent data)
+            for segment in self.__outstanding:
+                if seq_leq(end, segment.seq):
+                    break
+                if seq_lt(seq, segment.end):
+                    segment.retransmitted = True
+            if seq_leq(end, self.snd_nxt):
+                return
+            seq = self.snd_nxt                         # the part beyond snd_nxt is new data
+
+        segment = Segment(seq, end, time_stamp)
+        self.__outstanding.append(segment)
+        self.__by_end[end] = segment
+        self.snd_nxt = end
+
+
+    def __add_ack(self, packet):
+        if self.snd_una is None:
+            return None
+        ack = packet.ack_num
+        if seq_lt(self.snd_nxt, ack):                  # acknowledges data the capture never saw
+            return None
+        sample = None
+        advanced = seq_lt(self.snd_una, ack)
+        time_stamp = packet.time_stamp
+
+        timestamps = self.__timestamps or packet.tsecr is not None
+        if advanced:
+            if packet.tsecr is not None:
+                sample = self.__timestamp_sample(packet.tsecr, time_stamp)
+            elif not timestamps:
+                segment = self.__by_end.get(ack)
+                if segment is not None and not segment.sacked:
+                    sample = time_stamp - segment.time_stamp
+            outstanding = self.__outstanding
+            while outstanding and seq_lt(outstanding[0].seq, ack):
+                if outstanding[0].retransmitted:      # Karn: the ACK may be for the retransmission
+                    sample = None
+                if seq_lt(ack, outstanding[0].end):
+                    break
+                del self.__by_end[outstanding.popleft().end]
+            self.snd_una = ack
+
+        for left, right in packet.sack:
+            segment = self.__by_end.get(right)
+            if segment is None or segment.sacked:
+                continue
+            segment.sacked = True
+            if sample is None and not timestamps and not segment.retransmitted:
+                sample = time_stamp - segment.time_stamp
+
+        if sample is not None:
+            self.__update(time_stamp, sample)
+        return sample
+
+
+    def __timestamp_sample(self, tsecr, time_stamp):
+        '''Return the time since tsecr was first sent and forget all older TSvals'''
+        sent = self.__tsval_sent
+        sample = None
+        while sent and seq_leq(sent[0][0], tsecr):
+            tsval, sent_time = sent.popleft()
+            if tsval == tsecr:
+                sample = time_stamp - sent_time
+        return sample
+
+
+    def __update(self, time_stamp, rtt):
+        if self.keep_samples:
+            self.samples.append((time_stamp, rtt))
+        self.sample_count += 1
+        self.__sample_sum += rtt
+        if self.srtt < 0:
+            self.min_rtt = rtt
+            self.srtt    = rtt
+            self.rttvar  = rtt/2
+        else:
+            self.min_rtt = min(self.min_rtt, rtt)
+            self.rttvar  = (1 - BETA)*self.rttvar + BETA*abs(self.srtt - rtt)
+            self.srtt    = (1 - ALPHA)*self.srtt + ALPHA*rtt
+        self.rto = min(max(self.min_rto, self.srtt + K*self.rttvar), MAX_RTO)
@@ -0,0 +1,29 @@
+'''Modular arithmetic on 32-bit TCP sequence numbers (RFC 1982 serial number arithmetic).
+
+Sequence numbers, acknowledgements and timestamps wrap around at 2^32, so "a before b"
+must be decided on the signed distance between them rather than with a plain <.
+'''
+
+SEQ_MOD  = 1 << 32
+SEQ_HALF = 1 << 31
+
+
+def seq_add(seq, length):
+    return (seq + length) & 0xFFFFFFFF
+
+
+def seq_diff(a, b):
+    '''Return the signed distance a - b, in the range [-2^31, 2^31)'''
+    return ((a - b + SEQ_HALF) & 0xFFFFFFFF) - SEQ_HALF
+
+
+def seq_lt(a, b):
+    return seq_diff(a, b) < 0
+
+
+def seq_leq(a, b):
+    return seq_diff(a, b) <= 0
+
+
+def seq_max(a, b):
+    return b if seq_diff(a, b) < 0 else a
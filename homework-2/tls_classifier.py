@@ -0,0 +1,308 @@
+'''Identify the application protocol of a TCP connection without decrypting it.
+
+Both directions are reassembled (see http_reassembly.StreamReassembler) and scanned as TLS
+records. Only the handshake records are buffered, until the ClientHello and ServerHello are
+parsed: server name (SNI), offered and selected ALPN protocols, and the TLS version
+(supported_versions for TLS 1.3). Every other record is skipped by its length, and the
+application data records are counted per direction.
+
+A connection is labeled, in this order, by:
+    1. the ALPN protocol selected by the server ('h2', 'http/1.1', ...)
+    2. 'http/1.1' for TLS without ALPN (HTTP/2 over TLS requires ALPN)
+    3. the first bytes of a plain connection: an HTTP/1.x request, or the HTTP/2 preface ('h2c')
+    4. 'unknown'
+'''
+
+from http_reassembly import StreamReassembler
+
+
+CONTENT_CHANGE_CIPHER_SPEC = 20
+CONTENT_ALERT              = 21
+CONTENT_HANDSHAKE          = 22
+CONTENT_APPLICATION_DATA   = 23
+CONTENT_TYPES = (CONTENT_CHANGE_CIPHER_SPEC, CONTENT_ALERT, CONTENT_HANDSHAKE, CONTENT_APPLICATION_DATA, 24)
+
+HANDSHAKE_CLIENT_HELLO = 1
+HANDSHAKE_SERVER_HELLO = 2
+
+EXT_SERVER_NAME        = 0
+EXT_ALPN               = 16
+EXT_SUPPORTED_VERSIONS = 43
+
+MAX_RECORD    = (1 << 14) + 2048     # TLSCiphertext limit
+MAX_HANDSHAKE = 1 << 16              # stop buffering hello messages past this
+
+TLS_VERSIONS = {0x0300: 'SSL 3.0', 0x0301: 'TLS 1.0', 0x0302: 'TLS 1.1', 0x0303: 'TLS 1.2', 0x0304: 'TLS 1.3'}
+
+HTTP_METHODS = (b'GET ', b'POST ', b'HEAD ', b'PUT ', b'DELETE ', b'OPTIONS ', b'PATCH ', b'CONNECT ', b'TRACE ')
+H2_PREFACE = b'PRI * HTTP/2.0\r\n'
+
+
+def _u16(data, offset):
+    return (data[offset] << 8) | data[offset + 1]
+
+
+def _u24(data, offset):
+    return (data[offset] << 16) | (data[offset + 1] << 8) | data[offset + 2]
+
+
+def _vector(data, offset, length_size):
+    '''Return (the bytes of a TLS variable length vector, offset after it)'''
+    length = data[offset] if length_size == 1 else _u16(data, offset)
+    start = offset + length_size
+    if start + length > len(data):
+        raise IndexError('vector past the end of the message')
+    return data[start:start + length], start + length
+
+
+class TLSStream:
+    '''Scan one direction of a connection as TLS records
+
+    Attributes:
+        is_tls (bool): False once the stream is known not to be TLS
+        first_bytes (bytes): the first bytes of the stream, to recognize plain protocols
+        records (dict): { content type : number of records }
+        application_records (int): number of application data records
+        application_bytes (int): bytes of application data records, headers included
+        hello (dict): fields of the ClientHello or ServerHello, empty until parsed
+        error (str): why the scan stopped early, None otherwise
+    '''
+
+    def __init__(self):
+        self.is_tls = True
+        self.first_bytes = b''
+        self.records = {}
+        self.application_records = 0
+        self.application_bytes = 0
+        self.hello = {}
+        self.error = None
+        self.__header = bytearray()    # partial record header
+        self.__skip = 0                # bytes left in the current record body
+        self.__record_type = None
+        self.__handshake = bytearray() # handshake bytes kept until the hello is parsed
+
+
+    def feed(self, data, packet=None):
+        '''Scan the next in-order chunk of the stream'''
+        if len(self.first_bytes) < 16:
+            self.first_bytes += data[:16 - len(self.first_bytes)]
+        if not self.is_tls or self.error:
+            return
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if self.__skip:
+                n = min(self.__skip, size - pos)
+                if self.__record_type == CONTENT_HANDSHAKE and not self.hello:
+                    self.__handshake += data[pos:pos + n]
+                pos += n
+                self.__skip -= n
+                if self.__skip == 0 and self.__record_type == CONTENT_HANDSHAKE and not self.hello:
+                    self.__parse_handshake()
+                continue
+            n = min(5 - len(self.__header), size - pos)
+            self.__header += data[pos:pos + n]
+            pos += n
+            if len(self.__header) < 5:
+                break
+            self.__start_record()
+            if not self.is_tls:
+                return
+
+
+    def gap(self, length):
+        '''Bytes are missing. Inside the body of a record the scan goes on, 
+           anywhere else the record boundaries are lost and the scan stops (the counts so far stay valid).
+        '''
+        if length <= self.__skip and self.__record_type != CONTENT_HANDSHAKE:
+            self.__skip -= length
+            return
+        self.error = 'missing {} bytes'.format(length)
+        self.__skip = 0
+        self.__header.clear()
+        self.__handshake.clear()
+
+
+    def __start_record(self):
+        header = self.__header
+        content_type, major, length = header[0], header[1], _u16(header, 3)
+        self.__header = bytearray()
+        if content_type not in CONTENT_TYPES or major != 3 or length > MAX_RECORD:
+            self.is_tls = False
+            return
+        self.records[content_type] = self.records.get(content_type, 0) + 1
+        if content_type == CONTENT_APPLICATION_DATA:
+            self.application_records += 1
+            self.application_bytes += 5 + length
+        self.__record_type = content_type
+        self.__skip = length
+
+
+    def __parse_handshake(self):
+        data = self.__handshake
+        if len(data) < 4:
+            return
+        length = _u24(data, 1)
+        if len(data) < 4 + length:
+            if len(data) > MAX_HANDSHAKE:
+                self.__handshake.clear()
+                self.hello = {'error': 'hello too large'}
+            return                              # continues in the next record
+        handshake_type = data[0]
+        message = bytes(data[4:4 + length])
+        self.__handshake.clear()
+        try:
+            if handshake_type == HANDSHAKE_CLIENT_HELLO:
+                self.hello = parse_client_hello(message)
+            elif handshake_type == HANDSHAKE_SERVER_HELLO:
+                self.hello = parse_server_hello(message)
+            else:
+                self.hello = {'error': 'unexpected handshake type {}'.format(handshake_type)}
+        except IndexError:
+            self.hello = {'error': 'truncated hello'}
+
+
+def _parse_extensions(data, offset, hello, client):
+    if offset >= len(data):
+        return
+    extensions, _ = _vector(data, offset, 2)
+    pos = 0
+    while pos + 4 <= len(extensions):
+        ext_type = _u16(extensions, pos)
+        body, pos = _vector(extensions, pos + 2, 2)
+        if ext_type == EXT_SERVER_NAME and client:
+            names, _ = _vector(body, 0, 2)
+            if names and names[0] == 0:
+                name, _ = _vector(names, 1, 2)
+                hello['sni'] = name.decode('ascii', 'replace')
+        elif ext_type == EXT_ALPN:
+            protocols, _ = _vector(body, 0, 2)
+            offered = []
+            i = 0
+            while i < len(protocols):
+                protocol, i = _vector(protocols, i, 1)
+                offered.append(protocol.decode('ascii', 'replace'))
+            hello['alpn'] = offered
+        elif ext_type == EXT_SUPPORTED_VERSIONS:
+            if client:
+                versions, _ = _vector(body, 0, 1)
+                hello['supported_versions'] = [_u16(versions, i) for i in range(0, len(versions) - 1, 2)]
+            elif len(body) >= 2:
+                hello['version'] = _u16(body, 0)
+
+
+def parse_client_hello(message):
+    '''Parse the body of a ClientHello handshake message
+
+    Return:
+        (dict) 'type', 'version', and 'sni', 'alpn', 'supported_versions' when present
+    '''
+    hello = {'type': 'client_hello', 'version': _u16(message, 0)}
+    offset = 2 + 32
+    _, offset = _vector(message, offset, 1)       # session id
+    _, offset = _vector(message, offset, 2)       # cipher suites
+    _, offset = _vector(message, offset, 1)       # compression methods
+    _parse_extensions(message, offset, hello, True)
+    return hello
+
+
+def parse_server_hello(message):
+    '''Parse the body of a ServerHello handshake message
+
+    Return:
+        (dict) 'type', 'version' (the selected one, TLS 1.3 included), 'cipher', and 'alpn' when present
+    '''
+    hello = {'type': 'server_hello', 'version': _u16(message, 0)}
+    offset = 2 + 32
+    _, offset = _vector(message, offset, 1)       # session id
+    hello['cipher'] = _u16(message, offset)
+    offset += 3                                   # cipher suite, compression method
+    _parse_extensions(message, offset, hello, False)
+    return hello
+
+
+class TLSConnection:
+    '''Classify one TCP connection from both of its reassembled directions
+
+    Attributes:
+        client_port (int): the port of the side that sent the SYN (Flow.port1)
+        client (TLSStream): client to server direction
+        server (TLSStream): server to client direction
+    '''
+
+    def __init__(self, client_port):
+        self.client_port = client_port
+        self.client = TLSStream()
+        self.server = TLSStream()
+        self.__client_stream = StreamReassembler(self.client.feed, self.client.gap)
+        self.__server_stream = StreamReassembler(self.server.feed, self.server.gap)
+
+
+    def add_packet(self, packet):
+        if packet.source_port == self.client_port:
+            self.__client_stream.add_segment(packet)
+        else:
+            self.__server_stream.add_segment(packet)
+
+
+    def close(self):
+        self.__client_stream.flush()
+        self.__server_stream.flush()
+
+
+    def is_tls(self):
+        return self.client.hello.get('type') == 'client_hello' or self.server.hello.get('type') == 'server_hello'
+
+
+    def version(self):
+        '''Return the negotiated TLS version as text, None if no ServerHello was seen'''
+        version = self.server.hello.get('version')
+        return TLS_VERSIONS.get(version, hex(version)) if version is not None else None
+
+
+    def sni(self):
+        return self.client.hello.get('sni')
+
+
+    def alpn(self):
+        '''Return the ALPN protocol selected by the server, None without one'''
+        selected = self.server.hello.get('alpn')
+        return selected[0] if selected else None
+
+
+    def label(self):
+        '''Return the application protocol of the connection, see the module docstring'''
+        if self.is_tls():
+            return self.alpn() or 'http/1.1'
+        first = self.client.first_bytes
+        if first.startswith(H2_PREFACE[:len(first)]) and len(first) >= 4:
+            return 'h2c'
+        if first.startswith(HTTP_METHODS):
+            return 'http/1.1'
+        return 'unknown'
+
+
+    def application_bytes(self):
+        '''Return the application data of both directions: TLS records, or all bytes of a plain connection'''
+        if self.is_tls():
+            return self.client.application_bytes + self.server.application_bytes
+        return self.__client_stream.delivered + self.__server_stream.delivered
+
+
+def classify_capture(connections):
+    '''Label a capture with the protocol that carried most of its application data
+
+    Args:
+        connections (list): TLSConnection of every flow of the capture
+
+    Return:
+        (str) a label of TLSConnection.label(), 'unknown' if no connection carried data
+    '''
+    volume = {}
+    for connection in connections:
+        label = connection.label()
+        if label != 'unknown':
+            volume[label] = volume.get(label, 0) + connection.application_bytes()
+    if not volume:
+        return 'unknown'
+    return max(sorted(volume), key=lambda label: volume[label])
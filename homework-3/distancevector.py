@@ -1,40 +1,189 @@
 from collections import namedtuple
 
+INFINITY = 9999    # default cost of an unreachable destination
+
+
+class Route(object):
+    '''One entry of a distance vector, mutable so that an update does not rebuild it
+
+    Attr:
+        Dest (str): destination
+        Cost (int): cost to the destination
+        Next (str): next hop, '' if the destination is unreachable
+    '''
+    __slots__ = ('Dest', 'Cost', 'Next')
+
+    def __init__(self, Dest, Cost, Next):
+        self.Dest = Dest
+        self.Cost = Cost
+        self.Next = Next
+
+
+    def __eq__(self, other):
+        return (self.Dest, self.Cost, self.Next) == (other.Dest, other.Cost, other.Next)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __repr__(self):
+        return 'Distance(Dest=%r, Cost=%r, Next=%r)' % (self.Dest, self.Cost, self.Next)
+
+
 class DistanceVector:
-    '''This class encapsulates the distance vector
+    '''This class encapsulates the distance vector, a routing table indexed by destination.
+       Looking up or updating a destination is one dict access, so recomputing a destination
+       costs one step per neighbor.
+
+    Attr:
+        infinity (int): cost of an unreachable destination, a smaller one (16 in RIP) bounds
+                        how long a routing loop can count to infinity
     '''
     Distance = namedtuple('Distance', ['Dest', 'Cost', 'Next'])
 
-    def __init__(self, hostname):
+    def __init__(self, hostname=None, neighbor_dir='/home/neighbor/', infinity=INFINITY):
         '''
             Read neighbor file and init the distance vector
         '''
-        self.__dv = []  # a distance vector is essentially a list
+        self.infinity = infinity
+        self.__routes = {}  # { destination : Route }, in the order the destinations were added
+        if hostname is None:
+            return
         try:
-            with open('/home/neighbor/' + hostname, 'r') as f:
+            with open(neighbor_dir + hostname, 'r') as f:
                 lines = f.readlines()
                 for line in lines:
                     line = line.strip().split(' ')
                     neighbor = line[0]
                     weight   = line[1]
-                    self.__dv.append(self.Distance(Dest=neighbor, Cost=int(weight), Next=neighbor))
+                    self.update(neighbor, int(weight), neighbor)
         except Exception as e:
             print(e)
 
     def add_distance(self, distance):
-        self.__dv.append(distance)
+        '''Add or replace the route of a destination
+
+        Args:
+            distance (Distance or Route)
+        '''
+        self.update(distance.Dest, distance.Cost, distance.Next)
+
+
+    def update(self, dest, cost, next_hop):
+        '''Set the route of a destination
+
+        Return:
+            (bool) True if the route changed
+        '''
+        route = self.__routes.get(dest)
+        if route is None:
+            self.__routes[dest] = Route(dest, cost, next_hop)
+            return True
+        if route.Cost == cost and route.Next == next_hop:
+            return False
+        route.Cost = cost
+        route.Next = next_hop
+        return True
+
+
+    def get(self, dest):
+        '''Return the Route of a destination, None if it is unknown'''
+        return self.__routes.get(dest)
+
+
+    def cost(self, dest):
+        '''Return the cost to a destination, infinity if it is unknown'''
+        route = self.__routes.get(dest)
+        return route.Cost if route is not None else self.infinity
+
+
+    def recompute(self, dests, links, vectors, exclude=None, feasible=None, refused=None):
+        '''Bellman-Ford: set the route of every destination to the cheapest of the direct link and
+           the paths through each neighbor, from the last vector received from every neighbor.
+           A route gets more expensive when its next hop advertises a higher cost.
+           On a tie the current next hop is kept, so routes do not flap.
+
+           With feasible distances, a path through a new neighbor is only taken if the neighbor
+           advertises a cost lower than the lowest this table had for the destination, so the
+           neighbor cannot be routing through this host (the feasibility condition of EIGRP
+           and Babel). The current next hop is kept whatever its cost: the feasible distance
+           does not move, so the next hops still lead to ever lower feasible distances and
+           cannot form a loop. A destination without a feasible path becomes unreachable
+           instead of counting to infinity, until its feasible distance is reset.
+
+        Args:
+            dests (iterable): the destinations to recompute
+            links (dict): { neighbor : cost of the link to it }
+            vectors (dict): { neighbor : { destination : cost advertised by the neighbor } }
+            exclude (str): destination to skip, normally this host
+            feasible (dict): { destination : feasible distance }, updated, None to take any path
+            refused (set): the destinations whose cheapest path failed the feasibility condition
+                           are added to it
+
+        Return:
+            (list) the destinations whose route changed
+        '''
+        changed = []
+        routes = self.__routes
+        infinity = self.infinity
+        for dest in dests:
+            if dest == exclude:
+                continue
+            route = routes.get(dest)
+            current = route.Next if route is not None else None
+            best_cost = links.get(dest, infinity)
+            best_next = dest if best_cost < infinity else ''
+            distance = feasible.get(dest, infinity) if feasible is not None else infinity
+            refused_cost = infinity
+            for neighbor, link_cost in links.items():
+                vector = vectors.get(neighbor)
+                if vector is None or dest not in vector:
+                    continue
+                cost = link_cost + vector[dest]
+                if feasible is not None and vector[dest] >= distance and neighbor != current:
+                    refused_cost = min(refused_cost, cost)
+                    continue        # the neighbor may be routing through this host
+                if cost < best_cost or (cost == best_cost and neighbor == current):
+                    best_cost = cost
+                    best_next = neighbor
+            if refused is not None and refused_cost < min(best_cost, infinity):
+                refused.add(dest)
+            if best_cost >= infinity:
+                best_cost = infinity
+                best_next = ''
+                if route is None:
+                    continue
+            elif feasible is not None and best_cost < distance:
+                feasible[dest] = best_cost
+            if self.update(dest, best_cost, best_next):
+                changed.append(dest)
+        return changed
 
 
     dv = property()
 
     @dv.getter
     def dv(self):
-        return self.__dv
+        '''(list) the routes, in the order the destinations were added'''
+        return list(self.__routes.values())
+
+
+    def __iter__(self):
+        return iter(self.__routes.values())
+
+
+    def __len__(self):
+        return len(self.__routes)
+
+
+    def __contains__(self, dest):
+        return dest in self.__routes
 
 
     def __str__(self):
         string = ''
-        for distance in self.__dv:
+        for distance in self.__routes.values():
             string += str(distance) + '\n'
         return string
 
@@ -0,0 +1,118 @@
+'''Call back when some files of a directory are written, from an asyncio event loop.
+
+On Linux the directory is watched with inotify, through ctypes: the kernel reports the files
+closed after a write or renamed into the directory, so a change is seen as soon as it is
+complete, and nothing runs in between. Elsewhere, or if inotify is not available, the
+modification time and size of the files are compared every poll interval.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+
+POLL = 0.5    # seconds between two checks of the files, without inotify
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+EVENT = struct.Struct('iIII')    # watch descriptor, mask, cookie, length of the name
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    '''Watch some files of a directory
+
+    Attr:
+        directory (str)
+        names (set): the names of the watched files in the directory
+        callback (function): called with the name of a file after it changed
+        loop (asyncio.AbstractEventLoop)
+        inotify (bool): True if inotify reports the changes, False if the files are polled
+    '''
+
+    def __init__(self, directory, names, callback, loop, poll=POLL):
+        self.directory = directory
+        self.names = set(names)
+        self.callback = callback
+        self.loop = loop
+        self.poll = poll
+        self.inotify = False
+        self.__fd = None
+        self.__timer = None
+        self.__stats = {}
+
+
+    def start(self):
+        '''Start watching, with inotify if possible'''
+        libc = _libc()
+        if libc is not None and hasattr(self.loop, 'add_reader'):
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                if libc.inotify_add_watch(fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                    self.__fd = fd
+                    self.inotify = True
+                    self.loop.add_reader(fd, self.__read)
+                    return
+                os.close(fd)
+        self.__stats = dict((name, self.__stat(name)) for name in self.names)
+        self.__timer = self.loop.call_later(self.poll, self.__check)
+
+
+    def close(self):
+        '''Stop watching'''
+        if self.__fd is not None:
+            self.loop.remove_reader(self.__fd)
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+
+    def __read(self):
+        try:
+            data = os.read(self.__fd, 64*1024)
+        except BlockingIOError:
+            return
+        changed = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:     # events were lost, any file may have changed
+                changed = sorted(self.names)
+                break
+            if name in self.names and name not in changed:
+                changed.append(name)
+        for name in changed:
+            self.callback(name)
+
+
+    def __stat(self, name):
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    def __check(self):
+        for name in sorted(self.names):
+            stat = self.__stat(name)
+            if stat != self.__stats.get(name):
+                self.__stats[name] = stat
+                self.callback(name)
+        self.__timer = self.loop.call_later(self.poll, self.__check)
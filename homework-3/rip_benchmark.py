@@ -0,0 +1,184 @@
+'''Measure the convergence of riplite on generated topologies, against Dijkstra.
+
+Usage:
+    python rip_benchmark.py [--topologies line,ring,grid,scale-free] [--routers 100] [--events 3]
+                            [--destinations 0] [--latency 0.001] [--loss 0] [--seed 1]
+                            [--hold-down 0.1] [--infinity 9999] [--horizon poison] [--route-hold 1.0]
+                            [-o results.jsonl]
+
+Every topology is simulated with ripsim. The routers start together, then each event is
+applied to a random link, one at a time:
+
+    start     every router starts
+    cost      the cost of the link changes
+    fail      the link fails
+    recover   the failed link comes back with its cost
+
+After every event the routers run until they are quiet. The record of the event has the time
+from the event to the last route change, the datagrams and bytes sent, the route flaps (route
+changes beyond the ones from the table before the event to the table after it), the CPU time
+per router, and the routes that differ from Dijkstra on the same links. A destination beyond
+infinity is unreachable for both. An event has converged only if the routers went quiet
+before the timeout with no route differing from Dijkstra; the benchmark fails (exit status
+1) if any event did not.
+'''
+
+import argparse
+import csv
+import json
+import math
+import random
+import sys
+import time
+from collections import namedtuple
+
+import ripsim
+from distancevector import INFINITY
+from riplite import HOLD_DOWN, ROUTE_HOLD, POISONED_REVERSE, SPLIT_HORIZON
+
+
+TOPOLOGIES = ('line', 'ring', 'grid', 'scale-free')
+EVENTS = ('cost', 'fail', 'recover')
+
+ConvergenceRecord = namedtuple('ConvergenceRecord', ['topology', 'routers', 'links', 'event', 'converged', 'seconds',
+                                                     'datagrams', 'bytes', 'flaps', 'cpu_ms_per_router', 'mismatches'])
+
+
+def topology(name, routers, max_cost=10, seed=1):
+    '''Return the Edges of a topology of about routers routers'''
+    if name == 'line':
+        return ripsim.line(routers, max_cost, seed)
+    if name == 'ring':
+        return ripsim.ring(routers, max_cost, seed)
+    if name == 'grid':
+        side = max(2, int(round(math.sqrt(routers))))
+        return ripsim.grid(side, side, max_cost, seed)
+    if name == 'scale-free':
+        return ripsim.scale_free(routers, 2, max_cost, seed)
+    raise ValueError('unknown topology ' + name)
+
+
+def snapshot(simulation):
+    return dict(((name, route.Dest), (route.Cost, route.Next)) for name, host in simulation.hosts.items() for route in host.my_dv)
+
+
+def measure(simulation, topology_name, event, apply, destinations, timeout):
+    '''Apply an event, run until the routers are quiet, and measure
+
+    Return:
+        (ConvergenceRecord)
+    '''
+    hosts = simulation.hosts.values()
+    network = simulation.network
+    before = snapshot(simulation)
+    changes = sum(host.route_changes for host in hosts)
+    datagrams, sent = network.datagrams, network.bytes
+    start = simulation.loop.time()
+    cpu = time.process_time()
+    apply()
+    converged = simulation.converge(timeout)
+    cpu = time.process_time() - cpu
+    wrong = simulation.mismatches(destinations)
+    after = snapshot(simulation)
+    changed = sum(1 for key in set(before) | set(after) if before.get(key) != after.get(key))
+    last = simulation.last_change()
+    return ConvergenceRecord(topology=topology_name, routers=len(simulation.hosts), links=len(simulation.edges),
+                             event=event, converged=converged and wrong == 0,
+                             seconds=max(0.0, last - start) if last is not None else 0.0,
+                             datagrams=network.datagrams - datagrams, bytes=network.bytes - sent,
+                             flaps=sum(host.route_changes for host in hosts) - changes - changed,
+                             cpu_ms_per_router=cpu*1000.0/len(simulation.hosts),
+                             mismatches=wrong)
+
+
+def benchmark(topology_name, edges, events=1, destinations=0, latency=ripsim.LATENCY, loss=0.0, seed=1,
+              timeout=600.0, **options):
+    '''Start the routers of a topology, then apply every kind of event to events random links
+
+    Args:
+        destinations (int): advertise only this many random routers, 0 for all
+        options: given to every Host
+
+    Return:
+        (list) ConvergenceRecord
+    '''
+    rng = random.Random(seed)
+    routers = sorted(set([edge.a for edge in edges] + [edge.b for edge in edges]))
+    advertised = rng.sample(routers, destinations) if 0 < destinations < len(routers) else None
+    simulation = ripsim.Simulation(edges, latency, loss, seed, advertised, **options)
+    checked = advertised if advertised is not None else routers
+    records = [measure(simulation, topology_name, 'start', simulation.start, checked, timeout)]
+    for i in range(events):
+        edge = rng.choice(edges)
+        cost = simulation.hosts[edge.a].links[edge.b]
+        new_cost = rng.choice([c for c in range(1, 2*cost + 2) if c != cost])
+        records.append(measure(simulation, topology_name, 'cost',
+                               lambda: simulation.set_link(edge.a, edge.b, new_cost), checked, timeout))
+        edge = rng.choice(edges)
+        cost = simulation.hosts[edge.a].links[edge.b]
+        records.append(measure(simulation, topology_name, 'fail',
+                               lambda: simulation.fail_link(edge.a, edge.b), checked, timeout))
+        records.append(measure(simulation, topology_name, 'recover',
+                               lambda: simulation.set_link(edge.a, edge.b, cost), checked, timeout))
+    return records
+
+
+def print_benchmark(records):
+    print('{0:>10s} {1:>7s} {2:>6s} {3:>8s} {4:>9s} {5:>10s} {6:>11s} {7:>7s} {8:>13s} {9:>10s}'.format(
+          'topology', 'routers', 'links', 'event', 'seconds', 'datagrams', 'bytes', 'flaps', 'CPU ms/router', 'mismatches'))
+    for record in records:
+        print('{0:>10s} {1:7d} {2:6d} {3:>8s} {4:9.3f} {5:10d} {6:11d} {7:7d} {8:13.3f} {9:10d}{10}'.format(
+              record.topology, record.routers, record.links, record.event, record.seconds, record.datagrams,
+              record.bytes, record.flaps, record.cpu_ms_per_router, record.mismatches,
+              '' if record.converged else '  NOT converged'))
+
+
+def write_records(records, path):
+    '''Write the records as .jsonl or .csv'''
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.csv'):
+            writer = csv.writer(f)
+            writer.writerow(ConvergenceRecord._fields)
+            writer.writerows(records)
+        else:
+            for record in records:
+                f.write(json.dumps(record._asdict()) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the convergence of riplite')
+    parser.add_argument('--topologies', default=','.join(TOPOLOGIES), help='comma separated, among ' + ', '.join(TOPOLOGIES))
+    parser.add_argument('--routers', type=int, default=100)
+    parser.add_argument('--max-cost', type=int, default=10)
+    parser.add_argument('--events', type=int, default=3, help='links changed, failed and recovered per topology')
+    parser.add_argument('--destinations', type=int, default=0, help='advertise only this many routers, 0 for all')
+    parser.add_argument('--latency', type=float, default=ripsim.LATENCY, help='seconds')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--hold-down', type=float, default=HOLD_DOWN)
+    parser.add_argument('--infinity', type=int, default=INFINITY)
+    parser.add_argument('--horizon', choices=[POISONED_REVERSE, SPLIT_HORIZON, 'none'], default=POISONED_REVERSE)
+    parser.add_argument('--route-hold', type=float, default=ROUTE_HOLD, help='0 for no feasibility condition')
+    parser.add_argument('--timeout', type=float, default=600.0, help='simulated seconds per event')
+    parser.add_argument('-o', '--output', help='write the measurements as .jsonl or .csv')
+    args = parser.parse_args()
+
+    names = [name for name in args.topologies.split(',') if name]
+    for name in names:
+        if name not in TOPOLOGIES:
+            parser.error('unknown topology {}'.format(name))
+
+    records = []
+    for name in names:
+        edges = topology(name, args.routers, args.max_cost, args.seed)
+        records.extend(benchmark(name, edges, args.events, args.destinations, args.latency, args.loss, args.seed,
+                                 args.timeout, hold_down=args.hold_down, infinity=args.infinity,
+                                 horizon=None if args.horizon == 'none' else args.horizon,
+                                 route_hold=args.route_hold or None))
+    print_benchmark(records)
+    if args.output:
+        write_records(records, args.output)
+    failed = sum(1 for record in records if not record.converged)
+    if failed:
+        print('FAILED: {} of {} events did not converge to the shortest paths'.format(failed, len(records)))
+        sys.exit(1)
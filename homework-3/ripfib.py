@@ -0,0 +1,293 @@
+'''Install the routes of riplite in the Linux routing table, through rtnetlink.
+
+A destination of riplite is a router, not a prefix: its prefixes come from a prefix file,
+"destination prefix [prefix ...]" per line, or else from the neighbor files, where every
+router lists the address of each of its neighbors, as /32 host routes.
+
+Fib keeps the routes it installed, { prefix : gateway }, and applies only the difference
+with the new routes: one RTM_NEWROUTE (create or replace) per new or moved prefix, one
+RTM_DELROUTE per prefix gone unreachable. The messages of one change go to the kernel
+together, in as few sends as fit the socket buffer, and their acknowledgments are read
+after. The routes carry the RIP protocol number, so they are told apart from the others:
+when Fib opens, the routes it left behind are loaded, and the first sync removes the stale
+ones.
+
+In dry-run mode no socket is opened: the messages are built and counted, and the changes are
+only recorded, so it works without privileges.
+'''
+
+import errno
+import glob
+import os
+import socket
+import struct
+from collections import namedtuple
+
+
+NETLINK_ROUTE = 0
+NLMSG_ERROR   = 2
+NLMSG_DONE    = 3
+RTM_NEWROUTE  = 24
+RTM_DELROUTE  = 25
+RTM_GETROUTE  = 26
+NLM_F_REQUEST = 0x001
+NLM_F_ACK     = 0x004
+NLM_F_DUMP    = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE  = 0x400
+RT_TABLE_MAIN = 254
+RTPROT_RIP    = 189
+RT_SCOPE_UNIVERSE = 0
+RTN_UNICAST   = 1
+RTA_DST       = 1
+RTA_GATEWAY   = 5
+RTA_TABLE     = 15
+
+NLMSGHDR = struct.Struct('=IHHII')       # length, type, flags, sequence number, port ID
+RTMSG    = struct.Struct('=BBBBBBBBI')   # family, destination length, source length, TOS, table,
+                                         # protocol, scope, type, flags
+RTATTR   = struct.Struct('=HH')          # length, type
+NLMSGERR = struct.Struct('=i')           # error, then the header of the message in error
+
+MAX_BATCH = 32*1024    # bytes of messages per send
+
+FibChange = namedtuple('FibChange', ['operation', 'prefix', 'gateway'])    # operation: 'replace' or 'delete'
+
+
+def read_prefixes(path):
+    '''Read a prefix file, "destination prefix [prefix ...]" per line
+
+    Return:
+        (dict) { destination : list of prefixes }
+    '''
+    prefixes = {}
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if len(line) > 1:
+                prefixes.setdefault(line[0], []).extend(line[1:])
+    return prefixes
+
+
+def prefixes_from_neighbors(neighbor_dir):
+    '''Return { destination : list of /32 prefixes } of the addresses listed in the neighbor files'''
+    prefixes = {}
+    for path in sorted(glob.glob(os.path.join(neighbor_dir, '*_neighbor'))):
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.split()
+                if len(line) > 1:
+                    prefix = line[1] + '/32'
+                    if prefix not in prefixes.setdefault(line[0], []):
+                        prefixes[line[0]].append(prefix)
+    return prefixes
+
+
+def _attribute(kind, data):
+    length = RTATTR.size + len(data)
+    return RTATTR.pack(length, kind) + data + b'\0'*(-length % 4)
+
+
+def route_message(operation, prefix, gateway, sequence, table=RT_TABLE_MAIN, protocol=RTPROT_RIP):
+    '''Build the netlink message of one route change
+
+    Args:
+        operation (str): 'replace' or 'delete'
+        prefix (str): a.b.c.d/len
+        gateway (str): the next hop, None for a delete
+
+    Return:
+        (bytes)
+    '''
+    address, length = prefix.split('/')
+    body = RTMSG.pack(socket.AF_INET, int(length), 0, 0, table if table < 256 else 0, protocol,
+                      RT_SCOPE_UNIVERSE, RTN_UNICAST, 0)
+    body += _attribute(RTA_DST, socket.inet_aton(address))
+    if table >= 256:
+        body += _attribute(RTA_TABLE, struct.pack('=I', table))
+    if operation == 'replace':
+        body += _attribute(RTA_GATEWAY, socket.inet_aton(gateway))
+        kind, flags = RTM_NEWROUTE, NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE
+    else:
+        kind, flags = RTM_DELROUTE, NLM_F_REQUEST | NLM_F_ACK
+    return NLMSGHDR.pack(NLMSGHDR.size + len(body), kind, flags, sequence, 0) + body
+
+
+class Fib:
+    '''The kernel routes of one router
+
+    Attr:
+        prefixes (dict): { destination : list of prefixes }
+        installed (dict): { prefix : gateway } the routes in the kernel
+        table (int): routing table, main by default
+        dry_run (bool): build the messages but send nothing
+        changes (list): FibChange applied by the last sync or update
+        messages (int): netlink messages built
+        bytes (int): bytes of the messages built
+        errors (list): (FibChange, errno) refused by the kernel in the last sync or update
+    '''
+
+    def __init__(self, prefixes, table=RT_TABLE_MAIN, dry_run=False):
+        self.prefixes = prefixes
+        self.table = table
+        self.dry_run = dry_run
+        self.installed = {}
+        self.changes = []
+        self.errors = []
+        self.messages = 0
+        self.bytes = 0
+        self.__sequence = 0
+        self.__socket = None
+        if dry_run:
+            return
+        self.__socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.__socket.bind((0, 0))
+        self.load()
+
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+
+    def load(self):
+        '''Read the routes of our protocol already in the table, left by a previous run'''
+        self.__sequence += 1
+        request = RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+        self.__socket.send(NLMSGHDR.pack(NLMSGHDR.size + len(request), RTM_GETROUTE, NLM_F_REQUEST | NLM_F_DUMP,
+                                         self.__sequence, 0) + request)
+        while True:
+            data = self.__socket.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind, flags, sequence, port = NLMSGHDR.unpack_from(data, offset)
+                if kind == NLMSG_DONE or kind == NLMSG_ERROR:
+                    return
+                if kind == RTM_NEWROUTE:
+                    self.__load_route(data, offset + NLMSGHDR.size, offset + length)
+                offset += (length + 3) & ~3
+
+
+    def __load_route(self, data, offset, end):
+        family, dst_len, src_len, tos, table, protocol, scope, kind, flags = RTMSG.unpack_from(data, offset)
+        if family != socket.AF_INET or protocol != RTPROT_RIP:
+            return
+        offset += RTMSG.size
+        destination = gateway = None
+        while offset + RTATTR.size <= end:
+            length, attribute = RTATTR.unpack_from(data, offset)
+            if length < RTATTR.size:
+                break
+            value = data[offset + RTATTR.size:offset + length]
+            if attribute == RTA_DST:
+                destination = socket.inet_ntoa(value)
+            elif attribute == RTA_GATEWAY:
+                gateway = socket.inet_ntoa(value)
+            elif attribute == RTA_TABLE:
+                table = struct.unpack('=I', value)[0]
+            offset += (length + 3) & ~3
+        if table == self.table and destination is not None:
+            self.installed['%s/%d' % (destination, dst_len)] = gateway
+
+
+    def wanted(self, routes, neighbor_ip, infinity):
+        '''Return { prefix : gateway } of routes, None for a prefix to remove'''
+        wanted = {}
+        for route in routes:
+            gateway = neighbor_ip.get(route.Next) if route.Cost < infinity else None
+            for prefix in self.prefixes.get(route.Dest, ()):
+                wanted[prefix] = gateway
+        return wanted
+
+
+    def update(self, routes, neighbor_ip, infinity):
+        '''Apply the changed routes
+
+        Args:
+            routes (iterable): the Routes that changed
+            neighbor_ip (dict): { neighbor : IP address }, the gateways
+            infinity (int): cost of an unreachable destination
+
+        Return:
+            (list) FibChange applied
+        '''
+        return self.apply(self.wanted(routes, neighbor_ip, infinity))
+
+
+    def sync(self, routes, neighbor_ip, infinity):
+        '''Make the kernel table hold exactly these routes: the installed prefixes missing from
+           them are removed as well
+        '''
+        wanted = dict((prefix, None) for prefix in self.installed)
+        wanted.update(self.wanted(routes, neighbor_ip, infinity))
+        return self.apply(wanted)
+
+
+    def flush(self):
+        '''Remove every installed route'''
+        return self.apply(dict((prefix, None) for prefix in self.installed))
+
+
+    def apply(self, wanted):
+        '''Send the differences between wanted, { prefix : gateway or None }, and the kernel
+
+        Return:
+            (list) FibChange applied
+        '''
+        changes = []
+        for prefix, gateway in wanted.items():
+            current = self.installed.get(prefix)
+            if gateway is None:
+                if prefix in self.installed:
+                    changes.append(FibChange('delete', prefix, None))
+            elif gateway != current:
+                changes.append(FibChange('replace', prefix, gateway))
+        self.changes = changes
+        self.errors = []
+        if not changes:
+            return changes
+        batch = []
+        size = 0
+        for change in changes:
+            self.__sequence += 1
+            message = route_message(change.operation, change.prefix, change.gateway, self.__sequence, self.table)
+            self.messages += 1
+            self.bytes += len(message)
+            if size + len(message) > MAX_BATCH and batch:
+                self.__send(batch)
+                batch = []
+                size = 0
+            batch.append((self.__sequence, change, message))
+            size += len(message)
+        self.__send(batch)
+        return changes
+
+
+    def __send(self, batch):
+        if self.dry_run:
+            for sequence, change, message in batch:
+                self.__applied(change)
+            return
+        self.__socket.send(b''.join(message for sequence, change, message in batch))
+        pending = dict((sequence, change) for sequence, change, message in batch)
+        while pending:
+            data = self.__socket.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind, flags, sequence, port = NLMSGHDR.unpack_from(data, offset)
+                change = pending.pop(sequence, None)
+                if kind == NLMSG_ERROR and change is not None:
+                    error = -NLMSGERR.unpack_from(data, offset + NLMSGHDR.size)[0]
+                    if error == 0 or (error == errno.ESRCH and change.operation == 'delete'):
+                        self.__applied(change)
+                    else:
+                        self.errors.append((change, error))
+                offset += (length + 3) & ~3
+
+
+    def __applied(self, change):
+        if change.operation == 'delete':
+            self.installed.pop(change.prefix, None)
+        else:
+            self.installed[change.prefix] = change.gateway
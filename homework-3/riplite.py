@@ -1,64 +1,193 @@
-from distancevector import DistanceVector
-import sys
-import socket
-from thread import start_new_thread
+import argparse
+import asyncio
+import os
+import struct
 import time
-import threading
+
+import ripfib
+import riplog
+import ripwire
+from filewatch import FileWatcher
+from distancevector import DistanceVector, INFINITY
+from ripwire import HELLO, FULL, DELTA
+
+
+PORT = 6666    # UDP port of every router
+HOLD_DOWN = 0.1    # seconds between two advertisements of a router
+REFRESH = 30.0     # seconds between two advertisements of the whole table, like RIP
+ROUTE_HOLD = 1.0   # seconds a route is held before its feasible distance is reset and any path is taken
+NEIGHBOR_DIR = '/home/neighbor/'
+LOG_DIR      = '/home/log/'
+
+# what a router advertises to a neighbor about the routes whose next hop is that neighbor
+POISONED_REVERSE = 'poison'    # the routes, as unreachable
+SPLIT_HORIZON    = 'split'     # nothing
+# None advertises the routes as they are
+
+
+class RIPProtocol(asyncio.DatagramProtocol):
+    '''Hand the datagrams of a router's UDP socket to its Host
+    '''
+
+    def __init__(self, host):
+        self.host = host
+
+
+    def connection_made(self, transport):
+        self.host.transport = transport
+
+
+    def datagram_received(self, data, addr):
+        self.host.receive(data, addr)
+
+
+    def error_received(self, exc):
+        self.host.log.warning('socket_error', error=str(exc))
 
 
 class Host:
     '''
-        This class encapsulate a host (host + router)
+        This class encapsulate a host (host + router), on one asyncio event loop and one UDP socket.
+        Received vectors are batched per turn of the loop, changes are advertised as deltas at
+        most once per hold-down, and poisoned reverse and the feasibility condition of
+        DistanceVector.recompute keep the routes loop free.
     Attr:
         hostname (str)
         my_dv    (DistanceVector): this node's DistanceVector
+        neighbor (list): the neighbors of this host
+        neighbor_ip (dict): { neighbor : IP address }
+        links (dict): { neighbor : cost of the link to it }
+        neighbor_vectors (dict): { neighbor : { destination : cost } } routes advertised by every neighbor
+        names (ripwire.NameTable): the IDs of the destinations advertised by this host
+        neighbor_names (dict): { neighbor : { ID : destination } } the IDs of every neighbor
+        updates (dict): { neighbor : [ kind, { destination : cost, None if withdrawn } ] } the update queue,
+                        changes received but not processed yet
+        advertised (dict): { neighbor : { destination : cost } } routes last advertised to every neighbor
+        hold_down (float): seconds between two advertisements
+        refresh (float): seconds between two advertisements of the whole table
+        horizon (str): POISONED_REVERSE, SPLIT_HORIZON or None
+        route_hold (float): seconds a route that refuses a cheaper path, or is unreachable, is held,
+                            None for no feasibility condition
+        feasible (dict): { destination : feasible distance }, the lowest cost since the last hold
+        port (int): UDP port of every router
+        loop (asyncio.AbstractEventLoop): the event loop of the router, set when the host runs
+        transport (asyncio.DatagramTransport): the socket, set when the host runs
+        watcher (FileWatcher): reports the changes of the neighbor files, set when the host runs
+        log (riplog.EventLog): the events of the host, in log_dir/hostname.jsonl
+        fib (ripfib.Fib): the kernel table the routes are installed in as soon as they change, or None
+        received (int): vectors received
+        recomputations (int): Bellman-Ford recomputations
+        route_changes (int): routes changed by the recomputations
+        last_change (float): loop time of the last route change
+        destinations (set): the destinations advertised, None for all
+        advertisements (int): datagrams sent to the neighbors
+        bytes_sent (int): bytes of the datagrams sent
     '''
 
     all_hosts = ['h1', 'h2', 'r1', 'r2', 'r3', 'r4']
 
 
-    def __init__(self, hostname):
+    def __init__(self, hostname, port=PORT, hold_down=HOLD_DOWN, infinity=INFINITY,
+                 horizon=POISONED_REVERSE, refresh=REFRESH, route_hold=ROUTE_HOLD,
+                 links=None, neighbor_ip=None, all_hosts=None, destinations=None,
+                 neighbor_dir=None, log_dir='', log_level=riplog.INFO, fib=None):
+        '''
+        Args:
+            links (dict): { neighbor : cost }, None to read the cost file in neighbor_dir
+            neighbor_ip (dict): { neighbor : IP address }, None to read the IP file in neighbor_dir
+            all_hosts (list): the destinations known from the start, None for Host.all_hosts
+            destinations (set): the destinations to advertise, None for all
+            neighbor_dir (str): directory of the neighbor files, None for NEIGHBOR_DIR
+            log_dir (str): directory of the log, '' for LOG_DIR, None for no log
+            log_level (int): riplog level of the records kept
+            fib (ripfib.Fib): the kernel table to install the routes in, None for none
+        '''
         self.hostname = hostname
-        print('init cp-0')
-        self.my_dv = DistanceVector(hostname)
-        print('init cp-1')
+        self.neighbor_dir = neighbor_dir if neighbor_dir is not None else NEIGHBOR_DIR
+        self.log_dir = log_dir if log_dir != '' else LOG_DIR
+        self.log = riplog.EventLog(self.log_dir + hostname + '.jsonl' if self.log_dir is not None else None,
+                                   hostname, log_level)
+        self.destinations = destinations
+        self.fib = fib
+        if all_hosts is not None:
+            self.all_hosts = list(all_hosts)
+        self.port = port
+        self.hold_down = hold_down
+        self.horizon = horizon
+        self.refresh = refresh
+        self.route_hold = route_hold
+        self.feasible = {} if route_hold is not None else None
+        self.loop = None
+        self.transport = None
+        self.neighbor_vectors = {}
+        self.updates = {}
+        self.advertised = {}
+        self.names = ripwire.NameTable()
+        self.neighbor_names = {}
+        self.__bound = {}                         # { neighbor : IDs bound to their name for it }
+        self.received = 0
+        self.recomputations = 0
+        self.advertisements = 0
+        self.bytes_sent = 0
+        self.route_changes = 0
+        self.last_change = None
+        self.__processing = False                 # processing of the update queue is scheduled
+        self.__advertise_timer = None
+        self.__last_advertisement = float('-inf')
+        self.__changed = set()                    # destinations changed since the last advertisement
+        self.__held = set()                       # destinations waiting for the reset of their feasible distance
+        if links is None:
+            self.my_dv = DistanceVector(hostname, self.neighbor_dir, infinity)
+        else:
+            self.my_dv = DistanceVector(infinity=infinity)
+            for neighbor, cost in links.items():
+                self.my_dv.update(neighbor, cost, neighbor)
         self.neighbor     = []
         self.non_neighbor = []
-        self.neighbor_ip  = {}
-        self.read_neighbor_ip()
-        print(self.neighbor_ip)
+        self.neighbor_ip  = neighbor_ip if neighbor_ip is not None else self.read_neighbor_ip()
+        self.watcher = None
 
+        for distance in self.my_dv:
+            self.neighbor.append(distance.Dest)
+        self.links = dict((distance.Dest, distance.Cost) for distance in self.my_dv)
         for host in self.all_hosts:
-            for distance in self.my_dv.dv:
-                if host == distance.Dest:
-                    self.neighbor.append(host)
-                    break
-                elif host == self.hostname:
-                    break
-            else: # not a neighbor of this host, also not itself
+            if host != self.hostname and host not in self.my_dv:  # not a neighbor of this host, also not itself
                 self.non_neighbor.append(host)
 
         for host in self.non_neighbor:
-            self.my_dv.add_distance(DistanceVector.Distance(Dest=host, Cost=9999, Next=''))
+            self.my_dv.add_distance(DistanceVector.Distance(Dest=host, Cost=infinity, Next=''))
 
-        self.writelog('initialization at timestamp = ' + str(time.time()) + '\n')
-        self.writelog(str(self.my_dv) + '\n')
+        if self.log.enabled(riplog.INFO):
+            self.log.info('init', routes=self.routes(self.my_dv))
 
 
-    def writelog(self, message):
-        f = open('/home/log/'+self.hostname, 'a')
-        f.write(message)
-        f.close()
+    def routes(self, routes):
+        '''Return the routes as [ destination, cost, next hop ] lists, for the log'''
+        return [[route.Dest, route.Cost, route.Next] for route in routes]
 
 
     def read_neighbor_ip(self):
-        with open('/home/neighbor/' + self.hostname + '_neighbor', 'r') as f:
+        '''Return { neighbor : IP address } from the IP file of the host'''
+        neighbor_ip = {}
+        with open(self.neighbor_dir + self.hostname + '_neighbor', 'r') as f:
             lines = f.readlines()
             for line in lines:
                 line = line.strip().split(' ')
                 neighbor = line[0]
                 ip = line[1]
-                self.neighbor_ip[neighbor] = ip
+                neighbor_ip[neighbor] = ip
+        return neighbor_ip
+
+
+    def read_links(self):
+        '''Return { neighbor : cost of the link to it } from the cost file of the host'''
+        links = {}
+        with open(self.neighbor_dir + self.hostname, 'r') as f:
+            for line in f:
+                line = line.split()
+                if line:
+                    links[line[0]] = int(line[1])
+        return links
 
 
     def __str__(self):
@@ -67,159 +196,346 @@ class Host:
         return string
 
 
-    def start_listening(self):
-        '''This is the server side.
+    async def run(self, address='0.0.0.0'):
+        '''This is the server side: open the UDP socket, advertise the distance vector,
+           and watch the neighbor files until the loop stops.
+
+        Args:
+            address (str): listen on this address, all interfaces by default
         '''
-        host = '0.0.0.0'      # listening to all interfaces
-        port = 6666
+        self.loop = loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(lambda: RIPProtocol(self), local_addr=(address, self.port))
+        except OSError as err:
+            self.log.error('socket_failed', error=str(err))
+            self.log.close()
+            return
+        self.log.info('listening', address=address, port=self.port)
 
-        s = None
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.bind((host, port))
-            s.listen(5)
-            self.writelog((self.hostname + ' is listening at port %d\n' %(port)))
-            self.writelog('timestamp = ' + str(time.time()) + '\n')
-        except socket.error as err:
-            self.writelog((self.hostname + ' socket failed with error %s\n' %(err)))
+            self.start()
+            self.sync_fib()
+            self.watch_neighbor()
+            await loop.create_future()      # the host runs from the callbacks of the loop
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+            if self.fib is not None:
+                self.fib_changed(self.fib.flush)
+                self.fib.close()
+            self.log.close()
+
+
+    def start(self):
+        '''Advertise the whole table to the neighbors, and again every refresh interval
+        '''
+        self.__last_advertisement = self.loop.time()
+        self.send_dv(HELLO)
+        self.loop.call_later(self.refresh, self.__refresh)
 
-        #time.sleep(10)
 
-        while 1:
-            try:
-                conn, addr = s.accept() # wait to accept a connection - blocking call
+    def __refresh(self):
+        self.__last_advertisement = self.loop.time()
+        self.send_dv(FULL)
+        self.loop.call_later(self.refresh, self.__refresh)
 
-                t = threading.Thread(target=self.clientthread, args=(conn, addr))
-                t.start()
-            except Exception as e:
-                self.writelog('Oops! Error!. Socket is now closed.\n')
-                s.close()
 
+    def receive(self, data, addr):
+        '''Put the routes advertised by a neighbor in the update queue
+        '''
+        try:
+            frames = ripwire.decode(data)
+        except (ValueError, struct.error) as e:
+            self.log.warning('bad_datagram', address=addr[0], error=str(e))
+            return
+        for frame in frames:
+            self.receive_frame(frame)
+
+
+    def receive_frame(self, frame):
+        neighbor = frame.sender     # receive the distance vector from neighbor
+        if neighbor not in self.links:
+            self.log.warning('not_neighbor', sender=neighbor)
+            return
+        self.log.debug('received', neighbor=neighbor, kind=ripwire.KIND_NAMES.get(frame.kind),
+                       entries=len(frame.entries))
+
+        names = self.neighbor_names.setdefault(neighbor, {})
+        names.update(frame.bindings)
+        infinity = self.my_dv.infinity
+        changes = {}                # { destination : cost, None if the neighbor cannot reach it }
+        for id, cost in frame.entries:
+            dest = names.get(id)
+            if dest is None:        # its binding was lost, the next whole table has it
+                continue
+            changes[dest] = cost if cost < infinity else None
+
+        self.received += 1
+        queued = self.updates.get(neighbor)
+        if queued is None:
+            self.updates[neighbor] = [frame.kind, changes]
+        else:
+            queued[1].update(changes)
+            if frame.kind == HELLO:
+                queued[0] = HELLO
+        if not self.__processing:
+            self.__processing = True
+            self.loop.call_soon(self.process_updates)
+
+
+    def process_updates(self):
+        '''Empty the update queue with one Bellman-Ford recomputation, and advertise the changes
+        '''
+        self.__processing = False
+        updates, self.updates = self.updates, {}
+        dests = set()               # the destinations whose advertised cost changed
+        for neighbor, (kind, changes) in updates.items():
+            vector = self.neighbor_vectors.setdefault(neighbor, {})
+            for dest, cost in changes.items():
+                if cost is None:
+                    if vector.pop(dest, None) is not None:
+                        dests.add(dest)
+                elif vector.get(dest) != cost:
+                    vector[dest] = cost
+                    dests.add(dest)
+            if kind == HELLO:       # the neighbor just started and knows nothing of this router
+                self.send_vector(neighbor, FULL)
+        if dests:
+            self.recompute(sorted(dests))     # in the same order every run
+
+
+    def set_link(self, neighbor, cost):
+        '''Change the cost of the link to a neighbor, and advertise the routes it changes
+        '''
+        links = dict(self.links)
+        links[neighbor] = cost
+        self.set_links(links)
 
-    def clientthread(self, conn, addr):
-        '''Handle a connection from client. Used for creating threads
+
+    def set_links(self, links):
+        '''Change the costs of the links, and advertise the routes they change at once,
+           without waiting for the hold-down
+
+        Args:
+            links (dict): { neighbor : cost of the link to it }, a neighbor left out is unreachable
+        '''
+        infinity = self.my_dv.infinity
+        changed = [neighbor for neighbor in self.neighbor if min(links.get(neighbor, infinity), infinity) != self.links.get(neighbor)]
+        changed += [neighbor for neighbor in links if neighbor not in self.links]
+        if not changed:
+            return
+        for neighbor in changed:
+            cost = min(links.get(neighbor, infinity), infinity)
+            self.log.info('link', neighbor=neighbor, cost=cost)
+            self.links[neighbor] = cost
+            if neighbor not in self.neighbor:
+                self.neighbor.append(neighbor)
+                if neighbor in self.non_neighbor:
+                    self.non_neighbor.remove(neighbor)
+        self.recompute([route.Dest for route in self.my_dv] + [neighbor for neighbor in changed if neighbor not in self.my_dv],
+                       now=True)
+
+
+    def recompute(self, dests, now=False):
+        '''Recompute the routes of some destinations, and advertise the ones that changed,
+           at once if now is True
         '''
-        print('connection with ' + addr[0] + ':' + str(addr[1]))
+        refused = set() if self.feasible is not None else None
+        changed = self.my_dv.recompute(dests, self.links, self.neighbor_vectors, exclude=self.hostname,
+                                       feasible=self.feasible, refused=refused)
+        self.recomputations += 1
+        if self.feasible is not None:
+            infinity = self.my_dv.infinity
+            refused.update(dest for dest in changed if self.my_dv.cost(dest) > self.feasible.get(dest, infinity))
+            for dest in refused:
+                if dest not in self.__held:
+                    self.__held.add(dest)
+                    self.loop.call_later(self.route_hold, self.__release, dest)
+
+        if changed:
+            if self.log.enabled(riplog.INFO):     # the changed routes only, not the table
+                self.log.info('routes', routes=self.routes(self.my_dv.get(dest) for dest in changed))
+            self.sync_fib([self.my_dv.get(dest) for dest in changed])
+            self.route_changes += len(changed)
+            self.last_change = self.loop.time()
+            self.__changed.update(changed)
+            self.advertise(now)
+
+
+    def __release(self, dest):
+        '''End the hold of a destination: forget its feasible distance and take any path
+        '''
+        self.__held.discard(dest)
+        if self.my_dv.cost(dest) > self.feasible.get(dest, self.my_dv.infinity):
+            self.feasible.pop(dest, None)
+            self.recompute([dest])
 
-        dv = ''
 
-        try:
-            data = conn.recv(1024)  # data is the distance vector
-            dv = data.split('\n')
-            print(data)
-        except Exception as e:
-            print('error in receiving data', e)
-
-        neighbor = dv[0]            # receive the distance vector from neighbor
-        conn.sendall(self.hostname + ' received ' + neighbor + "'s distance vector")
-        self.writelog('\n\n' + self.hostname + ' received ' + 'distance vector from ' + neighbor + '\n')
-
-        conn.close()
-        neighbor_dv = []
-        for distance in dv[1:-1]:
-            distance  = distance.split(' ')
-            if distance[2] != '' and distance[0] != self.hostname:
-                neighbor = distance[0]
-                weight   = distance[1]
-                nexthop  = distance[2]
-                neighbor_dv.append(DistanceVector.Distance(Dest=neighbor, Cost=int(weight), Next=nexthop))
-
-        neighbor = dv[0]            # receive the distance vector from neighbor
-        flag = False       # record whether there is an update
-        cost_to_neighbor = 9999
-        for distance in self.my_dv.dv:
-            if distance.Dest == neighbor:
-                cost_to_neighbor = distance.Cost
-
-        print(neighbor_dv)
-
-        lock = threading.Lock()               # prevent multiple threads updating distance vector at the same time
-        lock.acquire()
-        my_new_dv = []
-        for neighbor_d in neighbor_dv:
-            destination = neighbor_d.Dest
-            for mydis in self.my_dv.dv[:]:    # a copy of my distance vector
-                if mydis.Dest == destination:
-                    pre_cost = mydis.Cost
-                    new_cost = cost_to_neighbor + neighbor_d.Cost
-                    print(pre_cost, new_cost)
-                    if new_cost < pre_cost:   # find a new path with lower cost!
-                        self.my_dv.dv.remove(mydis)
-                        my_new_dv.append(DistanceVector.Distance(Dest=destination, Cost=new_cost, Next=neighbor))
-                        flag = True
-        for new_d in my_new_dv:
-            self.my_dv.dv.append(new_d)
-        lock.release()
-
-        self.writelog('update my DV at timestamp = ' + str(time.time()) + '\n')
-        self.writelog(str(self.my_dv) + '\n')
-
-        if flag:
-            t = threading.Thread(target=host.send_dv)
-            t.start()
-
-
-    def send_dv(self):
-        '''Send host's distance vector to all its neighbors
+    def advertise(self, now=False):
+        '''Send the changes now, or when the hold-down since the last advertisement ends
         '''
-        send_queue = []
+        if now:
+            if self.__advertise_timer is not None:
+                self.__advertise_timer.cancel()
+            self.__advertise_now()
+            return
+        if self.__advertise_timer is not None:
+            return                  # the changes go out with the scheduled advertisement
+        wait = self.__last_advertisement + self.hold_down - self.loop.time()
+        if wait > 0:
+            self.__advertise_timer = self.loop.call_later(wait, self.__advertise_now)
+        else:
+            self.__advertise_now()
+
+
+    def __advertise_now(self):
+        self.__advertise_timer = None
+        self.__last_advertisement = self.loop.time()
+        self.send_dv(DELTA)
+
+
+    def send_dv(self, kind=FULL):
+        '''Send host's distance vector to all its neighbors: the whole table, or the changes
+           since the last advertisement to each of them.
+           The datagrams are queued by the socket, so the fan-out never blocks.
+        '''
+        if self.transport is None:
+            return
+        dests = sorted(self.__changed)
+        self.__changed = set()
         for neighbor in self.neighbor:
-            send_queue.append(self.neighbor_ip[neighbor])
-
-        port = 6666
-        while len(send_queue) >= 1:
-            try:
-                ip = send_queue[0]
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect((ip, port))
-                s.send(self.data_to_send())
-                reply = s.recv(1048)
-                #self.writelog(reply + '\n')
-                send_queue.pop(0)
-                time.sleep(0.01)
-            except socket.error as err:
-                self.writelog('Oops! error when sending distance vector', err)
-
-        self.writelog(self.hostname + ' successfully send dv to neighbors' + '\n')
-
-
-    def data_to_send(self):
-        '''Generate the data to be sent
+            self.send_vector(neighbor, kind, dests)
+        self.log.debug('sent', kind=ripwire.KIND_NAMES.get(kind), changed=len(dests))
+
+
+    def send_vector(self, neighbor, kind=FULL, dests=None):
+        '''Send the distance vector to one neighbor
+
+        Args:
+            neighbor (str)
+            kind (int): HELLO or FULL for the whole table, DELTA for the routes of dests whose
+                        advertised cost changed, nothing is sent if none did
+            dests (iterable): the destinations that may have changed, for a DELTA
         '''
-        string = self.hostname + '\n'
-        for distance in self.my_dv.dv:
-            dest = distance.Dest
-            cost = distance.Cost
-            nexthop = distance.Next
-            string += dest + ' ' + str(cost) + ' ' + nexthop + '\n'
-        return string
+        if self.transport is None:
+            return
+        ip = self.neighbor_ip.get(neighbor)
+        if ip is None:
+            self.log.warning('no_ip', neighbor=neighbor)
+            return
+        infinity = self.my_dv.infinity
+        if kind == DELTA:
+            advertised = self.advertised.setdefault(neighbor, {})
+            routes = [self.my_dv.get(dest) for dest in dests]
+        else:
+            advertised = self.advertised[neighbor] = {}
+            self.__bound[neighbor] = set()
+            routes = self.my_dv
+        entries = []
+        destinations = self.destinations
+        for route in routes:
+            dest = route.Dest
+            if destinations is not None and dest not in destinations:
+                continue
+            cost = self.advertised_cost(route, neighbor)
+            if cost is None:        # split horizon: withdraw the route if the neighbor has it
+                if advertised.pop(dest, None) is not None or kind != DELTA:
+                    entries.append((dest, infinity))
+                continue
+            if kind != DELTA or advertised.get(dest) != cost:
+                advertised[dest] = cost
+                entries.append((dest, cost))
+        if kind == DELTA and not entries:
+            return
+        for data in self.data_to_send(neighbor, entries, kind):
+            self.transport.sendto(data, (ip, self.port))
+            self.advertisements += 1
+            self.bytes_sent += len(data)
+
+
+    def advertised_cost(self, route, neighbor):
+        '''Return the cost of a route advertised to a neighbor, None if it is not advertised
+        '''
+        if route.Next == neighbor and route.Dest != neighbor:
+            if self.horizon == POISONED_REVERSE:
+                return self.my_dv.infinity
+            if self.horizon == SPLIT_HORIZON:
+                return None
+        return route.Cost
+
+
+    def data_to_send(self, neighbor, entries, kind=FULL):
+        '''Generate the datagrams to be sent to a neighbor
+
+        Args:
+            neighbor (str)
+            entries (list): (destination, cost) of the advertised routes
+            kind (int): HELLO, FULL or DELTA
+        '''
+        bound = self.__bound.setdefault(neighbor, set())
+        return ripwire.encode(self.hostname, kind, entries, self.names, bound)
+
+
+    def watch_neighbor(self):
+        '''Apply the changes of the neighbor files as soon as they are written:
+           the costs of the links, and the IP addresses of the neighbors
+        '''
+        self.watcher = FileWatcher(self.neighbor_dir, [self.hostname, self.hostname + '_neighbor'],
+                                   self.neighbor_changed, self.loop)
+        self.watcher.start()
+
 
+    def neighbor_changed(self, name):
+        '''A neighbor file was written
 
-    def check_neighbor(self):
-        '''Periodically check the weights of my neighbor
+        Args:
+            name (str): the cost file (hostname) or the IP file (hostname_neighbor)
+        '''
+        try:
+            if name == self.hostname:
+                links = self.read_links()
+                if links:           # an empty file is being written
+                    self.set_links(links)
+                return
+            neighbor_ip = self.read_neighbor_ip()
+        except (OSError, ValueError, IndexError) as e:
+            self.log.error('neighbor_file', file=name, error=str(e))
+            return
+        for neighbor in neighbor_ip:
+            new_ip = neighbor_ip[neighbor]
+            pre_ip = self.neighbor_ip.get(neighbor)
+            if pre_ip != new_ip:                 # if an IP changed
+                self.log.info('neighbor_ip', neighbor=neighbor, previous=pre_ip, ip=new_ip)
+                self.neighbor_ip[neighbor] = new_ip
+                self.send_vector(neighbor, HELLO)    # the router at the new address may know nothing
+                self.sync_fib([route for route in self.my_dv if route.Next == neighbor])
+
+
+    def sync_fib(self, routes=None):
+        '''Install routes in the kernel table, or all the table if routes is None
         '''
-        while 1:
-            time.sleep(0.5)  # check neighbors every 0.5 second
-            try:
-                neighbor_ip = {}
-                with open('/home/neighbor/' + self.hostname + '_neighbor', 'r') as f:
-                    lines = f.readlines()
-                    for line in lines:
-                        line = line.strip().split(' ')
-                        neighbor = line[0]
-                        ip = line[1]
-                        neighbor_ip[neighbor] = ip
-                for neighbor in neighbor_ip:
-                    new_ip = neighbor_ip[neighbor]
-                    pre_ip = self.neighbor_ip[neighbor]
-                    if pre_ip != new_ip:                 # if an IP changed
-                        self.writelog(self.hostname + " neighbor IP changed!\n")
-                        self.writelog('previous ip = ' + pre_ip + ', new ip = ' + new_ip + '\n')
-                        self.neighbor_ip = neighbor_ip
-                        self.send_dv()
-                        break
-            except Exception as e:
-                self.writelog('error in checking neighbor' + e)
+        if self.fib is None:
+            return
+        infinity = self.my_dv.infinity
+        if routes is None:
+            self.fib_changed(self.fib.sync, self.my_dv, self.neighbor_ip, infinity)
+        else:
+            self.fib_changed(self.fib.update, routes, self.neighbor_ip, infinity)
+
+
+    def fib_changed(self, method, *args):
+        '''Call a method of the Fib, and log what it changed'''
+        try:
+            changes = method(*args)
+        except OSError as e:
+            self.log.error('fib_failed', error=str(e))
+            return
+        if changes and self.log.enabled(riplog.INFO):
+            self.log.info('fib', dry_run=self.fib.dry_run,
+                          changes=[[change.operation, change.prefix, change.gateway] for change in changes])
+        for change, error in self.fib.errors:
+            self.log.warning('fib_error', operation=change.operation, prefix=change.prefix,
+                             gateway=change.gateway, error=os.strerror(error))
 
 
 def change_neighbor():
@@ -229,7 +545,7 @@ def change_neighbor():
     print('start changing r1-r3')
     try:
         new_str = []
-        with open('/home/neighbor/' + 'r1', 'r') as f:
+        with open(NEIGHBOR_DIR + 'r1', 'r') as f:
             lines = f.readlines()
             for line in lines:
                 line = line.strip().split(' ')
@@ -239,7 +555,7 @@ def change_neighbor():
                     new_str.append(line[0] + ' ' + line[1] + '\n')
             f.close()
 
-        with open('/home/neighbor/' + 'r1', 'w') as f:
+        with open(NEIGHBOR_DIR + 'r1', 'w') as f:
             f.write(''.join(new_str))
     except Exception as e:
         print('error in changing neighbors', e)
@@ -247,7 +563,7 @@ def change_neighbor():
     print('start changing r3-r1')
     try:
         new_str = []
-        with open('/home/neighbor/' + 'r3', 'r') as f:
+        with open(NEIGHBOR_DIR + 'r3', 'r') as f:
             lines = f.readlines()
             for line in lines:
                 line = line.strip().split(' ')
@@ -257,7 +573,7 @@ def change_neighbor():
                     new_str.append(line[0] + ' ' + line[1] + '\n')
             f.close()
 
-        with open('/home/neighbor/' + 'r3', 'w') as f:
+        with open(NEIGHBOR_DIR + 'r3', 'w') as f:
             f.write(''.join(new_str))
     except Exception as e:
         print('error in changing neighbors', e)
@@ -266,21 +582,30 @@ def change_neighbor():
 
 if __name__ == '__main__':
 
-    if len(sys.argv) == 2:
-        hostname = sys.argv[1]
-        host = Host(hostname)
-
-        t = threading.Thread(target=host.send_dv)
-        t.start()
-
-	t1 = threading.Thread(target=host.check_neighbor)
-        t1.start()
-
-        #t2 = threading.Thread(target=change_neighbor)
-        #t2.start()
-
-        host.start_listening()
-
-    else:
-        print('Error with parameters')
-
+    parser = argparse.ArgumentParser(description='Run the distance vector router of a host')
+    parser.add_argument('hostname')
+    parser.add_argument('--infinity', type=int, default=INFINITY, help='cost of an unreachable destination')
+    parser.add_argument('--horizon', choices=[POISONED_REVERSE, SPLIT_HORIZON, 'none'], default=POISONED_REVERSE,
+                        help='what to advertise to a neighbor about the routes through it')
+    parser.add_argument('--hold-down', type=float, default=HOLD_DOWN, help='seconds between two advertisements')
+    parser.add_argument('--refresh', type=float, default=REFRESH, help='seconds between two advertisements of the whole table')
+    parser.add_argument('--route-hold', type=float, default=ROUTE_HOLD,
+                        help='seconds a route is held before any path is taken, 0 for no feasibility condition')
+    parser.add_argument('--fib', action='store_true', help='install the routes in the kernel routing table')
+    parser.add_argument('--prefixes', help='"destination prefix [prefix ...]" per line, '
+                                           'by default the addresses of the neighbor files as /32')
+    parser.add_argument('--dry-run', action='store_true', help='log the kernel route changes instead of making them')
+    parser.add_argument('--log-level', choices=sorted(riplog.LEVELS, key=riplog.LEVELS.get), default='info')
+    args = parser.parse_args()
+
+    fib = None
+    if args.fib or args.dry_run:
+        prefixes = ripfib.read_prefixes(args.prefixes) if args.prefixes else ripfib.prefixes_from_neighbors(NEIGHBOR_DIR)
+        fib = ripfib.Fib(prefixes, dry_run=args.dry_run)
+    host = Host(args.hostname, hold_down=args.hold_down, infinity=args.infinity,
+                horizon=None if args.horizon == 'none' else args.horizon, refresh=args.refresh,
+                route_hold=args.route_hold or None, log_level=riplog.LEVELS[args.log_level], fib=fib)
+    try:
+        asyncio.run(host.run())
+    except KeyboardInterrupt:
+        pass
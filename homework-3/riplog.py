@@ -0,0 +1,132 @@
+'''Structured event log of a router, one JSON object per line.
+
+The router only puts the record in a queue: the time, the level, the event and its fields.
+A background thread turns the records into JSON and writes them in batches, so logging costs
+the router a queue put, and nothing below the level of the log costs anything. Any thread may
+log.
+
+Every record has "t", seconds of the monotonic clock (nanosecond resolution), "level",
+"host" and "event", then the fields of the event. The first record, "open", also has "wall",
+the wall-clock time at the same instant, to place the monotonic times in the day.
+'''
+
+import atexit
+import json
+import queue
+import threading
+import time
+
+
+DEBUG   = 10
+INFO    = 20
+WARNING = 30
+ERROR   = 40
+DISABLED = 100
+LEVELS = {'debug' : DEBUG, 'info' : INFO, 'warning' : WARNING, 'error' : ERROR}
+LEVEL_NAMES = dict((level, name) for name, level in LEVELS.items())
+
+_STOP = object()
+
+
+class EventLog:
+    '''The event log of one host
+
+    Attr:
+        path (str): the file, None for a log that records nothing
+        host (str)
+        level (int): the records below it are dropped
+    '''
+
+    def __init__(self, path, host, level=INFO):
+        self.path = path
+        self.host = host
+        self.level = level if path is not None else DISABLED
+        self.__queue = queue.SimpleQueue()
+        self.__thread = None
+        if self.level >= DISABLED:
+            return
+        self.__file = open(path, 'a')
+        self.__thread = threading.Thread(target=self.__write, name='log-' + host, daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+        self.log(INFO, 'open', wall=time.time())
+
+
+    def enabled(self, level):
+        '''Return True if the records of a level are kept, to skip building their fields'''
+        return level >= self.level
+
+
+    def log(self, level, event, **fields):
+        if level < self.level:
+            return
+        self.__queue.put((time.monotonic_ns(), level, event, fields))
+
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+
+    def close(self):
+        '''Write the queued records and stop the writer'''
+        if self.__thread is None:
+            return
+        self.__queue.put(_STOP)
+        self.__thread.join()
+        self.__thread = None
+        self.__file.close()
+
+
+    def __write(self):
+        host = self.host
+        while True:
+            records = [self.__queue.get()]
+            while True:             # and everything queued meanwhile, in one write
+                try:
+                    records.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            stop = False
+            for record in records:
+                if record is _STOP:
+                    stop = True
+                    continue
+                t, level, event, fields = record
+                line = {'t' : t/1e9, 'level' : LEVEL_NAMES.get(level, level), 'host' : host, 'event' : event}
+                line.update(fields)
+                lines.append(json.dumps(line) + '\n')
+            self.__file.write(''.join(lines))
+            self.__file.flush()
+            if stop:
+                return
+
+
+def read_events(path, event=None):
+    '''Read the records of a log
+
+    Args:
+        event (str): only the records of this event, None for all
+
+    Return:
+        (list) the records, as dicts
+    '''
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            if event is None or record['event'] == event:
+                records.append(record)
+    return records
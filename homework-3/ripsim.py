@@ -0,0 +1,459 @@
+'''Simulate many riplite routers in one process, without Mininet.
+
+Usage:
+    python ripsim.py --edges topology.txt [--latency 0.001] [--loss 0] [--seed 1]
+    python ripsim.py --random 1000 [--degree 4] [--max-cost 10] [--destinations 100]
+                     [--jitter 0] [--hold-down 0.1] [--infinity 9999] [--horizon poison]
+
+Every router is a riplite.Host. The hosts run on SimLoop, a discrete-event clock that offers
+the part of the asyncio loop they use (time, call_soon, call_later), and send through
+SimNetwork, which delivers a datagram after the latency of its link or loses it. Time only
+moves from one event to the next, so a simulation runs as fast as the routers compute, and
+two runs with the same seed are the same.
+
+The routers have converged once no datagram was sent for the hold-down, route hold and
+two link latencies. With losses a lost update is only repaired by the next refresh of the
+whole table, so the tables must also match Dijkstra on the same links.
+
+An edge list has one link per line, "router router cost [latency in seconds]", and # starts a
+comment. With N routers every table has N destinations, so a full mesh of tables is N^2
+routes: for thousands of routers, advertise only some destinations (--destinations).
+'''
+
+import argparse
+import heapq
+import random
+import time
+from collections import namedtuple
+
+from riplite import Host, PORT, HOLD_DOWN, ROUTE_HOLD, POISONED_REVERSE, SPLIT_HORIZON
+from distancevector import INFINITY
+
+
+LATENCY = 0.001    # seconds, of a link without its own
+
+Edge = namedtuple('Edge', ['a', 'b', 'cost', 'latency'])
+
+
+class SimHandle:
+    '''An event of SimLoop, which can be cancelled like an asyncio.TimerHandle'''
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SimLoop:
+    '''A discrete-event clock. Events run in the order of their time, then in the order
+       they were scheduled.
+
+    Attr:
+        events (int): events run
+    '''
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = 0
+        self.__queue = []               # (time, sequence number, SimHandle)
+        self.__sequence = 0
+
+
+    def time(self):
+        return self.now
+
+
+    def call_at(self, when, callback, *args):
+        handle = SimHandle(when, callback, args)
+        self.__sequence += 1
+        heapq.heappush(self.__queue, (when, self.__sequence, handle))
+        return handle
+
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.now + delay, callback, *args)
+
+
+    def call_soon(self, callback, *args):
+        return self.call_at(self.now, callback, *args)
+
+
+    def next_time(self):
+        '''Return the time of the next event, infinity if there is none'''
+        queue = self.__queue
+        while queue and queue[0][2].cancelled:
+            heapq.heappop(queue)
+        return queue[0][0] if queue else float('inf')
+
+
+    def run_once(self):
+        '''Run the next event
+
+        Return:
+            (bool) False if there was none
+        '''
+        if self.next_time() == float('inf'):
+            return False
+        when, sequence, handle = heapq.heappop(self.__queue)
+        self.now = when
+        self.events += 1
+        handle.callback(*handle.args)
+        return True
+
+
+    def run(self, until=float('inf')):
+        '''Run the events up to a time, and move the clock to it'''
+        while self.next_time() <= until:
+            self.run_once()
+        if until != float('inf'):
+            self.now = max(self.now, until)
+
+
+class SimNetwork:
+    '''The links between the simulated routers. The address of a router is its name.
+
+    Attr:
+        loop (SimLoop)
+        hosts (dict): { address : Host }
+        latency (dict): { (address, address) : seconds }, both directions of every link
+        down (set): the (address, address) of the failed links, both directions
+        loss (float): probability that a datagram is lost
+        datagrams (int): datagrams sent
+        bytes (int): bytes of the datagrams sent
+        lost (int): datagrams lost
+        in_flight (int): datagrams sent and not arrived yet
+        last_activity (float): time of the last datagram sent or arrived
+    '''
+
+    def __init__(self, loop, loss=0.0, seed=1):
+        self.loop = loop
+        self.hosts = {}
+        self.latency = {}
+        self.down = set()
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.datagrams = 0
+        self.bytes = 0
+        self.lost = 0
+        self.in_flight = 0
+        self.last_activity = 0.0
+
+
+    def add_link(self, a, b, latency=LATENCY):
+        self.latency[(a, b)] = latency
+        self.latency[(b, a)] = latency
+
+
+    def send(self, source, data, destination):
+        self.datagrams += 1
+        self.bytes += len(data)
+        self.last_activity = self.loop.now
+        link = (source, destination)
+        latency = self.latency.get(link)
+        if latency is None or link in self.down or (self.loss and self.random.random() < self.loss):
+            self.lost += 1
+            return
+        self.in_flight += 1
+        self.loop.call_later(latency, self.__deliver, source, data, destination)
+
+
+    def __deliver(self, source, data, destination):
+        self.in_flight -= 1
+        self.last_activity = self.loop.now
+        self.hosts[destination].receive(data, (source, PORT))
+
+
+class SimTransport:
+    '''The socket of one simulated router, with the sendto of asyncio.DatagramTransport'''
+
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address
+
+
+    def sendto(self, data, addr):
+        self.network.send(self.address, data, addr[0])
+
+
+def read_edges(path):
+    '''Read an edge list: "router router cost [latency]" per line
+
+    Return:
+        (list) Edge, latency None if the line has none
+    '''
+    edges = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            latency = float(line[3]) if len(line) > 3 else None
+            edges.append(Edge(line[0], line[1], int(line[2]), latency))
+    return edges
+
+
+def random_graph(n, degree=4, max_cost=10, seed=1):
+    '''A random connected graph: a random tree, then random links up to the mean degree
+
+    Return:
+        (list) Edge between the routers n0 to n<n-1>
+    '''
+    rng = random.Random(seed)
+    names = ['n%d' % i for i in range(n)]
+    pairs = set()
+    for i in range(1, n):
+        pairs.add((rng.randrange(i), i))
+    target = max(n - 1, min(n*degree//2, n*(n - 1)//2))
+    while len(pairs) < target:
+        i, j = rng.randrange(n), rng.randrange(n)
+        if i != j:
+            pairs.add((min(i, j), max(i, j)))
+    return [Edge(names[i], names[j], rng.randint(1, max_cost), None) for i, j in sorted(pairs)]
+
+
+def _edges(pairs, max_cost, rng):
+    return [Edge('n%d' % i, 'n%d' % j, rng.randint(1, max_cost), None) for i, j in pairs]
+
+
+def line(n, max_cost=10, seed=1):
+    '''n routers in a line, n0 to n<n-1>'''
+    return _edges([(i, i + 1) for i in range(n - 1)], max_cost, random.Random(seed))
+
+
+def ring(n, max_cost=10, seed=1):
+    '''n routers in a ring'''
+    return _edges([(i, i + 1) for i in range(n - 1)] + ([(0, n - 1)] if n > 2 else []), max_cost, random.Random(seed))
+
+
+def grid(rows, columns, max_cost=10, seed=1):
+    '''rows x columns routers, each linked to the next one of its row and of its column'''
+    pairs = []
+    for row in range(rows):
+        for column in range(columns):
+            i = row*columns + column
+            if column + 1 < columns:
+                pairs.append((i, i + 1))
+            if row + 1 < rows:
+                pairs.append((i, i + columns))
+    return _edges(pairs, max_cost, random.Random(seed))
+
+
+def scale_free(n, links=2, max_cost=10, seed=1):
+    '''n routers linked by preferential attachment (Barabasi-Albert): every new router links to
+       links routers already there, picked with a probability proportional to their degree
+    '''
+    rng = random.Random(seed)
+    pairs = []
+    ends = []                   # every router once per link it has
+    for i in range(1, min(links + 1, n)):
+        pairs.append((0, i))
+        ends.extend((0, i))
+    for i in range(links + 1, n):
+        targets = set()
+        while len(targets) < links:
+            targets.add(rng.choice(ends))
+        for j in sorted(targets):
+            pairs.append((j, i))
+            ends.extend((j, i))
+    return _edges(pairs, max_cost, rng)
+
+
+def shortest_paths(hosts, sources, infinity=INFINITY):
+    '''Dijkstra from some routers over the current links of the hosts. The links are symmetric,
+       so the distance from a source is also the distance to it.
+
+    Return:
+        (dict) { source : { router : cost } } of the routers closer than infinity
+    '''
+    distances = {}
+    for source in sources:
+        distance = {source : 0}
+        queue = [(0, source)]
+        while queue:
+            cost, router = heapq.heappop(queue)
+            if cost > distance[router]:
+                continue
+            for neighbor, link_cost in hosts[router].links.items():
+                new_cost = cost + link_cost
+                if new_cost < infinity and new_cost < distance.get(neighbor, infinity):
+                    distance[neighbor] = new_cost
+                    heapq.heappush(queue, (new_cost, neighbor))
+        distances[source] = distance
+    return distances
+
+
+class Simulation:
+    '''riplite routers connected by the links of a topology
+
+    Attr:
+        loop (SimLoop)
+        network (SimNetwork)
+        hosts (dict): { router : Host }
+        edges (list): Edge of the topology
+        infinity (int)
+        destinations (list): the routers advertised as destinations
+        quiet (float): seconds without any datagram after which the routers have converged
+    '''
+
+    def __init__(self, edges, latency=LATENCY, loss=0.0, seed=1, destinations=None, **options):
+        '''
+        Args:
+            edges (list): Edge of the topology
+            latency (float): seconds, of the links without their own
+            loss (float): probability that a datagram is lost
+            seed (int): of the losses and of the start times
+            destinations (iterable): the routers advertised as destinations, None for all
+            options: given to every Host (hold_down, infinity, horizon, route_hold, refresh)
+        '''
+        self.loop = SimLoop()
+        self.network = SimNetwork(self.loop, loss, seed)
+        self.random = random.Random(seed)
+        self.edges = list(edges)
+        self.infinity = options.get('infinity', INFINITY)
+        links = {}
+        max_latency = 0.0
+        for edge in self.edges:
+            links.setdefault(edge.a, {})[edge.b] = edge.cost
+            links.setdefault(edge.b, {})[edge.a] = edge.cost
+            edge_latency = edge.latency if edge.latency is not None else latency
+            max_latency = max(max_latency, edge_latency)
+            self.network.add_link(edge.a, edge.b, edge_latency)
+        self.destinations = sorted(destinations) if destinations is not None else sorted(links)
+        if destinations is not None:
+            destinations = set(destinations)
+        self.hosts = {}
+        for name in sorted(links):
+            host = Host(name, links=links[name], neighbor_ip=dict((neighbor, neighbor) for neighbor in links[name]),
+                        all_hosts=(), destinations=destinations, log_dir=None, **options)
+            host.loop = self.loop
+            host.transport = SimTransport(self.network, name)
+            self.hosts[name] = host
+            self.network.hosts[name] = host
+        self.quiet = (options.get('hold_down', HOLD_DOWN) + (options.get('route_hold', ROUTE_HOLD) or 0.0) +
+                      2*max_latency)
+
+
+    def start(self, jitter=0.0):
+        '''Start every router, at a random time within jitter seconds'''
+        for host in self.hosts.values():
+            self.loop.call_later(self.random.random()*jitter if jitter else 0.0, host.start)
+
+
+    def run(self, seconds):
+        self.loop.run(self.loop.time() + seconds)
+
+
+    def converge(self, timeout=600.0):
+        '''Run until no datagram was sent or received for quiet seconds and, with losses,
+           every table matches Dijkstra
+
+        Return:
+            (bool) False if the routers were still busy after timeout seconds
+        '''
+        deadline = self.loop.time() + timeout
+        network = self.network
+        checked = None                        # last_activity of the last quiet stretch checked
+        while True:
+            next_time = self.loop.next_time()
+            if network.in_flight == 0 and next_time > network.last_activity + self.quiet \
+                    and checked != network.last_activity:
+                if not network.loss or self.mismatches() == 0:
+                    return True
+                checked = network.last_activity   # wait for the refreshes to repair the lost updates
+            if next_time > deadline:
+                return False
+            self.loop.run_once()
+
+
+    def set_link(self, a, b, cost):
+        '''Change the cost of a link at both ends, as editing the cost files would.
+           At infinity the link fails and carries no datagram.
+        '''
+        if cost >= self.infinity:
+            self.network.down.update([(a, b), (b, a)])
+        else:
+            self.network.down.difference_update([(a, b), (b, a)])
+        self.hosts[a].set_link(b, cost)
+        self.hosts[b].set_link(a, cost)
+
+
+    def fail_link(self, a, b):
+        self.set_link(a, b, self.infinity)
+
+
+    def last_change(self):
+        '''Return the time of the last route change of any router, None if none changed'''
+        times = [host.last_change for host in self.hosts.values() if host.last_change is not None]
+        return max(times) if times else None
+
+
+    def mismatches(self, destinations=None):
+        '''Return the number of (router, destination) whose cost differs from Dijkstra
+
+        Args:
+            destinations (iterable): the destinations checked, None for the advertised ones
+        '''
+        infinity = self.infinity
+        destinations = self.destinations if destinations is None else list(destinations)
+        truth = shortest_paths(self.hosts, destinations, infinity)
+        count = 0
+        for name, host in self.hosts.items():
+            for dest in destinations:
+                if dest == name:
+                    continue
+                want = truth[dest].get(name, infinity)
+                if min(host.my_dv.cost(dest), infinity) != want:
+                    count += 1
+        return count
+
+
+    def tables(self):
+        '''Return { router : { destination : cost } } of the reachable destinations'''
+        return dict((name, dict((route.Dest, route.Cost) for route in host.my_dv if route.Cost < self.infinity))
+                    for name, host in self.hosts.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate riplite routers on a topology')
+    parser.add_argument('--edges', help='edge list, "router router cost [latency]" per line')
+    parser.add_argument('--random', type=int, help='routers of a random topology')
+    parser.add_argument('--degree', type=int, default=4, help='mean degree of the random topology')
+    parser.add_argument('--max-cost', type=int, default=10)
+    parser.add_argument('--destinations', type=int, help='advertise only this many routers, picked at random')
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds over which the routers start')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--hold-down', type=float, default=HOLD_DOWN)
+    parser.add_argument('--infinity', type=int, default=INFINITY)
+    parser.add_argument('--horizon', choices=[POISONED_REVERSE, SPLIT_HORIZON, 'none'], default=POISONED_REVERSE)
+    parser.add_argument('--timeout', type=float, default=600.0, help='simulated seconds')
+    args = parser.parse_args()
+    if (args.edges is None) == (args.random is None):
+        parser.error('give --edges or --random')
+
+    edges = read_edges(args.edges) if args.edges else random_graph(args.random, args.degree, args.max_cost, args.seed)
+    destinations = None
+    if args.destinations:
+        routers = sorted(set([edge.a for edge in edges] + [edge.b for edge in edges]))
+        destinations = random.Random(args.seed).sample(routers, min(args.destinations, len(routers)))
+
+    start = time.perf_counter()
+    simulation = Simulation(edges, args.latency, args.loss, args.seed, destinations, hold_down=args.hold_down,
+                            infinity=args.infinity, horizon=None if args.horizon == 'none' else args.horizon)
+    simulation.start(args.jitter)
+    converged = simulation.converge(args.timeout)
+    seconds = time.perf_counter() - start
+
+    network = simulation.network
+    print('{} routers, {} links{}'.format(len(simulation.hosts), len(edges),
+          ', {} destinations'.format(len(destinations)) if destinations is not None else ''))
+    print('{} after {:1.3f} simulated seconds'.format('Converged' if converged else 'NOT converged', simulation.last_change() or 0.0))
+    print('{} datagrams, {} bytes, {} lost, {} events in {:1.2f} s'.format(network.datagrams, network.bytes,
+          network.lost, simulation.loop.events, seconds))
@@ -0,0 +1,178 @@
+'''Binary wire format of the distance vectors.
+
+A datagram holds one or more frames. A frame is length-prefixed:
+
+    FRAME     length (uint32, whole frame), kind (uint8), sender name length (uint8),
+              bindings (uint16), entries (uint16)
+              the sender name, utf-8
+    BINDING   destination ID (uint16), name length (uint8), then the name, utf-8,  once per binding
+    ENTRY     destination ID (uint16), cost (uint32),                              once per entry
+
+Every route is a fixed-width ENTRY. A destination name is interned: the sender gives it a
+small ID the first time it advertises it, and binds the ID to the name in the first frame it
+sends to each neighbor with that ID. So a name crosses a link once, not in every
+advertisement. A destination the sender cannot reach has a cost of at least its infinity.
+
+A table too big for one datagram is split in several frames, each in its own datagram, so
+losing one datagram loses only its routes.
+'''
+
+import struct
+from collections import namedtuple
+
+
+# kinds of frame
+HELLO = 0    # the whole table of a router that just started, the neighbor answers with its own
+FULL  = 1    # the whole table
+DELTA = 2    # the routes that changed since the last advertisement to this neighbor
+KIND_NAMES = {HELLO : 'hello', FULL : 'full', DELTA : 'delta'}
+
+MAX_DATAGRAM = 1472    # bytes, the UDP payload of an Ethernet frame, so IP never fragments it
+MAX_ID = 0xffff
+
+FRAME   = struct.Struct('!IBBHH')
+BINDING = struct.Struct('!HB')
+ENTRY   = struct.Struct('!HI')
+
+Frame = namedtuple('Frame', ['sender', 'kind', 'bindings', 'entries'])
+
+
+class NameTable:
+    '''The IDs of the destination names of one router
+
+    Attr:
+        ids (dict): { name : ID }
+        names (list): the name of every ID
+    '''
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+
+    def intern(self, name):
+        '''Return the ID of a name, given the next one the first time'''
+        id = self.ids.get(name)
+        if id is None:
+            id = len(self.names)
+            if id > MAX_ID:
+                raise ValueError('more than {} destinations'.format(MAX_ID + 1))
+            self.ids[name] = id
+            self.names.append(name)
+        return id
+
+
+def encode(sender, kind, entries, names, bound=None, max_size=MAX_DATAGRAM):
+    '''Encode routes as frames of at most max_size bytes, one per datagram
+
+    Args:
+        sender (str): hostname of the sender
+        kind (int): HELLO, FULL or DELTA, a HELLO split in several frames is a HELLO then FULLs
+        entries (list): (destination, cost) of the routes
+        names (NameTable): the IDs of the sender
+        bound (set): the IDs the receiver knows, updated, None to bind every ID of every frame
+        max_size (int)
+
+    Return:
+        (list) the frames, as bytes
+    '''
+    sender = sender.encode()
+    header_size = FRAME.size + len(sender)
+    frames = []
+    size = header_size
+    bindings = 0
+    count = 0
+    binding_data = bytearray()
+    entry_data = bytearray()
+    for dest, cost in entries:
+        id = names.intern(dest)
+        name = None
+        if bound is None or id not in bound:
+            name = dest.encode()
+            need = ENTRY.size + BINDING.size + len(name)
+        else:
+            need = ENTRY.size
+        if size + need > max_size and count:
+            frames.append(_frame(sender, kind, bindings, count, binding_data, entry_data))
+            if kind == HELLO:
+                kind = FULL
+            size = header_size
+            bindings = count = 0
+            binding_data = bytearray()
+            entry_data = bytearray()
+        if name is not None:
+            binding_data += BINDING.pack(id, len(name)) + name
+            bindings += 1
+            if bound is not None:
+                bound.add(id)
+        entry_data += ENTRY.pack(id, cost)
+        count += 1
+        size += need
+    if count or not frames:
+        frames.append(_frame(sender, kind, bindings, count, binding_data, entry_data))
+    return frames
+
+
+def _frame(sender, kind, bindings, count, binding_data, entry_data):
+    length = FRAME.size + len(sender) + len(binding_data) + len(entry_data)
+    return FRAME.pack(length, kind, len(sender), bindings, count) + sender + bytes(binding_data) + bytes(entry_data)
+
+
+def decode_frame(view):
+    '''Decode one whole frame
+
+    Args:
+        view (memoryview): the frame, and nothing after it
+
+    Return:
+        (Frame) bindings is a list of (ID, name), entries a list of (ID, cost)
+    '''
+    length, kind, sender_length, bindings, count = FRAME.unpack_from(view, 0)
+    offset = FRAME.size
+    sender = bytes(view[offset:offset + sender_length]).decode()
+    offset += sender_length
+    names = []
+    for i in range(bindings):
+        id, name_length = BINDING.unpack_from(view, offset)
+        offset += BINDING.size
+        names.append((id, bytes(view[offset:offset + name_length]).decode()))
+        offset += name_length
+    end = offset + count*ENTRY.size
+    if end != length:
+        raise ValueError('frame of {} bytes holds {}'.format(length, end))
+    return Frame(sender, kind, names, list(ENTRY.iter_unpack(view[offset:end])))
+
+
+def decode(data):
+    '''Decode the frames of one datagram
+
+    Return:
+        (list) the Frames
+
+    Raise:
+        ValueError if the datagram ends inside a frame, struct.error if a frame is malformed
+    '''
+    view = memoryview(data)
+    frames, offset = _split(view)
+    if offset != len(view):
+        raise ValueError('truncated frame, {} bytes'.format(len(view) - offset))
+    return frames
+
+
+def _split(view):
+    '''Decode the whole frames at the start of a view
+
+    Return:
+        (tuple) (list of Frame, bytes they take)
+    '''
+    frames = []
+    offset = 0
+    while len(view) - offset >= FRAME.size:
+        length = FRAME.unpack_from(view, offset)[0]
+        if length < FRAME.size:
+            raise ValueError('frame of {} bytes'.format(length))
+        if len(view) - offset < length:
+            break
+        frames.append(decode_frame(view[offset:offset + length]))
+        offset += length
+    return frames, offset
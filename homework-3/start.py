@@ -52,12 +52,12 @@ def startNetwork():
     #for host in net.hosts:
      #   host.cmdPrint("ps aux")
 
-    net.get('h1').cmdPrint("python /home/riplite.py h1 &")
-    net.get('h2').cmdPrint("python /home/riplite.py h2 &")
-    net.get('r1').cmdPrint("python /home/riplite.py r1 &")
-    net.get('r2').cmdPrint("python /home/riplite.py r2 &")
-    net.get('r3').cmdPrint("python /home/riplite.py r3 &")
-    net.get('r4').cmdPrint("python /home/riplite.py r4 &")
+    net.get('h1').cmdPrint("python3 /home/riplite.py h1 --fib &")
+    net.get('h2').cmdPrint("python3 /home/riplite.py h2 --fib &")
+    net.get('r1').cmdPrint("python3 /home/riplite.py r1 --fib &")
+    net.get('r2').cmdPrint("python3 /home/riplite.py r2 --fib &")
+    net.get('r3').cmdPrint("python3 /home/riplite.py r3 --fib &")
+    net.get('r4').cmdPrint("python3 /home/riplite.py r4 --fib &")
 
     info('** Testing network connectivity\n')
     net.ping(net.hosts)